@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+"""This module provides rate limiting for transactions received by a miner.
+
+Every connection and every public key hash has a token bucket. A transaction
+is only accepted for verification if both of its buckets have a token left,
+so a single noisy node cannot fill the miner's transaction list and
+transactions over the limit are dropped before their digital signature is
+checked.
+
+Classes:
+    TokenBucket: A token bucket rate limiter.
+    AdmissionController: The token buckets for all connections and keys.
+"""
+import threading
+import clocks
+
+
+class TokenBucket:
+    """A token bucket that refills at a fixed rate up to a maximum burst.
+
+    Methods:
+        consume():
+            Take a token if one is available.
+        time_until_available():
+            Return the number of seconds until a token is available.
+    """
+    def __init__(self, rate, burst, clock=None):
+        self.rate = rate  # tokens per second
+        self.burst = burst
+        self.tokens = burst
+        self.clock = clock or clocks.SYSTEM_CLOCK
+        self.last_refill = self.clock.time()
+
+    def __refill(self):
+        """Add the tokens earned since the last refill"""
+        curr_time = self.clock.time()
+        self.tokens = min(self.burst, self.tokens +
+                          (curr_time - self.last_refill) * self.rate)
+        self.last_refill = curr_time
+
+    def consume(self):
+        """Take a token from the bucket. Return False if there are none left"""
+        self.__refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def time_until_available(self):
+        """Return how many seconds until the bucket has a token available"""
+        self.__refill()
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """Token buckets for the connections and public keys of a miner.
+
+    A rate of None turns off the limit for connections or for keys.
+
+    Methods:
+        admit_connection(conn_id):
+            Check the rate limit of a connection.
+        admit_key(key_hash):
+            Check the rate limit of a public key hash.
+        remove_connection(conn_id):
+            Forget the bucket of a closed connection.
+    """
+    def __init__(self, key_rate=1000, key_burst=2000, conn_rate=2000,
+                 conn_burst=4000, clock=None):
+        self.key_rate = key_rate
+        self.key_burst = key_burst
+        self.conn_rate = conn_rate
+        self.conn_burst = conn_burst
+        self.clock = clock
+        self.key_buckets = {}
+        self.conn_buckets = {}
+        # Connections from the same node share the bucket for its key
+        self.bucket_lock = threading.Lock()
+
+    def __admit(self, buckets, bucket_id, rate, burst):
+        """Take a token from a bucket, creating the bucket if needed.
+
+        Return a tuple of whether the token was taken and how many seconds
+        until the next token is available.
+        """
+        if rate is None:
+            return True, 0
+        bucket = buckets.get(bucket_id)
+        if bucket is None:
+            bucket = TokenBucket(rate, burst, self.clock)
+            buckets[bucket_id] = bucket
+        if bucket.consume():
+            return True, 0
+        return False, bucket.time_until_available()
+
+    def admit_connection(self, conn_id):
+        """Check if another transaction can be received on a connection"""
+        self.bucket_lock.acquire()
+        result = self.__admit(self.conn_buckets, conn_id, self.conn_rate,
+                              self.conn_burst)
+        self.bucket_lock.release()
+        return result
+
+    def admit_key(self, key_hash):
+        """Check if another transaction can be received from a public key"""
+        self.bucket_lock.acquire()
+        result = self.__admit(self.key_buckets, key_hash, self.key_rate,
+                              self.key_burst)
+        self.bucket_lock.release()
+        return result
+
+    def remove_connection(self, conn_id):
+        """Forget the bucket of a connection that has been closed"""
+        self.bucket_lock.acquire()
+        self.conn_buckets.pop(conn_id, None)
+        self.bucket_lock.release()
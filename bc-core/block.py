@@ -6,16 +6,26 @@ including block creation, traversal of the merkle tree of mined blocks,
 removal of transactions stored in mined blocks and verification of creator
 of transactions when a user sends remove or summarise transactions.
 
+Merkle trees of blocks created by this version hash every child of a node
+(MERKLE_VERSION 2), so a transaction's inclusion in a block can be proved
+with the sibling hashes on its path to the root (see proofs.py). Trees of
+blocks created before then only hashed the last child of a node. They are
+still read and cleaned as before, but no proofs can be made for them.
+
 Classes:
     Block: Represents blocks in a blockchain.
 """
 
 import hashlib
 import threading
-import time
 from Crypto.Cipher import AES
+import clocks
+import proofs
 import transaction
 
+# The version of the merkle tree hashing used for new blocks
+MERKLE_VERSION = 2
+
 
 class _TreeNode:
     """The class representing a node in the merkle tree for blocks.
@@ -25,14 +35,12 @@ class _TreeNode:
     """
     def __init__(self, children):
         self.children = children
-        for child in children:
-            # If the child is a transaction object, use the transaction id as data
-            if isinstance(child, transaction.Transaction):
-                self.data = child.tx_id
-            else:
-                hash_algo = hashlib.sha256()
-                hash_algo.update(child.data.encode('utf-8'))
-                self.data = hash_algo.hexdigest()
+        # If the child is a transaction object, use the transaction id as data
+        if isinstance(children[0], transaction.Transaction):
+            self.data = children[0].tx_id
+        else:
+            self.data = proofs.hash_children([child.data
+                                              for child in children])
 
     def has_children(self):
         """Check if the tree node has children"""
@@ -66,6 +74,9 @@ class _MerkleTree:
     handled in this class.
     """
     def __init__(self, txs):
+        # Trees unpickled from blocks stored before the version was set have
+        # no version attribute, and are version 1
+        self.version = MERKLE_VERSION
         if not txs:
             self.root = 'root'
             return
@@ -160,14 +171,55 @@ class _MerkleTree:
 
     def in_tree(self, tx_id):
         """Check if a transaction matching the given id exists in this tree"""
+        if self.root == 'root':
+            return False
         to_visit = [self.root]
         for node in to_visit:
             if node.has_children():
-                if node.child_is_tx() and node.get_tx_child().tx_id == tx_id:
-                    return True
-                to_visit.extend(node.children)
+                if node.child_is_tx():
+                    if node.get_tx_child().tx_id == tx_id:
+                        return True
+                else:
+                    to_visit.extend(node.children)
         return False
 
+    def get_proof(self, tx_id):
+        """Get the proof that a transaction is stored in this merkle tree.
+
+        Returns the (sibling hash, side) steps from the leaf of the
+        transaction to the root (see proofs.py), or None if the transaction
+        is not stored in this tree or the tree is too old to make proofs for.
+        Nodes pruned by clean_tree keep their hash, so proofs can still be
+        made for the transactions left in a cleaned tree.
+        """
+        if self.root == 'root' or getattr(self, 'version', 1) < 2:
+            return None
+        # The path from the root to every node visited
+        to_visit = [(self.root, [])]
+        for node, path in to_visit:
+            if not node.has_children():
+                continue
+            if node.child_is_tx():
+                if node.get_tx_child().tx_id == tx_id:
+                    return _MerkleTree.__path_to_proof(path)
+                continue
+            for child in node.children:
+                to_visit.append((child, path + [(node, child)]))
+        return None
+
+    @staticmethod
+    def __path_to_proof(path):
+        """Get the sibling hashes of the nodes on a path, from the leaf up"""
+        proof = []
+        for parent, child in reversed(path):
+            if len(parent.children) == 1:
+                proof.append((None, None))
+            elif parent.children[0] is child:
+                proof.append((parent.children[1].data, proofs.RIGHT))
+            else:
+                proof.append((parent.children[0].data, proofs.LEFT))
+        return proof
+
     def get_encoded(self, encoding):
         """Get the encoded data of the merkle tree root"""
         if self.root == 'root':
@@ -190,12 +242,16 @@ class _MerkleTree:
 
     def get_tx(self, tx_id):
         """Get a single transaction matching the id from this merkle tree"""
+        if self.root == 'root':
+            return None
         to_visit = [self.root]
         for node in to_visit:
             if node.has_children():
-                if node.child_is_tx() and node.get_tx_child().tx_id == tx_id:
-                    return node.get_tx_child()
-                to_visit.extend(node.children)
+                if node.child_is_tx():
+                    if node.get_tx_child().tx_id == tx_id:
+                        return node.get_tx_child()
+                else:
+                    to_visit.extend(node.children)
         # If the transaction does not exists, return None
         return None
 
@@ -289,6 +345,9 @@ class Block:
     manipulation of existing transactions on the blockchain will pass through
     block objects which then call the appropriate method in its merkle tree.
 
+    Blocks can hold any number of transactions. The miner creates partially
+    filled blocks when transactions have waited too long for a full block.
+
     Methods:
             set_prev_block(prev_blck_hash):
                 Set the previous block hash for this block.
@@ -300,6 +359,8 @@ class Block:
                 Remove the transactions with ids in the given list if they exist.
             get_tx(id):
                 Return the transaction with the given id if it exists in this block.
+            get_proof(id):
+                Return the merkle inclusion proof of a transaction in this block.
             check_usr_txs(user_txs):
                 Verify the generator verifiers from user_tx tuples.
             get_tx_ids():
@@ -307,7 +368,13 @@ class Block:
             get_block_txs():
                 Return the transactions stored in this block.
     """
-    def __init__(self, block_tx=None):
+    def __init__(self, block_tx=None, clock=None):
+        if block_tx:
+            # Copy the list so the merkle tree is not affected by later
+            # changes to the list given
+            block_tx = list(block_tx)
+        # The number of transactions the block was created with
+        self.tx_count = len(block_tx) if block_tx else 0
         self.root_hash_value = []
         self.merkle_tree = None
         root_hash_calc_thread = threading.Thread(target=self.__create_merkle_tree,
@@ -315,7 +382,8 @@ class Block:
         root_hash_calc_thread.start()
         self.prev_block_hash = "root"
         # From StackOverflow https://stackoverflow.com/a/5998359
-        self.timestamp = str(int(round(time.time() * 1000)))
+        self.timestamp = str(int(round((clock or clocks.SYSTEM_CLOCK).time()
+                                       * 1000)))
         self.block_hash = None
         root_hash_calc_thread.join()
 
@@ -350,6 +418,10 @@ class Block:
         """Return the transaction from the merkle tree matching the id (can return None)"""
         return self.merkle_tree.get_tx(tx_id)
 
+    def get_proof(self, tx_id):
+        """Return the merkle inclusion proof of a transaction (can return None)"""
+        return self.merkle_tree.get_proof(tx_id)
+
     def check_usr_txs(self, usr_txs):
         """Given a list of user tx tuples, verify the generator of the
                 transactions with transaction ids in the tuples."""
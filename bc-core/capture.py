@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+"""This module provides the capture of the traffic a miner receives.
+
+A capture records every public key sent by a node when it connects, every
+transaction frame received and every connection closing, with the time it
+was received and the connection it was received on. Frames are recorded as
+the pickled bytes received, before they are unpickled or verified, so a
+capture can be replayed (see replay.py) to give a miner exactly the same
+input again without creating or signing any transactions.
+
+Every record is a header packed with RECORD_HEADER followed by its payload:
+    time: The seconds since the first record (a double).
+    connection: The number of the connection, counted from 0.
+    kind: KEY, FRAME or CLOSE.
+    size: The number of bytes in the payload.
+
+Classes:
+    Recorder: Writes the records of a capture to a file.
+
+Methods:
+    read_records(path):
+        Iterate over the records of a capture file.
+"""
+import struct
+import threading
+import time
+
+RECORD_HEADER = struct.Struct('>dIBI')
+# The kinds of record. KEY records hold the public key a node sent when it
+# connected, FRAME records the pickled bytes of a frame it sent and CLOSE
+# records have no payload.
+KEY = 0
+FRAME = 1
+CLOSE = 2
+
+
+class Recorder:
+    """Writes the traffic received on connections to a capture file.
+
+    If no path is given nothing is recorded.
+
+    Methods:
+        record_key(conn, key):
+            Record the public key a node sent when it connected.
+        record_frame(conn, data):
+            Record the pickled bytes of a frame.
+        record_close(conn):
+            Record a connection closing.
+        close():
+            Close the capture file.
+    """
+    def __init__(self, path=None):
+        self.capture_file = open(path, 'wb') if path else None
+        self.start_time = None
+        # The number of every open connection recorded. Connections are
+        # numbered in the order they were first recorded.
+        self.conn_ids = {}
+        self.num_conns = 0
+        self.write_lock = threading.Lock()
+
+    def record_key(self, conn, key):
+        """Record the public key a node sent when it connected"""
+        self.__write(conn, KEY, key)
+
+    def record_frame(self, conn, data):
+        """Record the pickled bytes of a frame received on a connection"""
+        self.__write(conn, FRAME, data)
+
+    def record_close(self, conn):
+        """Record that a connection was closed"""
+        self.__write(conn, CLOSE, b'')
+        self.write_lock.acquire()
+        self.conn_ids.pop(conn, None)
+        self.write_lock.release()
+
+    def __write(self, conn, kind, payload):
+        """Write a record, numbering the connection if it is new"""
+        if not self.capture_file:
+            return
+        received_time = time.time()
+        self.write_lock.acquire()
+        if self.capture_file:
+            if self.start_time is None:
+                self.start_time = received_time
+            if conn not in self.conn_ids:
+                self.conn_ids[conn] = self.num_conns
+                self.num_conns += 1
+            header = RECORD_HEADER.pack(received_time - self.start_time,
+                                        self.conn_ids[conn], kind,
+                                        len(payload))
+            self.capture_file.write(header + payload)
+            # Flush every record so that nothing is lost if the miner is
+            # killed
+            self.capture_file.flush()
+        self.write_lock.release()
+
+    def close(self):
+        """Flush and close the capture file"""
+        self.write_lock.acquire()
+        if self.capture_file:
+            self.capture_file.close()
+            self.capture_file = None
+        self.write_lock.release()
+
+
+def read_records(path):
+    """Iterate over the (time, connection, kind, payload) records of a file"""
+    with open(path, 'rb') as capture_file:
+        while True:
+            header = capture_file.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # The end of the file, or a record cut short by the miner
+                # being killed while writing it
+                return
+            record_time, conn_id, kind, size = RECORD_HEADER.unpack(header)
+            payload = capture_file.read(size)
+            if len(payload) < size:
+                return
+            yield record_time, conn_id, kind, payload
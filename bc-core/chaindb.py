@@ -0,0 +1,431 @@
+#!/usr/bin/python3
+"""This module describes how the blockchain is laid out in the database.
+
+Blocks are stored with their hex block hash as the key. The hash of the last
+block created and the number of blocks is stored under the 'last' key. All
+other records (such as the public keys of nodes) are stored under keys that
+start with a prefix ending in ':', which can never be part of a block hash.
+The hash of the block at every height (the number of blocks before it) is
+stored under a height key, so blocks can be read in the order they were
+created.
+
+Databases can also have secondary indexes, which are kept up to date by the
+miner once INDEXED_KEY has been written:
+    pk:<public key hash>:<block timestamp>:<tx id> -> block hash
+        The transactions sent by every public key, in the order they were
+        mined (by id within a block). Entries are deleted when their
+        transaction is removed.
+    ts:<block timestamp>:<block hash> -> height
+        Every block in the order of the time it was created.
+    tx:<tx id> -> block hash
+        The block every transaction that has not been removed is stored in.
+
+Blocks can be stored compressed. A compressed block starts with the byte
+of its codec (see CODECS), and a block stored without a codec is its pickle,
+which always starts with PICKLE_START, so blocks stored before compression
+was added are still read. Blocks stored with the zlib-dict codec are
+compressed with a shared zlib dictionary stored under dict:<id>, and have
+the id after the codec byte. The id of the dictionary new blocks are
+compressed with is stored under DICT_KEY.
+
+The public key hash of every node is given a small integer id when it is
+first seen, stored under idk:<key hash> with the hash under idr:<id>. Blocks
+are pickled with pickle_block, which writes the ids of known key hashes
+instead of the hashes, and decode_block looks them up again. Blocks pickled
+before then have the hashes in them and are read the same way. Always read
+blocks with decode_block.
+
+The functions that read the database also accept a snapshot of it.
+
+Methods:
+    is_block_key(key):
+        Check if a database key is the hash of a block
+    iter_blocks(db):
+        Iterate over the block hashes and stored blocks in the database
+    encode_block(pickled_block, codec, dictionary):
+        Compress a pickled block to store it
+    decode_block(data, db):
+        Decompress and unpickle a stored block
+    unpack_block(data, db):
+        Decompress a stored block to its pickle
+    dictionary_id(dictionary):
+        Get the id a dictionary is stored under
+    train_dictionary(samples, size):
+        Build a shared zlib dictionary from pickled blocks
+    pickle_block(block, key_ids):
+        Pickle a block with the ids of its public key hashes
+    identity_key(key_id):
+        Get the key the public key hash with an id is stored under
+    load_identities(db):
+        Get the ids of every public key hash
+    put_identity(batch, key_hash, key_id):
+        Store the id of a public key hash
+    put_dictionary(batch, dictionary):
+        Store a dictionary and make it the one new blocks use
+    get_dictionary(db):
+        Get the dictionary new blocks are compressed with
+    height_key(height):
+        Get the key the hash of the block at a height is stored under
+    get_last(db):
+        Get the hash and height of the last block created
+    iter_heights(db, start, stop):
+        Iterate over the heights and hashes of blocks in height order
+    index_heights(db):
+        Write the height keys of a database created without them
+    index_block(batch, block, height):
+        Write the secondary index entries of a block
+    unindex_txs(batch, block, txs):
+        Delete the secondary index entries of transactions removed from a block
+    build_indexes(db):
+        Write the secondary indexes of every block in a database
+    iter_key_txs(db, key_hash, after):
+        Iterate over the transactions sent by a public key in mined order
+    iter_time_blocks(db, start_time, stop_time, after):
+        Iterate over the blocks created in a time range
+"""
+import collections
+import hashlib
+import io
+import lzma
+import pickle
+import zlib
+
+DB_PATH = "/home/ben/mof-bc"
+LAST_KEY = b'last'
+# Public keys of nodes, stored under their SHA256 hash
+KEY_PREFIX = b'key:'
+# Block hashes, stored under the height of the block padded to HEIGHT_DIGITS
+# digits so that the keys sort in height order
+HEIGHT_PREFIX = b'h:'
+HEIGHT_DIGITS = 12
+# The first key after every height key
+_HEIGHT_END = b'h;'
+# Secondary indexes (see above). Timestamps in keys are padded to
+# TIME_DIGITS digits so that the keys sort in time order.
+PUB_KEY_TX_PREFIX = b'pk:'
+TIME_PREFIX = b'ts:'
+TX_PREFIX = b'tx:'
+TIME_DIGITS = 15
+# Written once the secondary indexes of every block have been written
+INDEXED_KEY = b'index:secondary'
+# The first byte of every pickle, which is never the byte of a codec
+PICKLE_START = 0x80
+# The byte at the start of blocks stored with each codec. Blocks stored with
+# the 'raw' codec are not compressed and have no codec byte.
+CODECS = {'raw': None, 'zlib': 1, 'lzma': 2, 'zlib-dict': 3}
+DICT_PREFIX = b'dict:'
+DICT_KEY = b'codec:dict'
+# The number of bytes of a dictionary id
+DICT_ID_SIZE = 8
+# Dictionaries are never changed once stored and their ids are hashes of
+# their contents, so they are cached by id for every database
+_dictionaries = {}
+# Public key hashes by id and ids by public key hash
+IDENTITY_ID_PREFIX = b'idr:'
+IDENTITY_PREFIX = b'idk:'
+# The length of a (hex) public key hash
+KEY_HASH_SIZE = 64
+
+
+def is_block_key(key):
+    """Check if a key in the database is the hash of a block"""
+    return key != LAST_KEY and b':' not in key
+
+
+def iter_blocks(db):
+    """Iterate over (block hash, stored block) tuples of all stored blocks"""
+    with db.iterator() as it:
+        for block_hash, pickled_block in it:
+            if is_block_key(block_hash):
+                yield block_hash, pickled_block
+
+
+def encode_block(pickled_block, codec='raw', dictionary=None):
+    """Compress a pickled block with a codec to store it.
+
+    The dictionary is needed for the zlib-dict codec.
+    """
+    if codec == 'raw':
+        return pickled_block
+    if codec == 'zlib':
+        return bytes([CODECS['zlib']]) + zlib.compress(pickled_block)
+    if codec == 'lzma':
+        return bytes([CODECS['lzma']]) + lzma.compress(pickled_block)
+    if codec == 'zlib-dict':
+        compressor = zlib.compressobj(zdict=dictionary)
+        return bytes([CODECS['zlib-dict']]) + dictionary_id(dictionary) + \
+            compressor.compress(pickled_block) + compressor.flush()
+    raise ValueError("unknown codec {}".format(codec))
+
+
+def unpack_block(data, db=None):
+    """Decompress a stored block to its pickle.
+
+    The database (or a mapping of dictionary keys to dictionaries) is needed
+    to read the dictionary of blocks stored with the zlib-dict codec.
+    """
+    codec = data[0]
+    if codec == PICKLE_START:
+        return data
+    if codec == CODECS['zlib']:
+        return zlib.decompress(data[1:])
+    if codec == CODECS['lzma']:
+        return lzma.decompress(data[1:])
+    if codec == CODECS['zlib-dict']:
+        dict_id = data[1:1 + DICT_ID_SIZE]
+        dictionary = _dictionaries.get(dict_id)
+        if dictionary is None:
+            dictionary = db.get(DICT_PREFIX + dict_id) if db is not None \
+                else None
+            if dictionary is None:
+                raise ValueError("missing dictionary {}".format(dict_id.hex()))
+            _dictionaries[dict_id] = dictionary
+        decompressor = zlib.decompressobj(zdict=dictionary)
+        return decompressor.decompress(data[1 + DICT_ID_SIZE:]) + \
+            decompressor.flush()
+    raise ValueError("unknown codec byte {}".format(codec))
+
+
+class _BlockPickler(pickle.Pickler):
+    """Pickles blocks with the ids of public key hashes instead of them"""
+    def __init__(self, block_file, key_ids):
+        super().__init__(block_file)
+        self.key_ids = key_ids
+
+    def persistent_id(self, obj):
+        """Get the id of a public key hash (None for every other object)"""
+        if type(obj) is bytes and len(obj) == KEY_HASH_SIZE:
+            return self.key_ids.get(obj)
+        return None
+
+
+class _BlockUnpickler(pickle.Unpickler):
+    """Unpickles blocks, looking up the public key hashes of ids"""
+    def __init__(self, block_file, db):
+        super().__init__(block_file)
+        self.db = db
+        # Every transaction of a node in the block shares one hash object
+        self.key_hashes = {}
+
+    def persistent_load(self, pid):
+        """Get the public key hash with an id"""
+        key_hash = self.key_hashes.get(pid)
+        if key_hash is None:
+            key_hash = self.db.get(identity_key(pid)) if self.db is not None \
+                else None
+            if key_hash is None:
+                raise pickle.UnpicklingError("unknown key id {}".format(pid))
+            self.key_hashes[pid] = key_hash
+        return key_hash
+
+
+def pickle_block(block, key_ids):
+    """Pickle a block, writing the ids of the key hashes in key_ids"""
+    block_file = io.BytesIO()
+    _BlockPickler(block_file, key_ids).dump(block)
+    return block_file.getvalue()
+
+
+def decode_block(data, db=None):
+    """Decompress and unpickle a stored block (see unpack_block).
+
+    The database (or a mapping of keys to records) is needed to look up the
+    public key hashes of blocks pickled with their ids.
+    """
+    return _BlockUnpickler(io.BytesIO(unpack_block(data, db)), db).load()
+
+
+def identity_key(key_id):
+    """Get the key the public key hash with an id is stored under"""
+    return IDENTITY_ID_PREFIX + str(key_id).encode('utf-8')
+
+
+def load_identities(db):
+    """Get a dictionary of the id of every public key hash stored"""
+    with db.iterator(prefix=IDENTITY_PREFIX) as it:
+        return {key[len(IDENTITY_PREFIX):]: int(key_id) for key, key_id in it}
+
+
+def put_identity(batch, key_hash, key_id):
+    """Store the id of a public key hash and the hash under the id"""
+    batch.put(IDENTITY_PREFIX + key_hash, str(key_id).encode('utf-8'))
+    batch.put(identity_key(key_id), key_hash)
+
+
+def dictionary_id(dictionary):
+    """Get the id of a dictionary, the start of the hash of its contents"""
+    return hashlib.sha256(dictionary).digest()[:DICT_ID_SIZE]
+
+
+def train_dictionary(samples, size=32 * 1024, segment_size=32):
+    """Build a shared zlib dictionary from samples of pickled blocks.
+
+    The dictionary is made of the segments of segment_size bytes that are
+    in the most samples (e.g. the pickled class and attribute names and the
+    public key hashes of busy nodes). zlib finds matches at the end of a
+    dictionary with the fewest bits, so the most common segments are put
+    last.
+    """
+    step = max(1, segment_size // 8)
+    counts = collections.Counter()
+    for sample in samples:
+        counts.update(set(sample[i:i + segment_size] for i
+                          in range(0, len(sample) - segment_size + 1, step)))
+    chosen = []
+    used = 0
+    for segment, count in counts.most_common():
+        if count < 2 or used + segment_size > size:
+            break
+        chosen.append(segment)
+        used += segment_size
+    return b''.join(reversed(chosen))
+
+
+def put_dictionary(batch, dictionary):
+    """Store a dictionary and make it the one new blocks are compressed with"""
+    dict_id = dictionary_id(dictionary)
+    batch.put(DICT_PREFIX + dict_id, dictionary)
+    batch.put(DICT_KEY, dict_id)
+    _dictionaries[dict_id] = dictionary
+
+
+def get_dictionary(db):
+    """Get the dictionary new blocks are compressed with (None if not set)"""
+    dict_id = db.get(DICT_KEY)
+    if dict_id is None:
+        return None
+    return db.get(DICT_PREFIX + dict_id)
+
+
+def height_key(height):
+    """Get the key the hash of the block at a height is stored under"""
+    return HEIGHT_PREFIX + str(height).zfill(HEIGHT_DIGITS).encode('utf-8')
+
+
+def get_last(db):
+    """Get the (block hash, height) of the last block (None if empty)"""
+    last = db.get(LAST_KEY)
+    if last is None:
+        return None
+    return pickle.loads(last)
+
+
+def iter_heights(db, start=0, stop=None):
+    """Iterate over (height, block hash) tuples from start up to stop"""
+    stop_key = height_key(stop) if stop is not None else _HEIGHT_END
+    with db.iterator(start=height_key(start), stop=stop_key) as it:
+        for key, block_hash in it:
+            yield int(key[len(HEIGHT_PREFIX):]), block_hash
+
+
+def index_heights(db):
+    """Write the height key of every block in a database without them.
+
+    The chain is followed back from the last block to the genesis block.
+    Returns the number of height keys written.
+    """
+    last = get_last(db)
+    if last is None:
+        return 0
+    block_hash, height = last
+    written = 0
+    with db.write_batch() as batch:
+        while height >= 0:
+            batch.put(height_key(height), block_hash)
+            written += 1
+            prev_hash = decode_block(db.get(block_hash), db).prev_block_hash
+            if prev_hash == 'root':
+                break
+            block_hash = prev_hash.encode('utf-8')
+            height -= 1
+    return written
+
+
+def _time_part(timestamp):
+    """Get a block timestamp (milliseconds) as it is written in keys"""
+    return str(timestamp).zfill(TIME_DIGITS).encode('utf-8')
+
+
+def _pub_key_tx_key(block, tx):
+    """Get the key of a transaction in the public key index"""
+    return PUB_KEY_TX_PREFIX + tx.pub_key + b':' + \
+        _time_part(block.timestamp) + b':' + tx.tx_id.encode('utf-8')
+
+
+def index_block(batch, block, height):
+    """Write the secondary index entries of a block to a write batch"""
+    block_hash = block.block_hash.encode('utf-8')
+    batch.put(TIME_PREFIX + _time_part(block.timestamp) + b':' + block_hash,
+              str(height).encode('utf-8'))
+    if block.merkle_tree.root == 'root':
+        return
+    for tx in block.get_block_txs():
+        batch.put(_pub_key_tx_key(block, tx), block_hash)
+        batch.put(TX_PREFIX + tx.tx_id.encode('utf-8'), block_hash)
+
+
+def unindex_txs(batch, block, txs):
+    """Delete the index entries of transactions removed from a block"""
+    for tx in txs:
+        batch.delete(_pub_key_tx_key(block, tx))
+        batch.delete(TX_PREFIX + tx.tx_id.encode('utf-8'))
+
+
+def build_indexes(db):
+    """Write the secondary indexes of every block and INDEXED_KEY.
+
+    The height keys must have been written first. Returns the number of
+    blocks indexed.
+    """
+    indexed = 0
+    with db.write_batch() as batch:
+        for height, block_hash in iter_heights(db):
+            index_block(batch, decode_block(db.get(block_hash), db), height)
+            indexed += 1
+        batch.put(INDEXED_KEY, b'1')
+    return indexed
+
+
+def _iter_index(db, prefix, start, after):
+    """Iterate over the (key, value) entries of an index from a start key.
+
+    If after is given, iteration starts after that key instead. Raises a
+    ValueError if after is not a key of the index at or after start, so a
+    cursor cannot be used to read entries outside the range asked for.
+    """
+    stop = prefix[:-1] + bytes([prefix[-1] + 1])
+    if after is not None:
+        if not after.startswith(prefix) or after < start:
+            raise ValueError("cursor {} is outside the range queried".format(
+                after.decode('utf-8', 'replace')))
+        start = after
+    with db.iterator(start=start, stop=stop,
+                     include_start=after is None) as it:
+        for key, value in it:
+            yield key, value
+
+
+def iter_key_txs(db, key_hash, after=None):
+    """Iterate over the transactions sent by a public key hash.
+
+    Yields (index key, tx id, block hash) tuples in the order the
+    transactions were mined, starting after the index key 'after' if given.
+    """
+    prefix = PUB_KEY_TX_PREFIX + key_hash + b':'
+    for key, block_hash in _iter_index(db, prefix, prefix, after):
+        yield key, key.rsplit(b':', 1)[1].decode('utf-8'), block_hash
+
+
+def iter_time_blocks(db, start_time=0, stop_time=None, after=None):
+    """Iterate over the blocks created from start_time up to stop_time.
+
+    Times are block timestamps in milliseconds. Yields (index key, block hash,
+    height) tuples in time order, starting after the index key 'after' if
+    given.
+    """
+    start = TIME_PREFIX + _time_part(start_time)
+    for key, height in _iter_index(db, TIME_PREFIX, start, after):
+        timestamp = int(key[len(TIME_PREFIX):len(TIME_PREFIX) + TIME_DIGITS])
+        if stop_time is not None and timestamp >= stop_time:
+            return
+        yield key, key.rsplit(b':', 1)[1], int(height)
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+"""This module provides the export and import of whole blockchains.
+
+A chain file holds the blocks of a database in height order and the public
+keys of its nodes, so a chain can be moved to another machine or used to
+seed a benchmark database without copying the LevelDB directory. Nothing is
+unpickled when a chain is exported or imported (unless the secondary indexes
+are rebuilt).
+
+A chain file starts with MAGIC and is followed by records. Every record is a
+header packed with RECORD_HEADER followed by its key and value:
+    kind: KEY, IDENTITY, DICTIONARY, BLOCK or END.
+    height: The height of a block (the number of blocks for END, and for a
+            DICTIONARY 1 if it is the one new blocks are compressed with).
+    key size: The number of bytes in the key.
+    value size: The number of bytes in the value.
+KEY records hold a public key under its hash, IDENTITY records the id of a
+public key hash under the hash, DICTIONARY records a block
+compression dictionary under its id (see chaindb) and BLOCK records a stored
+block under its hash. Blocks are written as stored, compressed or not, and
+the identities and dictionaries they need come before them. The END record is the last record of a complete file, so a
+file cut short is not imported as a shorter chain.
+
+The whole file can be compressed with gzip or lzma, which is detected when
+it is read.
+
+Methods:
+    export_chain(db, path, compression):
+        Write the keys and blocks of a database to a chain file
+    import_chain(db, path, batch_bytes, indexes):
+        Load a chain file into an empty database
+    open_chain_file(path):
+        Open a chain file for reading, decompressing it if needed
+"""
+import gzip
+import lzma
+import pickle
+import struct
+import chaindb
+
+MAGIC = b'BCCHAIN1'
+RECORD_HEADER = struct.Struct('>BQHI')
+KEY = 0
+BLOCK = 1
+END = 2
+DICTIONARY = 3
+IDENTITY = 4
+# The openers of every compression, and the first bytes of their files
+COMPRESSIONS = {'none': open, 'gzip': gzip.open, 'lzma': lzma.open}
+_COMPRESSED_MAGIC = ((b'\x1f\x8b', gzip.open),
+                     (b'\xfd7zXZ\x00', lzma.open))
+
+
+def _write_record(chain_file, kind, height, key, value):
+    """Write a record to a chain file"""
+    chain_file.write(RECORD_HEADER.pack(kind, height, len(key), len(value)))
+    chain_file.write(key)
+    chain_file.write(value)
+
+
+def export_chain(db, path, compression='none'):
+    """Write the public keys and blocks of a database to a chain file.
+
+    Blocks are read in height order one at a time, so the memory used does
+    not depend on the size of the chain. Returns the number of blocks and
+    keys written.
+    """
+    last = chaindb.get_last(db)
+    if last is not None and db.get(chaindb.height_key(last[1])) is None:
+        raise ValueError("The database has no height keys, open it with the "
+                         "miner once to write them")
+    num_blocks = 0
+    num_keys = 0
+    with COMPRESSIONS[compression](path, 'wb') as chain_file:
+        chain_file.write(MAGIC)
+        with db.iterator(prefix=chaindb.KEY_PREFIX) as it:
+            for key, pub_key in it:
+                _write_record(chain_file, KEY, 0,
+                              key[len(chaindb.KEY_PREFIX):], pub_key)
+                num_keys += 1
+        with db.iterator(prefix=chaindb.IDENTITY_PREFIX) as it:
+            for key, key_id in it:
+                _write_record(chain_file, IDENTITY, 0,
+                              key[len(chaindb.IDENTITY_PREFIX):], key_id)
+        current_dict_id = db.get(chaindb.DICT_KEY)
+        with db.iterator(prefix=chaindb.DICT_PREFIX) as it:
+            for key, dictionary in it:
+                dict_id = key[len(chaindb.DICT_PREFIX):]
+                _write_record(chain_file, DICTIONARY,
+                              int(dict_id == current_dict_id), dict_id,
+                              dictionary)
+        for height, block_hash in chaindb.iter_heights(db):
+            _write_record(chain_file, BLOCK, height, block_hash,
+                          db.get(block_hash))
+            num_blocks += 1
+        _write_record(chain_file, END, num_blocks, b'', b'')
+    return num_blocks, num_keys
+
+
+def open_chain_file(path):
+    """Open a chain file for reading, decompressing it if it is compressed"""
+    with open(path, 'rb') as chain_file:
+        start = chain_file.read(len(MAGIC))
+    opener = open
+    for magic, compressed_opener in _COMPRESSED_MAGIC:
+        if start.startswith(magic):
+            opener = compressed_opener
+    chain_file = opener(path, 'rb')
+    if chain_file.read(len(MAGIC)) != MAGIC:
+        chain_file.close()
+        raise ValueError("{} is not a chain file".format(path))
+    return chain_file
+
+
+def _read_exact(chain_file, size):
+    """Read a number of bytes, raising an error if the file ends first"""
+    data = chain_file.read(size)
+    if len(data) < size:
+        raise ValueError("The chain file ends in the middle of a record")
+    return data
+
+
+def import_chain(db, path, batch_bytes=64 * 1024 * 1024, indexes=False):
+    """Load the keys and blocks of a chain file into an empty database.
+
+    Records are written in write batches of about batch_bytes bytes, along
+    with the height keys of the blocks and, if indexes is set, their
+    secondary indexes (see chaindb). The last record is written once every
+    block has been, so a database that was not fully imported is not opened
+    by the miner as a shorter chain. Returns the number of blocks and keys
+    imported.
+    """
+    if chaindb.get_last(db) is not None:
+        raise ValueError("The database already has a chain")
+    num_blocks = 0
+    num_keys = 0
+    last = None
+    complete = False
+    # The dictionaries and identities of blocks, to decode them to be indexed
+    records = {}
+    with open_chain_file(path) as chain_file:
+        while not complete:
+            batch_size = 0
+            with db.write_batch() as batch:
+                while batch_size < batch_bytes:
+                    header = _read_exact(chain_file, RECORD_HEADER.size)
+                    kind, height, key_size, value_size = \
+                        RECORD_HEADER.unpack(header)
+                    key = _read_exact(chain_file, key_size)
+                    value = _read_exact(chain_file, value_size)
+                    batch_size += RECORD_HEADER.size + key_size + value_size
+                    if kind == KEY:
+                        batch.put(chaindb.KEY_PREFIX + key, value)
+                        num_keys += 1
+                    elif kind == IDENTITY:
+                        chaindb.put_identity(batch, key, int(value))
+                        records[chaindb.identity_key(int(value))] = key
+                    elif kind == DICTIONARY:
+                        batch.put(chaindb.DICT_PREFIX + key, value)
+                        records[chaindb.DICT_PREFIX + key] = value
+                        if height:
+                            batch.put(chaindb.DICT_KEY, key)
+                    elif kind == BLOCK:
+                        if height != num_blocks:
+                            raise ValueError("Block {} is out of order".format(
+                                height))
+                        batch.put(key, value)
+                        batch.put(chaindb.height_key(height), key)
+                        if indexes:
+                            loaded_block = chaindb.decode_block(value,
+                                                                records)
+                            chaindb.index_block(batch, loaded_block, height)
+                        last = (key, height)
+                        num_blocks += 1
+                    elif kind == END:
+                        if height != num_blocks:
+                            raise ValueError("The chain file has {} blocks, "
+                                             "not {}".format(num_blocks,
+                                                             height))
+                        complete = True
+                        break
+                    else:
+                        raise ValueError("Unknown record kind {}".format(kind))
+    with db.write_batch() as batch:
+        if indexes:
+            batch.put(chaindb.INDEXED_KEY, b'1')
+        if last is not None:
+            batch.put(chaindb.LAST_KEY, pickle.dumps(last))
+    return num_blocks, num_keys
@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+"""This module provides the controller that picks the miner cleaning interval.
+
+Every cleaning period the miner reports the work it did (blocks read, blocks
+written, bytes rewritten, transactions affected and time spent in each phase)
+and the backlog of work still waiting. From these measurements the controller
+picks the next cleaning interval so that cleaning stays within a target share
+of the miner's time while expired data is never kept longer than a maximum
+retention lag.
+
+Classes:
+    IntervalController: Measures cleaning periods and chooses the interval
+                        until the next one.
+"""
+import collections
+import threading
+import clocks
+
+
+class IntervalController:
+    """Chooses the next cleaning interval from measured cleaning cost.
+
+    The cost of a period is the time spent in its phases. If a period costs c
+    seconds and the miner should spend at most a fraction b of its time
+    cleaning, the next period can start no sooner than c / b seconds after
+    this one. Expired transactions can wait for a whole interval plus the
+    cleaning period that removes them, so the interval is also bounded by the
+    maximum retention lag. The cost used is the larger of the smoothed cost of
+    past periods and the predicted cost of the backlog left for the next one.
+
+    Every decision is kept (up to a history limit) so it can be inspected.
+
+    Methods:
+        start_period():
+            Mark the start of a cleaning period.
+        in_period():
+            Check if a cleaning period is currently running.
+        add_phase_time(name, elapsed):
+            Add the time spent in a phase to the current period.
+        add_work(blocks_read, blocks_written, bytes_written, txs):
+            Add work done by a phase to the current period.
+        end_period(backlog, cap_interval):
+            Finish the current period and return the next cleaning interval.
+        get_decisions():
+            Return the most recent interval decisions, oldest first.
+    """
+    def __init__(self, initial_interval=20, budget=0.2, max_retention_lag=300,
+                 min_interval=1, smoothing=0.5, history=100, clock=None):
+        self.interval = initial_interval
+        # The fraction of time the miner may spend in cleaning periods
+        self.budget = budget
+        # The longest time (in seconds) expired data may stay on the blockchain
+        self.max_retention_lag = max_retention_lag
+        self.min_interval = min_interval
+        # Weight given to the latest period in the smoothed cost
+        self.smoothing = smoothing
+        self.smoothed_cost = None
+        self.cost_per_tx = 0
+        self.period_start = None
+        self.period = None
+        self.decisions = collections.deque(maxlen=history)
+        # Periods are scheduled on the miner's clock but their cost is the
+        # real time spent in their phases (see tracing.py)
+        self.clock = clock or clocks.SYSTEM_CLOCK
+        # Phases run in their own threads so the period record is locked
+        self.period_lock = threading.Lock()
+
+    def start_period(self):
+        """Start recording a new cleaning period"""
+        self.period_lock.acquire()
+        self.period_start = self.clock.time()
+        self.period = {'blocks_read': 0, 'blocks_written': 0,
+                       'bytes_written': 0, 'txs': 0, 'phases': {}}
+        self.period_lock.release()
+
+    def in_period(self):
+        """Check if a cleaning period has been started and not yet ended"""
+        return self.period is not None
+
+    def add_work(self, blocks_read=0, blocks_written=0, bytes_written=0,
+                 txs=0):
+        """Add the work done by a phase to the current period"""
+        self.period_lock.acquire()
+        if self.period is not None:
+            self.period['blocks_read'] += blocks_read
+            self.period['blocks_written'] += blocks_written
+            self.period['bytes_written'] += bytes_written
+            self.period['txs'] += txs
+        self.period_lock.release()
+
+    def add_phase_time(self, name, elapsed):
+        """Add the time spent in a phase to the current period"""
+        self.period_lock.acquire()
+        if self.period is not None:
+            phases = self.period['phases']
+            phases[name] = phases.get(name, 0) + elapsed
+        self.period_lock.release()
+
+    def end_period(self, backlog=0, cap_interval=None):
+        """Finish the current cleaning period and choose the next interval.
+
+        Arguments:
+            backlog: The number of transactions still waiting to be cleaned.
+            cap_interval: An upper bound on the interval, used by the miner
+                          once the block cap has been reached.
+        """
+        self.period_lock.acquire()
+        period = self.period
+        self.period = None
+        self.period_lock.release()
+        if period is None:
+            return self.interval
+        duration = self.clock.time() - self.period_start
+        cost = sum(period['phases'].values())
+        if self.smoothed_cost is None:
+            self.smoothed_cost = cost
+        else:
+            self.smoothed_cost = self.smoothing * cost + \
+                (1 - self.smoothing) * self.smoothed_cost
+        if period['txs']:
+            self.cost_per_tx = cost / period['txs']
+        # The backlog will be cleaned next period so estimate its cost from
+        # the cost per transaction of this period
+        predicted_cost = max(self.smoothed_cost, self.cost_per_tx * backlog)
+        interval = predicted_cost / self.budget
+        reason = 'budget'
+        # Expired data waits for the interval and the period that cleans it
+        max_interval = self.max_retention_lag - duration
+        if cap_interval is not None and cap_interval < max_interval:
+            max_interval = cap_interval
+            if interval > max_interval:
+                reason = 'cap'
+        elif interval > max_interval:
+            reason = 'retention_lag'
+        interval = min(interval, max_interval)
+        if interval < self.min_interval:
+            interval = self.min_interval
+            reason = 'minimum'
+        self.interval = interval
+        decision = dict(period)
+        decision.update({'start': self.period_start, 'duration': duration,
+                         'cost': cost, 'predicted_cost': predicted_cost,
+                         'backlog': backlog, 'interval': interval,
+                         'reason': reason})
+        self.decisions.append(decision)
+        return interval
+
+    def get_decisions(self):
+        """Return a list of the most recent interval decisions"""
+        return list(self.decisions)
+
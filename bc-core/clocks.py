@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+"""This module provides the clocks the miner, nodes and transactions use.
+
+Everything that depends on the time of day (transaction times, block
+timestamps, time to live expiry, cleaning periods and block deadlines) gets
+the time and sleeps through a clock object instead of the time module. The
+system clock is used by default. A simulated clock only moves when it is
+advanced, so hours of temporary transaction churn can be run in seconds and
+a run can be repeated exactly.
+
+Classes:
+    SystemClock: The real time of day.
+    SimulatedClock: A clock that is advanced by the caller.
+"""
+import threading
+import time
+
+
+class SystemClock:
+    """A clock that uses the real time of day.
+
+    Methods:
+        time():
+            Return the current time in seconds since the epoch.
+        sleep(seconds):
+            Block the calling thread for a number of seconds.
+    """
+    @staticmethod
+    def time():
+        """Return the current time in seconds since the epoch"""
+        return time.time()
+
+    @staticmethod
+    def sleep(seconds):
+        """Block the calling thread for a number of seconds"""
+        time.sleep(seconds)
+
+
+class SimulatedClock:
+    """A clock that only moves forward when it is advanced.
+
+    Threads that sleep on a simulated clock are blocked until the clock has
+    been advanced past the time they sleep until. The number of sleeping
+    threads can be waited for so that a benchmark only advances the clock
+    once every thread has finished reacting to the last advance.
+
+    Methods:
+        time():
+            Return the simulated time.
+        sleep(seconds):
+            Block the calling thread until the clock has been advanced by a
+            number of seconds.
+        advance(seconds):
+            Move the clock forward and wake the threads that are due.
+        advance_to(new_time):
+            Move the clock forward to a time.
+        wait_for_sleepers(num_sleepers, timeout):
+            Wait until a number of threads are sleeping on this clock.
+    """
+    def __init__(self, start=0.0):
+        self.now = start
+        # The times the sleeping threads will wake at. Threads stop counting
+        # as sleeping as soon as the clock is advanced past their wake time.
+        self.wake_times = []
+        self.condition = threading.Condition()
+
+    def time(self):
+        """Return the simulated time in seconds"""
+        return self.now
+
+    def sleep(self, seconds):
+        """Block until the clock has been advanced by a number of seconds"""
+        self.condition.acquire()
+        wake_time = self.now + seconds
+        if wake_time > self.now:
+            self.wake_times.append(wake_time)
+            self.condition.notify_all()
+        while self.now < wake_time:
+            self.condition.wait()
+        self.condition.release()
+
+    def advance(self, seconds):
+        """Move the clock forward by a number of seconds"""
+        self.advance_to(self.now + seconds)
+
+    def advance_to(self, new_time):
+        """Move the clock forward to a time and wake the threads that are due"""
+        self.condition.acquire()
+        if new_time > self.now:
+            self.now = new_time
+            self.wake_times = [wake_time for wake_time in self.wake_times
+                               if wake_time > new_time]
+            self.condition.notify_all()
+        self.condition.release()
+
+    def wait_for_sleepers(self, num_sleepers, timeout=None):
+        """Wait until at least num_sleepers threads sleep on this clock.
+
+        Returns False if the timeout (in real seconds) passed first.
+        """
+        self.condition.acquire()
+        reached = self.condition.wait_for(
+            lambda: len(self.wake_times) >= num_sleepers, timeout)
+        self.condition.release()
+        return reached
+
+
+# The clock used when no clock is given
+SYSTEM_CLOCK = SystemClock()
@@ -0,0 +1,1002 @@
+#!/usr/bin/python3
+"""This module provides the blockchain logic of a miner without a transport
+
+The engine verifies transactions, keeps them in a mempool, seals them into
+blocks that are stored in the database and cleans the blockchain every
+cleaning period. It does not listen on a socket, so it can be embedded in
+another program or benchmarked without the overhead of sending transactions
+to it, and several engines (each with its own database) can run in one
+process. The miner is the socket server built on top of it.
+
+Classes:
+    MinerEngine: Verifies, mines and cleans the transactions it is given.
+"""
+import threading
+import pickle
+import hashlib
+import time
+import plyvel
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+from Crypto.Hash import SHA256
+import transaction
+import block
+import chaindb
+import cleaning
+import clocks
+import keystore
+import latency
+import mempool
+import metrics
+import tracing
+import window
+from summarise import get_summary
+
+
+class MinerEngine:
+    """The verification, mining and cleaning logic of a miner.
+
+    Creating an engine opens (or creates) its database but does not start
+    any threads. The engine can be driven from the calling thread with
+    submit(), step(), flush() and run_cleaning(), or start() can be called to
+    seal blocks and run cleaning periods on background threads as the miner
+    does. run_cleaning() must not be called once start() has been called.
+
+    Methods:
+        register_key(key_hash, key):
+            Store the public key of a node so its transactions can be
+            verified.
+        submit(tx):
+            Verify a transaction and add it to the mempool.
+        submit_batch(txs):
+            Submit a list of transactions.
+        step():
+            Seal the blocks that are due.
+        flush():
+            Seal every transaction waiting to be mined.
+        run_cleaning():
+            Run a whole cleaning period in the calling thread.
+        start():
+            Seal blocks and clean the blockchain on background threads.
+        get_metrics():
+            Collect the current metrics of the engine.
+        close():
+            Close the database and trace file.
+    """
+    # The mempool lanes in priority order with their weights. Transactions
+    # in the strict (weight None) critical lane go into the next block
+    MEMPOOL_LANES = (('critical', None), ('normal', 1))
+    # The mempool lane of each transaction type (other types are 'normal').
+    # Mining these transactions lets cleaning periods free storage.
+    TX_LANES = {'remove': 'critical', 'summarise': 'critical',
+                'summarised': 'critical'}
+    # The counters shown in the metrics of the miner
+    COUNTERS = ('txs_received', 'txs_throttled', 'txs_verified',
+                'verify_failures', 'txs_mined', 'blocks_stored')
+
+    def __init__(self, block_cap=1000000, num_stored=1000,
+                 post_cap_interval=10, cleaning_budget=0.2,
+                 max_retention_lag=300, min_block_size=10, max_block_size=500,
+                 max_block_latency=2, mempool_lanes=None, tx_lanes=None,
+                 key_file=None, trace_file=None, db_path=None, indexes=False,
+                 block_codec='raw', dict_samples=32, clock=None):
+        # All times and sleeps go through this clock so that a simulated
+        # clock can be used to run the miner faster than real time
+        self.clock = clock or clocks.SYSTEM_CLOCK
+        # Transactions waiting to be mined
+        self.transactions = mempool.Mempool(mempool_lanes or
+                                            MinerEngine.MEMPOOL_LANES,
+                                            self.clock)
+        self.tx_lanes = tx_lanes or MinerEngine.TX_LANES
+        self.running_threads = []
+        # Synchronisation for block creation and list of running threads
+        self.create_sync_vars()
+        # Counters for the metrics of the miner and the time taken to store
+        # each block in the database
+        self.counters = metrics.Counters(MinerEngine.COUNTERS)
+        self.store_latency = latency.Histogram()
+        # Spans of cleaning periods and their phases are written to the
+        # trace file if one is given
+        self.tracer = tracing.Tracer(trace_file, self.clock)
+        self.period_span = None
+        self.blocks_created = 0
+        # How many blocks can be reached before using a fixed cleaning interval
+        # This can be set to zero or one to always use a fixed cleaning interval
+        self.block_cap = block_cap
+        # How many block hashes to store when using a fixed cleaning interval
+        # More blocks = longer fixed cleaning interval but higher possibility
+        # of remove succeeding
+        self.n_blocks_stored = num_stored
+        # The longest cleaning interval in seconds once the block cap is reached
+        self.interval_after_cap = post_cap_interval
+        # The fraction of time the miner may spend cleaning the blockchain
+        self.cleaning_budget = cleaning_budget
+        # The longest time in seconds expired data may stay on the blockchain
+        self.max_retention_lag = max_retention_lag
+        # The range of the number of transactions in a full block
+        self.min_block_size = min_block_size
+        self.max_block_size = max_block_size
+        # The longest time in seconds a transaction waits before its block is
+        # created, even if the block is not full
+        self.max_block_latency = max_block_latency
+        # Create at most this many blocks every step
+        self.max_blocks_per_step = 5
+        # The maximum number of transactions waiting to be mined
+        self.tx_limit = 1000000
+        # The database can be changed so that several engines (e.g.
+        # benchmarks) can run on one computer
+        self.db_path = db_path or chaindb.DB_PATH
+        # Keep the secondary indexes of transactions by public key and of
+        # blocks by time (see chaindb)
+        self.indexed = indexes
+        # The codec blocks are compressed with when they are stored (see
+        # chaindb). Blocks stored with any codec can always be read.
+        self.block_codec = block_codec
+        # With the zlib-dict codec, blocks are compressed with zlib until
+        # dict_samples blocks have been stored, then a shared dictionary is
+        # trained on them and used for every block from then on
+        self.dict_samples = dict_samples
+        self.dict_sample_blocks = []
+        self.dictionary = None
+        # Blocks are encoded when they are stored and when they are cleaned
+        self.codec_lock = threading.Lock()
+        # The integer id of every public key hash, which stored blocks have
+        # instead of the hash (see chaindb), and one shared object of every
+        # hash so that transactions in the mempool do not each have a copy.
+        # They are loaded once the database is open.
+        self.key_ids = {}
+        self.interned_keys = {}
+        self.identity_lock = threading.Lock()
+        try:
+            # Try to open an existing database first
+            self.db = plyvel.DB(self.db_path)
+            last_tuple = pickle.loads(self.db.get(chaindb.LAST_KEY))
+            self.dictionary = chaindb.get_dictionary(self.db)
+            # Get the details of the existing database
+            # (last block created and number of blocks)
+            if last_tuple:
+                self.prev_block = chaindb.decode_block(
+                    self.db.get(last_tuple[0]), self.db)
+                self.blocks_created = last_tuple[1]
+                if self.db.get(chaindb.height_key(self.blocks_created)) \
+                        is None:
+                    # The database was created before blocks were indexed
+                    # by height
+                    chaindb.index_heights(self.db)
+            else:
+                self.blocks_created = 0
+        except plyvel.Error:
+            # Database doesn't exist - create a new one
+            self.db = plyvel.DB(self.db_path, create_if_missing=True)
+            self.genesis = block.Block(clock=self.clock)
+            self.genesis.calc_and_set_block_hash()
+            self.prev_block = self.genesis
+            self.store_block(self.genesis)
+        # Once a database has secondary indexes they are always kept up to
+        # date, otherwise they would no longer match the blocks
+        has_indexes = self.db.get(chaindb.INDEXED_KEY) is not None
+        if self.indexed and not has_indexes:
+            chaindb.build_indexes(self.db)
+        self.indexed = self.indexed or has_indexes
+        self.key_ids.update(chaindb.load_identities(self.db))
+        self.interned_keys.update((key_hash, key_hash)
+                                  for key_hash in self.key_ids)
+        # Public keys of nodes that have been used since the miner started.
+        # All public keys received are also stored in the database and are
+        # loaded into this dictionary when they are first needed.
+        self.key_hash_map = {}
+        self.create_new_key(key_file)
+        self.prev_tx = 'first'
+        self.init_optimisation_variables()
+        self.init_block_variables()
+        # Stage times and latency histograms of transactions
+        self.latency = latency.LatencyTracker(self.clock)
+
+    def create_sync_vars(self):
+        """Create all the locks used for synchronisation in this thread"""
+        self.create_block_lock = threading.Lock()
+        # Lock for the list that stores currently running threads
+        self.thread_list_lock = threading.Lock()
+        # Lock for the list that stores user summarise or remove transactions
+        # that have not been consumed by a cleaning period
+        self.user_tx_lock = threading.Lock()
+        # Lock for the list that stores transactions that need to be removed
+        self.remove_tx_lock = threading.Lock()
+        # Lock for the list that stores summarisable transactions
+        self.summarise_tx_lock = threading.Lock()
+
+    def init_optimisation_variables(self):
+        """Create all the variables related to cleaning the blockchain."""
+        self.cleaning_interval = 20  # seconds
+        # Picks the cleaning interval from the measured cost of each period
+        self.interval_controller = cleaning.IntervalController(
+            self.cleaning_interval, self.cleaning_budget,
+            self.max_retention_lag, clock=self.clock)
+        # Clock times are seconds since the epoch so using a period in order
+        # of seconds is appropriate
+        self.next_cleaning_period = self.clock.time() + self.cleaning_interval
+        # A list of tuples of transactions that need to be removed.
+        # The tuples have structure (block_hash, transaction_id, remove_time)
+        # This allows constant time for removing transactions
+        self.to_remove = []
+        # A dictionary of transaction ids to be summarised
+        # The keys of the dictionary are block hashes
+        # The values are lists of transaction ids
+        # A dictionary is used so searching for transactions to summarise is
+        # linear to the number of transactions in the dictionary otherwise
+        # the runtime is too slow
+        self.to_summarise = {}
+        # Store the remove and summarise transactions received from nodes
+        self.user_txs = [[], []]
+        # The hashes and transaction ids of the last n_blocks_stored blocks
+        self.block_window = window.BlockWindow(self.n_blocks_stored)
+
+    def init_block_variables(self):
+        """Create all the variables related to sealing blocks."""
+        # The target number of transactions in a block. This adapts to the
+        # rate transactions are received at
+        self.tx_per_block = self.min_block_size
+        # Aim to create a block this often (in seconds) when transactions are
+        # received faster than min_block_size per interval
+        self.target_block_interval = 0.1
+        # Counters used to measure the arrival rate of transactions
+        self.txs_mined = 0
+        self.arrival_rate = 0
+        self.last_rate_check = self.clock.time()
+        self.last_rate_count = 0
+
+    def start(self):
+        """Start the threads that seal blocks and clean the blockchain.
+
+        Threads are named after the method they run so they can be told
+        apart in profiles.
+        """
+        # Spin up a new thread that checks the number of transactions received
+        # and create new blocks if there are enough transactions
+        self.check_tx_thread = threading.Thread(target=self.check_num_tx,
+                                                name='check_num_tx')
+        self.check_tx_thread.start()
+        # Spin up a new thread that will run cleaning period operations
+        self.cleaning_thread = threading.Thread(target=self.clean_bc,
+                                                name='clean_bc')
+        self.cleaning_thread.start()
+
+    def create_new_key(self, key_file=None):
+        """Create a new key for miner created transactions.
+
+        If a key file is given, the key saved in it is used instead so that
+        the miner keeps its identity after a restart.
+        """
+        self.key = keystore.load_or_create_key(key_file)
+        self.priv_key = self.key.exportKey('PEM')
+        self.pub_key = self.key.publickey().exportKey('PEM')
+        hash_algo = hashlib.sha256()
+        hash_algo.update(self.pub_key)
+        self.key_hash = self.intern_key_hash(
+            hash_algo.hexdigest().encode('utf-8'))
+        self.key_hash_map[self.key_hash] = self.pub_key
+
+    def register_key(self, key_hash, key):
+        """Store a node's public key in memory and in the database"""
+        if self.get_pub_key(key_hash) is None:
+            self.db.put(chaindb.KEY_PREFIX + key_hash.encode('utf-8'), key)
+        self.intern_key_hash(key_hash.encode('utf-8'))
+        self.key_hash_map[key_hash] = key
+
+    def intern_key_hash(self, key_hash):
+        """Get the shared object of a public key hash.
+
+        A hash seen for the first time is given the next id, which is stored
+        before any block can be stored with it.
+        """
+        interned = self.interned_keys.get(key_hash)
+        if interned is not None:
+            return interned
+        self.identity_lock.acquire()
+        if key_hash not in self.interned_keys:
+            key_id = len(self.key_ids)
+            with self.db.write_batch(transaction=True) as batch:
+                chaindb.put_identity(batch, key_hash, key_id)
+            self.key_ids[key_hash] = key_id
+            self.interned_keys[key_hash] = key_hash
+        interned = self.interned_keys[key_hash]
+        self.identity_lock.release()
+        return interned
+
+    def get_pub_key(self, key_hash):
+        """Get the public key of a node from its hash (None if unknown).
+
+        Keys received before the miner was started are loaded from the
+        database the first time they are needed.
+        """
+        key = self.key_hash_map.get(key_hash)
+        if key is None:
+            key = self.db.get(chaindb.KEY_PREFIX + key_hash.encode('utf-8'))
+            if key is not None:
+                self.intern_key_hash(key_hash.encode('utf-8'))
+                self.key_hash_map[key_hash] = key
+        return key
+
+    def submit(self, tx):
+        """Verify a signed transaction and add it to the mempool.
+
+        Returns True if the transaction was accepted. Accepted remove and
+        user summarise transactions are not added to the mempool until a
+        cleaning period has found the transactions they cover.
+        """
+        self.counters.incr('txs_received')
+        self.latency.stamp(tx, 'received')
+        return self.process_tx(tx)
+
+    def submit_batch(self, txs):
+        """Submit a list of transactions and return how many were accepted"""
+        return sum(1 for tx in txs if self.submit(tx))
+
+    def process_tx(self, tx):
+        """Verify a received transaction and add it to the mempool.
+
+        Returns True if the transaction was accepted. Transactions that are
+        not accepted will not be mined.
+        """
+        accepted = False
+        reason = 'error'
+        try:
+            verified = self.verify_tx(tx)
+            self.counters.incr('txs_verified' if verified
+                               else 'verify_failures')
+            if verified and self.check_tx_type(tx):
+                tx.pub_key = self.interned_keys.get(tx.pub_key, tx.pub_key)
+                self.add_to_mempool(tx)
+                accepted = True
+            elif verified and tx.tx_type in ('remove', 'summarise'):
+                # Remove and summarise transactions are verified again in a
+                # cleaning period, which decides if they are accepted
+                return True
+            else:
+                reason = 'invalid signature' if not verified else \
+                    'invalid type'
+        except Exception:
+            # Ignore any errors
+            pass
+        if accepted:
+            self.on_tx_result(tx, True)
+        else:
+            self.latency.discard(tx)
+            self.on_tx_result(tx, False, reason)
+        return accepted
+
+    def on_tx_result(self, tx, accepted, reason=None):
+        """Called when it is decided if a transaction will be mined.
+
+        The reason is given when a transaction is rejected. The engine does
+        nothing, the miner sends a receipt to the node that sent it.
+        """
+
+    def on_block_stored(self, block_hash, height, block_tx):
+        """Called once a block has been stored with the transactions in it.
+
+        The height is the number of blocks before it, from the genesis block.
+        The engine does nothing, the miner tells the nodes that sent the
+        transactions.
+        """
+
+    def on_txs_summarised(self, tx_ids, summary_tx_id):
+        """Called when transactions have been summarised by a transaction.
+
+        The summarised transactions are removed in the next cleaning period.
+        The engine does nothing, the miner tells subscribed nodes.
+        """
+
+    def on_txs_removed(self, block_hash, tx_ids):
+        """Called once transactions have been removed from a stored block.
+
+        The engine does nothing, the miner tells subscribed nodes.
+        """
+
+    def verify_tx(self, tx):
+        """Check the digital signature of a received transaction"""
+        pub_key_hash = tx.pub_key.decode('utf-8')
+        pub_key = self.get_pub_key(pub_key_hash)
+        tx_hash = SHA256.new(tx.get_signature_contents())
+        key = RSA.importKey(pub_key)
+        verifier = PKCS1_v1_5.new(key)
+        verified = verifier.verify(tx_hash, tx.sig)
+        return verified
+
+    def close(self):
+        """Clean up the trace file and database handle"""
+        self.tracer.close()
+        self.db.close()
+
+    def encode_block(self, pickled_block):
+        """Compress a pickled block with the codec of the engine.
+
+        With the zlib-dict codec the first blocks are kept as samples to
+        train the dictionary on, and are compressed with zlib.
+        """
+        if self.block_codec != 'zlib-dict':
+            return chaindb.encode_block(pickled_block, self.block_codec)
+        self.codec_lock.acquire()
+        if self.dictionary is None:
+            self.dict_sample_blocks.append(pickled_block)
+            if len(self.dict_sample_blocks) < self.dict_samples:
+                self.codec_lock.release()
+                return chaindb.encode_block(pickled_block, 'zlib')
+            dictionary = chaindb.train_dictionary(self.dict_sample_blocks)
+            self.dict_sample_blocks = []
+            with self.db.write_batch(transaction=True) as batch:
+                chaindb.put_dictionary(batch, dictionary)
+            self.dictionary = dictionary
+        self.codec_lock.release()
+        return chaindb.encode_block(pickled_block, 'zlib-dict',
+                                    self.dictionary)
+
+    def store_block(self, block_to_store):
+        """Store a created block in the database"""
+        try:
+            # Get the bytes of the block
+            byte_blocks = self.encode_block(
+                chaindb.pickle_block(block_to_store, self.key_ids))
+        except Exception:
+            return
+        # The latency of the write is real time, even on a simulated clock
+        start_time = time.perf_counter()
+        with self.db.write_batch(transaction=True) as batch:
+            # Write the byte blocks to the database and update the "last block"
+            # object on the database. This operation is considered atomic.
+            block_hash = block_to_store.block_hash.encode('utf-8')
+            batch.put(block_hash, byte_blocks)
+            batch.put(chaindb.height_key(self.blocks_created), block_hash)
+            if self.indexed:
+                chaindb.index_block(batch, block_to_store, self.blocks_created)
+            batch.put(chaindb.LAST_KEY, pickle.dumps((block_hash,
+                                                            self.blocks_created)))
+        self.store_latency.record(time.perf_counter() - start_time)
+        self.counters.incr('blocks_stored')
+        return
+
+    def get_metrics(self):
+        """Collect the current metrics of the miner.
+
+        Counters are in the 'counters' dictionary so that the metrics server
+        can add their rates.
+        """
+        self.summarise_tx_lock.acquire()
+        num_to_summarise = sum(len(tx_ids) for tx_ids
+                               in self.to_summarise.values())
+        self.summarise_tx_lock.release()
+        decisions = self.interval_controller.get_decisions()
+        last_period = {}
+        if decisions:
+            last_period = {'duration': decisions[-1]['duration'],
+                           'blocks_read': decisions[-1]['blocks_read'],
+                           'blocks_written': decisions[-1]['blocks_written'],
+                           'bytes_written': decisions[-1]['bytes_written'],
+                           'phases': decisions[-1]['phases']}
+        return {
+            'counters': self.counters.snapshot(),
+            'mempool': {'depth': len(self.transactions),
+                        'lanes': {lane: self.transactions.lane_size(lane)
+                                  for lane in self.transactions.lane_order}},
+            'blocks_created': self.blocks_created,
+            'tx_per_block': self.tx_per_block,
+            'arrival_rate': self.arrival_rate,
+            'store_latency': self.store_latency.summary(),
+            'to_remove': len(self.to_remove),
+            'to_summarise': num_to_summarise,
+            'user_txs': len(self.user_txs[0]) + len(self.user_txs[1]),
+            'cleaning_interval': self.cleaning_interval,
+            'cleaning_periods': len(decisions),
+            'last_cleaning_period': last_period,
+            'latency': self.latency.percentiles(),
+            'threads': threading.active_count(),
+            'rss': metrics.get_rss(),
+        }
+
+    def create_and_append_block(self, block_tx):
+        """Create a block from a list of transactions"""
+        self.latency.stamp_block(block_tx, 'assigned')
+        new_block = block.Block(block_tx, self.clock)
+        # Lock block creation so that the blocks form a consistent chain
+        # Only lock a small part of the creation so that multiple blocks
+        # can be created at once and a small part is synchronised
+        self.create_block_lock.acquire()
+        new_block.set_prev_block(self.prev_block)
+        new_block.calc_and_set_block_hash()
+        self.prev_block = new_block
+        self.blocks_created += 1
+        self.txs_mined += len(block_tx)
+        self.counters.incr('txs_mined', len(block_tx))
+        store_block_thread = threading.Thread(target=self.store_block,
+                                              args=[new_block],
+                                              name='store_block')
+        store_block_thread.start()
+        self.block_window.add(new_block.block_hash,
+                              [tx.tx_id for tx in block_tx])
+        store_block_thread.join()
+        self.latency.stamp_block(block_tx, 'persisted')
+        self.check_block_tx_types(new_block.block_hash, block_tx)
+        height = self.blocks_created
+        self.create_block_lock.release()
+        self.on_block_stored(new_block.block_hash, height, block_tx)
+
+    def check_block_tx_types(self, block_hash, txs):
+        """Check the types of the block transactions when a block is created.
+
+        This method checks for any temporary or miner summarisable transactions
+        in a created block. If there are any, the transaction id and block
+        hash is stored by the miner so that retrieval of these transactions
+        can be performed in constant time.
+        """
+        block_hash = block_hash.encode('utf-8')
+        for tx in txs:
+            if tx.tx_type == 'temp':
+                remove_time = tx.ttl + self.clock.time()
+                self.to_remove.append((block_hash, tx.tx_id, remove_time))
+            elif tx.tx_type == 'summ':
+                self.summarise_tx_lock.acquire()
+                if block_hash in self.to_summarise:
+                    self.to_summarise[block_hash].append(tx.tx_id)
+                else:
+                    self.to_summarise[block_hash] = [tx.tx_id]
+                self.summarise_tx_lock.release()
+
+    def add_to_mempool(self, tx):
+        """Add a transaction to the mempool lane for its type"""
+        self.latency.stamp(tx, 'verified')
+        self.transactions.add(tx, self.tx_lanes.get(tx.tx_type, 'normal'))
+
+    def check_tx_type(self, tx):
+        """Check if the type of a received transaction is valid"""
+        valid_type = True
+        if tx.tx_type == 'perm':
+            pass
+        elif tx.tx_type == 'temp':
+            pass
+        elif tx.tx_type == 'summ':
+            pass
+        # Check transaction validity of remove and summarise transactions
+        # during a cleaning period
+        elif tx.tx_type == 'remove':
+            valid_type = False
+            self.user_tx_lock.acquire()
+            self.user_txs[1].append(tx)
+            self.user_tx_lock.release()
+        elif tx.tx_type == 'summarise':
+            valid_type = False
+            self.user_tx_lock.acquire()
+            self.user_txs[1].append(tx)
+            self.user_tx_lock.release()
+        # If the transaction type is not an accepted type
+        else:
+            valid_type = False
+        return valid_type
+
+    def update_block_size(self):
+        """Adapt the target block size to the transaction arrival rate.
+
+        The arrival rate is measured about once a second and smoothed. The
+        target block size is the number of transactions expected to arrive
+        every target_block_interval seconds, kept between the minimum and
+        maximum block sizes. At high load this creates fewer, larger blocks
+        so the overhead of creating and storing each block is amortised.
+        """
+        curr_time = self.clock.time()
+        elapsed = curr_time - self.last_rate_check
+        if elapsed < 1:
+            return
+        num_added = self.transactions.num_added
+        rate = (num_added - self.last_rate_count) / elapsed
+        self.arrival_rate = 0.5 * rate + 0.5 * self.arrival_rate
+        self.last_rate_check = curr_time
+        self.last_rate_count = num_added
+        target = int(self.arrival_rate * self.target_block_interval)
+        self.tx_per_block = max(self.min_block_size,
+                                min(self.max_block_size, target))
+
+    def step(self):
+        """Seal the blocks that are due and return how many were created.
+
+        A block is due once there are at least tx_per_block transactions
+        waiting to be mined or the oldest of them has waited longer than
+        max_block_latency seconds. At most max_blocks_per_step blocks are
+        created, and only the last block created after the deadline has
+        passed can have fewer than tx_per_block transactions. Transactions in
+        a strict mempool lane are put into the next block without waiting
+        for the block to fill up or the deadline to pass.
+        """
+        self.update_block_size()
+        num_waiting = len(self.transactions)
+        oldest_time = self.transactions.oldest_time()
+        if oldest_time is None:
+            return 0
+        block_size = self.tx_per_block
+        # Transactions that free storage do not wait for a full block
+        deadline_passed = self.transactions.has_strict() or \
+            self.clock.time() - oldest_time >= self.max_block_latency
+        if num_waiting < block_size and not deadline_passed:
+            return 0
+        # The transactions for each block are taken from the mempool in
+        # priority order. Only if the deadline has passed is the last block
+        # allowed to have fewer than block_size transactions.
+        num_blocks = min(self.max_blocks_per_step, num_waiting // block_size)
+        tx_for_block = [self.transactions.take(block_size)
+                        for _ in range(num_blocks)]
+        if deadline_passed and num_blocks < self.max_blocks_per_step \
+                and num_blocks * block_size < num_waiting:
+            tx_for_block.append(self.transactions.take(block_size))
+        for block_tx in tx_for_block:
+            self.create_and_append_block(block_tx)
+        return len(tx_for_block)
+
+    def flush(self):
+        """Seal every transaction waiting to be mined into blocks.
+
+        Blocks are created whether or not they are full or their deadline
+        has passed. Returns the number of blocks created.
+        """
+        num_blocks = 0
+        while self.transactions:
+            block_tx = self.transactions.take(self.tx_per_block)
+            if block_tx:
+                self.create_and_append_block(block_tx)
+                num_blocks += 1
+        return num_blocks
+
+    def check_num_tx(self):
+        """Seal the blocks that are due for as long as the engine runs"""
+        while True:
+            if not self.step():
+                self.clock.sleep(0.005)
+
+    def remove_txs_from_bc(self):
+        """Purge the blockchain of any transactions that need to be removed."""
+        with self.trace_phase('remove') as span:
+            self.remove_expired_txs(span)
+
+    def remove_expired_txs(self, span):
+        """Remove the transactions in the to_remove list that are due"""
+        with span.step('collect'):
+            to_clean_list = self.collect_due_txs()
+        if to_clean_list:
+            block_hash_dict = {}
+            # Combine all transactions that are stored in the same block in
+            # a single list so all transactions stored in the same block that
+            # need to be removed are removed in one i/o operation
+            for block_hash, tx_id in to_clean_list:
+                if block_hash in block_hash_dict:
+                    block_hash_dict[block_hash].append(tx_id)
+                else:
+                    block_hash_dict[block_hash] = [tx_id]
+            # Remove all removable transactions from blocks and update the db
+            for block_hash, tx_id_list in block_hash_dict.items():
+                with span.step('read'):
+                    pickled_block = self.db.get(block_hash)
+                with span.step('unpickle'):
+                    loaded_block = chaindb.decode_block(pickled_block, self.db)
+                num_txs = len(tx_id_list)
+                block_txs = {}
+                if self.indexed:
+                    # The index entries of the removed transactions are
+                    # deleted with the block update
+                    block_txs = {tx.tx_id: tx for tx
+                                 in loaded_block.get_block_txs()}
+                # The ids of transactions that are removed are taken out of
+                # the list given, so the ids not found are left in it
+                not_found = list(tx_id_list)
+                with span.step('prune'):
+                    loaded_block.remove_txs(not_found)
+                removed_ids = [tx_id for tx_id in tx_id_list
+                               if tx_id not in not_found]
+                with span.step('pickle'):
+                    pickled_block = self.encode_block(
+                        chaindb.pickle_block(loaded_block, self.key_ids))
+                with span.step('write'):
+                    with self.db.write_batch(transaction=True) as batch:
+                        batch.put(block_hash, pickled_block)
+                        if self.indexed:
+                            chaindb.unindex_txs(batch, loaded_block,
+                                                [block_txs[tx_id] for tx_id
+                                                 in removed_ids])
+                span.add(blocks_read=1, blocks_written=1,
+                         bytes=len(pickled_block), txs=num_txs)
+                self.on_txs_removed(block_hash.decode('utf-8'), removed_ids)
+
+    def collect_due_txs(self):
+        """Take the transactions that are due for removal from to_remove"""
+        self.remove_tx_lock.acquire()
+        curr_time = self.clock.time()
+        # Look for any transactions that need to be removed from the blockchain
+        # These transactions are all tracked in the to_remove list
+        # Temporary transactions that have past their time to live, summarisable
+        # transactions that have been summarised in the past cleaning period
+        # or transactions stored in the merkle tree of user summarise or remove
+        # transactions that have been located on the blockchain in the past
+        # cleaning period
+        to_clean_list = [(block_hash, tx_id) for block_hash, tx_id, remove_time
+                         in self.to_remove if remove_time <= curr_time]
+        # Update the to remove list to all transactions that will need to be
+        # removed in the future
+        self.to_remove = [remove_tuple for remove_tuple in self.to_remove
+                          if remove_tuple[2] > curr_time]
+        self.remove_tx_lock.release()
+        return to_clean_list
+
+    def verify_usr_txs(self):
+        """Check some blocks to verify remove or summarise transactions"""
+        with self.trace_phase('verify') as span:
+            self.verify_received_usr_txs(span)
+
+    def verify_received_usr_txs(self, span):
+        """Verify the user transactions received before this cleaning period"""
+        # Clone the list of user summarise or remove transactions that were
+        # received before this cleaning period and update the list of received
+        # user summarise or remove transactions so that new received
+        # transactions will be queued for verification and removal next cleaning
+        # period
+        self.user_tx_lock.acquire()
+        user_txs = self.user_txs[0].copy()
+        self.user_txs[0] = self.user_txs[1]
+        self.user_txs[1] = []
+        self.user_tx_lock.release()
+        received_txs = user_txs
+        span.add(txs=len(received_txs))
+        accepted_ids = set()
+        verified_txs = []
+        if user_txs:
+            # Transform the list of remove or summarise transactions into tuples
+            # containing relevant information for each transaction
+            # (i.e. gv values, transaction ids)
+            user_txs = [(tx, tx.gv_list, tx.tx_tree.get_ids(), [])
+                        for tx in user_txs]
+            # Only consider the transactions that provide an equal number of
+            # gv values as the number of ids in the merkle tree
+            user_txs = [tx_tuple for tx_tuple in user_txs if len(tx_tuple[1])
+                        == len(tx_tuple[2])]
+            # Check existing blocks for transactions matching the transaction
+            # ids stored in the merkle tree of remove or summarise transactions
+            if self.blocks_created > self.block_cap:
+                # Only read the blocks in the window that contain one of the
+                # transaction ids in the received transactions
+                usr_tx_ids = set()
+                for tx_tuple in user_txs:
+                    usr_tx_ids.update(tx_tuple[2])
+                with span.step('window'):
+                    matching_blocks = self.block_window.find(usr_tx_ids)
+                for block_hash in matching_blocks:
+                    with span.step('read'):
+                        pickled_block = self.db.get(block_hash.encode('utf-8'))
+                    with span.step('unpickle'):
+                        loaded_block = chaindb.decode_block(pickled_block,
+                                                            self.db)
+                    with span.step('match'):
+                        loaded_block.check_usr_txs(user_txs)
+                span.add(blocks_read=len(matching_blocks))
+                verified_txs = [tx_tuple for tx_tuple in user_txs
+                                if len(tx_tuple[2]) == len(tx_tuple[3])]
+            else:
+                # This part should be rewritten so that transactions that are
+                # verified are removed from the user_txs list so that the loop
+                # can early exit if all transactions are verified
+                for _, pickled_block in chaindb.iter_blocks(self.db):
+                    with span.step('unpickle'):
+                        loaded_block = chaindb.decode_block(pickled_block,
+                                                            self.db)
+                    with span.step('match'):
+                        loaded_block.check_usr_txs(user_txs)
+                    span.add(blocks_read=1)
+                    verified_txs.extend([tx_tuple for tx_tuple in user_txs
+                                         if len(tx_tuple[2])
+                                         == len(tx_tuple[3])])
+                    user_txs = [tx_tuple for tx_tuple in user_txs
+                                if len(tx_tuple[2]) != len(tx_tuple[3])]
+                    if not user_txs:
+                        break
+        for tx, _, _, tx_list in verified_txs:
+            # If all of the transactions in the remove or summarise transaction
+            # has been verified
+            with span.step('check_summary'):
+                accepted = (tx.tx_type == 'summarise' and
+                            MinerEngine.check_user_summ(tx, tx_list)) \
+                    or tx.tx_type == 'remove'
+            if accepted:
+                self.add_to_mempool(tx)
+                accepted_ids.add(tx.tx_id)
+                self.on_tx_result(tx, True)
+                if tx.tx_type == 'summarise':
+                    self.on_txs_summarised([found_tx.tx_id for found_tx, _
+                                            in tx_list], tx.tx_id)
+                self.remove_tx_lock.acquire()
+                # Add the transaction ids from all verified transaction
+                # merkle trees to the to_remove list and give them a
+                # remove time of 0
+                self.to_remove.extend([(block_hash, tx.tx_id, 0) for tx,
+                                       block_hash in tx_list])
+                self.remove_tx_lock.release()
+        # Transactions that could not be verified will not be mined
+        for tx in received_txs:
+            if tx.tx_id not in accepted_ids:
+                self.latency.discard(tx)
+                self.on_tx_result(tx, False, 'covered transactions not found')
+
+    @staticmethod
+    def check_user_summ(tx, txs):
+        """Check the inputs and outputs of a verified user summarise transaction"""
+        txs = [tx_found for tx_found, block_hash in txs]
+        ins, outs = get_summary(txs)
+        tx_in = tx.input.split(':')
+        tx_out = tx.output.split(':')
+        return set(ins) == set(tx_in) and set(outs) == set(tx_out)
+
+    def summarise_current_txs(self):
+        """Summarise all received miner summarisable transactions"""
+        with self.trace_phase('summarise') as span:
+            self.summarise_received_txs(span)
+
+    def summarise_received_txs(self, span):
+        """Summarise the summarisable transactions received so far"""
+        self.summarise_tx_lock.acquire()
+        summarise_tx_dict = self.to_summarise.copy()
+        self.to_summarise = {}
+        self.summarise_tx_lock.release()
+        summarise_txs = []
+        for block_hash in summarise_tx_dict:
+            with span.step('read'):
+                pickled_block = self.db.get(block_hash)
+            try:
+                with span.step('unpickle'):
+                    loaded_block = chaindb.decode_block(pickled_block,
+                                                        self.db)
+                with span.step('get_txs'):
+                    for tx_id in summarise_tx_dict[block_hash]:
+                        summarise_txs.append(loaded_block.get_tx(tx_id))
+                span.add(blocks_read=1,
+                         txs=len(summarise_tx_dict[block_hash]))
+            except pickle.UnpicklingError:
+                continue
+        self.remove_tx_lock.acquire()
+        # Track the summarisable transactions for removal next cleaning period
+        for block_hash, tx_id_list in summarise_tx_dict.items():
+            for tx_id in tx_id_list:
+                self.to_remove.append((block_hash, tx_id, 0))  # Remove time of 0
+        self.remove_tx_lock.release()
+        with span.step('summarise'):
+            (inputs, outputs) = get_summary(summarise_txs)
+        if inputs and outputs:
+            # Create a new transaction
+            summarised = transaction.Transaction(self.prev_tx, ':'.join(inputs),
+                                                 ':'.join(outputs),
+                                                 self.key_hash, 'summarised',
+                                                 clock=self.clock)
+            self.prev_tx = summarised.tx_id
+            self.add_to_mempool(summarised)
+            self.on_txs_summarised([tx.tx_id for tx in summarise_txs],
+                                   summarised.tx_id)
+
+    def trace_phase(self, name):
+        """Start the span of a phase of the current cleaning period.
+
+        When the span ends, its time and work are added to the cleaning
+        period measured by the interval controller.
+        """
+        return self.tracer.span(name, self.period_span, self.record_phase)
+
+    def record_phase(self, span):
+        """Add the time and work of a finished phase to the cleaning period"""
+        self.interval_controller.add_phase_time(span.name, span.duration())
+        self.interval_controller.add_work(span.work['blocks_read'],
+                                          span.work['blocks_written'],
+                                          span.work['bytes'],
+                                          span.work['txs'])
+
+    def get_cleaning_backlog(self):
+        """Count the transactions that are waiting to be cleaned.
+
+        This includes transactions in the to_remove list that are due for
+        removal, transactions waiting to be summarised and received remove or
+        user summarise transactions that have not been verified yet.
+        """
+        curr_time = self.clock.time()
+        backlog = sum(1 for remove_tuple in self.to_remove
+                      if remove_tuple[2] <= curr_time)
+        self.summarise_tx_lock.acquire()
+        backlog += sum(len(tx_ids) for tx_ids in self.to_summarise.values())
+        self.summarise_tx_lock.release()
+        backlog += len(self.user_txs[0]) + len(self.user_txs[1])
+        return backlog
+
+    def begin_cleaning_period(self):
+        """Start measuring and tracing a cleaning period"""
+        self.interval_controller.start_period()
+        self.period_span = self.tracer.span('cleaning_period')
+        # Update the next cleaning period time. This is replaced once the
+        # period has finished and its cost is known
+        self.next_cleaning_period = self.clock.time() + self.cleaning_interval
+
+    def end_cleaning_period(self):
+        """Finish the current cleaning period and pick the next interval.
+
+        The interval controller measures the period and picks the time until
+        the next one, which is returned.
+        """
+        # Once the block cap is reached the interval can be no longer than the
+        # fixed interval after the cap so that removed transactions are still
+        # in the last blocks stored
+        cap_interval = None
+        if self.blocks_created > self.block_cap:
+            cap_interval = self.interval_after_cap
+        backlog = self.get_cleaning_backlog()
+        self.cleaning_interval = self.interval_controller.end_period(
+            backlog, cap_interval)
+        self.period_span.end(
+            interval=self.cleaning_interval, backlog=backlog,
+            reason=self.interval_controller.decisions[-1]['reason'])
+        self.next_cleaning_period = self.interval_controller.period_start + \
+            self.cleaning_interval
+        return self.cleaning_interval
+
+    def run_cleaning(self):
+        """Run a whole cleaning period in the calling thread.
+
+        Transactions due for removal are removed, received remove and user
+        summarise transactions are verified and miner summarisable
+        transactions are summarised, one after the other. Returns the
+        cleaning interval picked for the next period.
+        """
+        self.begin_cleaning_period()
+        if self.to_remove:
+            self.remove_txs_from_bc()
+        if self.user_txs:
+            self.verify_usr_txs()
+        if self.to_summarise:
+            self.summarise_current_txs()
+        return self.end_cleaning_period()
+
+    def clean_bc(self):
+        """A continuously running method that will purge the blockchain.
+
+        This method runs while the engine is active and every cleaning period
+        it will remove all transactions to be removed, summarise miner
+        summarisable transactions and attempt to verify received remove or
+        user summarise transaction. When all the threads of a cleaning period
+        have finished, the period is ended. If it is not the next cleaning
+        period, the thread that this method is running on will sleep.
+        """
+        while True:
+            # If it is the next cleaning period and the last one has finished
+            if self.clock.time() > self.next_cleaning_period and \
+                    not self.interval_controller.in_period():
+                self.begin_cleaning_period()
+                if self.to_remove:
+                    # Start the remove transaction thread
+                    remove_tx_thread = threading.Thread(
+                        target=self.remove_txs_from_bc,
+                        name='remove_txs_from_bc')
+                    self.thread_list_lock.acquire()
+                    self.running_threads.append(remove_tx_thread)
+                    self.thread_list_lock.release()
+                    remove_tx_thread.start()
+                if self.user_txs:
+                    self.verify_usr_txs()
+                # Start the miner summarise thread
+                if self.to_summarise:
+                    summarise_thread = threading.Thread(
+                        target=self.summarise_current_txs,
+                        name='summarise_current_txs')
+                    self.thread_list_lock.acquire()
+                    self.running_threads.append(summarise_thread)
+                    self.thread_list_lock.release()
+                    summarise_thread.start()
+            else:
+                self.thread_list_lock.acquire()
+                # Remove finished threads from the running thread list
+                self.running_threads = [thread for thread in
+                                        self.running_threads if thread.is_alive()]
+                period_finished = not self.running_threads
+                self.thread_list_lock.release()
+                if period_finished and self.interval_controller.in_period():
+                    self.end_cleaning_period()
+                # Sleep for 5% of the cleaning interval time or 1 second,
+                # whichever is smaller, but never busy loop
+                sleep_time = max(0.05, min(1, self.cleaning_interval / 20))
+                self.clock.sleep(sleep_time)
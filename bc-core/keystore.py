@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+"""This module provides on disk storage of RSA keys for nodes and miners.
+
+A node or miner given a key file will load its key from the file, or generate
+a key and save it to the file the first time it is started, so it keeps the
+same identity across restarts. Key pools hold many pre-generated keys in one
+file so that benchmarks can start thousands of nodes without generating a
+key for each of them.
+
+Methods:
+    load_or_create_key(path):
+        Load the key in a key file, creating the file if it doesn't exist
+    create_key_pool(path, num_keys):
+        Generate keys and save them to a key pool file
+    load_key_pool(path):
+        Load the exported keys in a key pool file
+"""
+import os
+import pickle
+from Crypto.PublicKey import RSA
+
+KEY_SIZE = 1024
+
+
+def save_key(key, path):
+    """Save the private key to a file only readable by the current user"""
+    file_desc = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(file_desc, 'wb') as key_file:
+        key_file.write(key.exportKey('PEM'))
+
+
+def load_key(path):
+    """Load a private key from a file"""
+    with open(path, 'rb') as key_file:
+        return RSA.importKey(key_file.read())
+
+
+def load_or_create_key(path=None):
+    """Load the key saved in the file at path.
+
+    If the file doesn't exist, a new key is generated and saved to it. If no
+    path is given, a new key is generated and not saved.
+    """
+    if path and os.path.exists(path):
+        return load_key(path)
+    key = RSA.generate(KEY_SIZE)
+    if path:
+        save_key(key, path)
+    return key
+
+
+def create_key_pool(path, num_keys):
+    """Generate num_keys keys and save their exported PEMs to a pool file"""
+    keys = [RSA.generate(KEY_SIZE).exportKey('PEM') for _ in range(num_keys)]
+    with open(path, 'wb') as pool_file:
+        pickle.dump(keys, pool_file)
+    return keys
+
+
+def load_key_pool(path):
+    """Load the list of exported PEM keys saved in a pool file"""
+    with open(path, 'rb') as pool_file:
+        return pickle.load(pool_file)
@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+"""This module tracks how long transactions take to be included in a block.
+
+The miner stamps every transaction when it is received, when it is verified
+and added to the list of transactions waiting to be mined, when it is
+assigned to a block and when the block is stored in the database. When a
+transaction's block is stored, the time between each stage is recorded in a
+histogram for the transaction type.
+
+Classes:
+    Histogram: A log-linear histogram of durations, similar to HdrHistogram.
+    LatencyTracker: The stage times of transactions and their histograms.
+"""
+import threading
+import clocks
+
+# The stages a transaction goes through in the miner, in order
+STAGES = ('received', 'verified', 'assigned', 'persisted')
+# The durations recorded for every transaction, as (name, start, end) stages.
+# 'created' is the time the node created the transaction.
+INTERVALS = (('verify', 'received', 'verified'),
+             ('mempool', 'verified', 'assigned'),
+             ('store', 'assigned', 'persisted'),
+             ('inclusion', 'received', 'persisted'),
+             ('end_to_end', 'created', 'persisted'))
+
+
+class Histogram:
+    """A histogram of durations with a bounded relative error.
+
+    Durations are counted in whole microseconds. Values below 2^bits are
+    counted exactly and larger values are counted in buckets that are at most
+    2^(1-bits) of their value wide, so with the default of 7 bits percentiles
+    are within 1.6% of the true value for any duration.
+
+    Methods:
+        record(seconds):
+            Count a duration.
+        percentile(percent):
+            Return the duration that percent of the recorded durations are
+            less than or equal to.
+        summary():
+            Return the count, mean, maximum and common percentiles.
+    """
+    UNIT = 1e-6  # microseconds
+
+    def __init__(self, bits=7):
+        self.bits = bits
+        self.half = 1 << (bits - 1)
+        self.counts = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.histogram_lock = threading.Lock()
+
+    def __index(self, value):
+        """Get the index of the bucket a value in microseconds is counted in"""
+        if value < 1 << self.bits:
+            return value
+        exponent = value.bit_length() - self.bits
+        return exponent * self.half + (value >> exponent)
+
+    def __value(self, index):
+        """Get the middle value of the bucket with the given index"""
+        if index < 1 << self.bits:
+            return index
+        exponent = index // self.half - 1
+        mantissa = index - exponent * self.half
+        return (mantissa << exponent) + (1 << exponent) // 2
+
+    def record(self, seconds):
+        """Count a duration given in seconds"""
+        value = max(0, int(seconds / Histogram.UNIT))
+        index = self.__index(value)
+        self.histogram_lock.acquire()
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        self.histogram_lock.release()
+
+    def percentile(self, percent):
+        """Return the given percentile of the recorded durations in seconds"""
+        self.histogram_lock.acquire()
+        buckets = sorted(self.counts.items())
+        count = self.count
+        self.histogram_lock.release()
+        if not count:
+            return 0
+        target = max(1, count * percent / 100)
+        seen = 0
+        for index, bucket_count in buckets:
+            seen += bucket_count
+            if seen >= target:
+                return min(self.__value(index), self.max) * Histogram.UNIT
+        return self.max * Histogram.UNIT
+
+    def summary(self):
+        """Return a dictionary of the count, mean, max and percentiles"""
+        count = self.count
+        return {'count': count,
+                'mean': self.total / count * Histogram.UNIT if count else 0,
+                'p50': self.percentile(50), 'p90': self.percentile(90),
+                'p99': self.percentile(99), 'p99.9': self.percentile(99.9),
+                'max': self.max * Histogram.UNIT}
+
+
+class LatencyTracker:
+    """Stamps transactions as they pass through the miner.
+
+    The stage times of a transaction are kept until its block is stored, then
+    its durations are added to the histograms of its type and the stage times
+    are forgotten. Transactions that are rejected should be discarded so
+    their stage times are not kept forever.
+
+    Methods:
+        stamp(tx, stage):
+            Record the time a transaction reached a stage.
+        stamp_block(txs, stage):
+            Record the time all the transactions of a block reached a stage.
+        discard(tx):
+            Forget the stage times of a rejected transaction.
+        percentiles():
+            Return the summaries of all histograms.
+        print_summary():
+            Print the summaries of all histograms.
+    """
+    def __init__(self, clock=None):
+        self.clock = clock or clocks.SYSTEM_CLOCK
+        # Transaction id -> dictionary of stage times
+        self.stamps = {}
+        # Transaction type -> interval name -> Histogram
+        self.histograms = {}
+        self.tracker_lock = threading.Lock()
+
+    def stamp(self, tx, stage, stamp_time=None):
+        """Record the time a transaction reached a stage of the miner"""
+        if stamp_time is None:
+            stamp_time = self.clock.time()
+        self.tracker_lock.acquire()
+        stamps = self.stamps.get(tx.tx_id)
+        if stamps is None:
+            stamps = {'created': tx.time}
+            self.stamps[tx.tx_id] = stamps
+        stamps[stage] = stamp_time
+        self.tracker_lock.release()
+        if stage == 'persisted':
+            self.__record(tx.tx_type, tx.tx_id)
+
+    def stamp_block(self, txs, stage):
+        """Record the time all the transactions of a block reached a stage"""
+        stamp_time = self.clock.time()
+        for tx in txs:
+            self.stamp(tx, stage, stamp_time)
+
+    def discard(self, tx):
+        """Forget the stage times of a transaction that will not be mined"""
+        self.tracker_lock.acquire()
+        self.stamps.pop(tx.tx_id, None)
+        self.tracker_lock.release()
+
+    def __record(self, tx_type, tx_id):
+        """Add the durations of a stored transaction to its histograms"""
+        self.tracker_lock.acquire()
+        stamps = self.stamps.pop(tx_id)
+        histograms = self.histograms.get(tx_type)
+        if histograms is None:
+            histograms = {name: Histogram() for name, _, _ in INTERVALS}
+            self.histograms[tx_type] = histograms
+        self.tracker_lock.release()
+        for name, start, end in INTERVALS:
+            # Miner created transactions are never received or verified
+            if start in stamps and end in stamps:
+                histograms[name].record(stamps[end] - stamps[start])
+
+    def percentiles(self):
+        """Return the histogram summaries by transaction type and interval"""
+        self.tracker_lock.acquire()
+        histograms = {tx_type: dict(type_histograms) for tx_type,
+                      type_histograms in self.histograms.items()}
+        self.tracker_lock.release()
+        return {tx_type: {name: histogram.summary()
+                          for name, histogram in type_histograms.items()
+                          if histogram.count}
+                for tx_type, type_histograms in histograms.items()}
+
+    def print_summary(self):
+        """Print the percentiles of every interval for every transaction type"""
+        for tx_type, summaries in sorted(self.percentiles().items()):
+            print("Latency (seconds) of", tx_type, "transactions")
+            for name, _, _ in INTERVALS:
+                if name not in summaries:
+                    continue
+                summary = summaries[name]
+                print("    {:<11} n={:<8} p50={:.4f} p90={:.4f} p99={:.4f} "
+                      "p99.9={:.4f} max={:.4f}".format(
+                          name, summary['count'], summary['p50'],
+                          summary['p90'], summary['p99'], summary['p99.9'],
+                          summary['max']))
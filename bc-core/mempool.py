@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+"""This module provides the pool of transactions waiting to be mined.
+
+Transactions are kept in priority lanes. Transactions in strict lanes are
+always taken first, so transactions that let a cleaning period free storage
+(verified remove and user summarise transactions and miner summarised
+transactions) are put into the next block created even when there is a large
+backlog of other transactions. The remaining lanes share each block by weight.
+
+Classes:
+    Mempool: The transactions waiting to be mined, in priority lanes.
+"""
+import collections
+import threading
+import clocks
+
+
+class Mempool:
+    """Transactions waiting to be mined, kept in first in first out lanes.
+
+    The lanes are given as a list of (name, weight) pairs in priority order.
+    A weight of None makes the lane strict: its transactions are taken before
+    any transactions of later lanes. Lanes with a weight share what is left of
+    a block in proportion to their weights, and a lane with nothing waiting
+    gives its share to the others.
+
+    Methods:
+        add(tx, lane):
+            Add a transaction to the end of a lane.
+        take(num_txs):
+            Remove and return up to num_txs transactions for a block.
+        oldest_time():
+            Return when the oldest waiting transaction was added.
+        has_strict():
+            Check if any transactions are waiting in a strict lane.
+    """
+    def __init__(self, lanes=(('critical', None), ('normal', 1)), clock=None):
+        self.clock = clock or clocks.SYSTEM_CLOCK
+        self.lane_order = [name for name, _ in lanes]
+        self.weights = dict(lanes)
+        # Each lane is a deque of (time added, transaction) tuples
+        self.lanes = {name: collections.deque() for name in self.lane_order}
+        self.num_txs = 0
+        # The total number of transactions ever added
+        self.num_added = 0
+        self.mempool_lock = threading.Lock()
+
+    def __len__(self):
+        return self.num_txs
+
+    def add(self, tx, lane='normal'):
+        """Add a transaction to the end of the given lane"""
+        self.mempool_lock.acquire()
+        self.lanes[lane].append((self.clock.time(), tx))
+        self.num_txs += 1
+        self.num_added += 1
+        self.mempool_lock.release()
+
+    def lane_size(self, lane):
+        """Return the number of transactions waiting in a lane"""
+        return len(self.lanes[lane])
+
+    def has_strict(self):
+        """Check if there are transactions waiting in a strict lane"""
+        return any(self.lanes[name] for name in self.lane_order
+                   if self.weights[name] is None)
+
+    def oldest_time(self):
+        """Return the time the oldest waiting transaction was added (or None)"""
+        self.mempool_lock.acquire()
+        times = [lane[0][0] for lane in self.lanes.values() if lane]
+        self.mempool_lock.release()
+        return min(times) if times else None
+
+    def take(self, num_txs):
+        """Remove and return up to num_txs transactions for the next block"""
+        self.mempool_lock.acquire()
+        taken = []
+        # Strict lanes are emptied first, in priority order
+        for name in self.lane_order:
+            if self.weights[name] is None:
+                Mempool.__take_from(self.lanes[name], num_txs - len(taken),
+                                    taken)
+        # Share the rest of the block between the weighted lanes. Repeat
+        # until the block is full or there are no more transactions so that
+        # the share of lanes that run out is given to the other lanes.
+        while len(taken) < num_txs:
+            active = [(self.lanes[name], self.weights[name])
+                      for name in self.lane_order
+                      if self.weights[name] is not None and self.lanes[name]]
+            if not active:
+                break
+            space = num_txs - len(taken)
+            total_weight = sum(weight for _, weight in active)
+            for lane, weight in active:
+                share = max(1, space * weight // total_weight)
+                Mempool.__take_from(lane, min(share, num_txs - len(taken)),
+                                    taken)
+        self.num_txs -= len(taken)
+        self.mempool_lock.release()
+        return taken
+
+    @staticmethod
+    def __take_from(lane, num_txs, taken):
+        """Move up to num_txs transactions from the front of a lane to taken"""
+        for _ in range(min(num_txs, len(lane))):
+            taken.append(lane.popleft()[1])
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+"""This module provides the framing of objects sent between nodes and miners.
+
+Every object is pickled and sent after its length, which is written as a
+string of FRAME_SIZE_DIGITS digits. Nodes send transactions this way and
+miners use the same framing to send messages back to nodes.
+
+Methods:
+    encode_frame(obj):
+        Return the bytes of the frame for a pickled object
+    encode_pickled(pickled_obj):
+        Return the bytes of the frame for an object that is already pickled
+    send_msg(sock, obj, lock):
+        Send an object on a socket
+    recv_frame(sock):
+        Receive the pickled bytes of the next frame on a socket
+"""
+import pickle
+
+FRAME_SIZE_DIGITS = 50  # The maximum size of a frame in number of digits
+
+
+def encode_frame(obj):
+    """Pickle an object and prefix it with its padded length"""
+    return encode_pickled(pickle.dumps(obj))
+
+
+def encode_pickled(pickled_obj):
+    """Prefix the bytes of a pickled object with their padded length"""
+    obj_size = str(len(pickled_obj)).zfill(FRAME_SIZE_DIGITS)
+    return obj_size.encode('utf-8') + pickled_obj
+
+
+def send_msg(sock, obj, lock=None):
+    """Send an object on a socket.
+
+    If a lock is given it is held while sending so that frames sent by
+    different threads on the same socket are not interleaved.
+    """
+    frame = encode_frame(obj)
+    if lock:
+        with lock:
+            sock.sendall(frame)
+    else:
+        sock.sendall(frame)
+
+
+def _recv_exact(sock, num_bytes):
+    """Receive exactly num_bytes bytes. Return None if the socket closes"""
+    data = b''
+    # Continuously receive and concatenate bytes until all bytes are received
+    while len(data) < num_bytes:
+        chunk = sock.recv(num_bytes - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def recv_frame(sock):
+    """Receive the pickled bytes of the next frame (None if the socket closes)"""
+    obj_size = _recv_exact(sock, FRAME_SIZE_DIGITS)
+    if obj_size is None:
+        return None
+    return _recv_exact(sock, int(obj_size.decode('utf-8')))
@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+"""This module provides the counters and metrics endpoint of the miner.
+
+Counters are plain integers updated under a lock so that they are cheap
+enough to always be on. When a port is given, the miner serves its metrics
+over HTTP on localhost: /metrics returns one 'name value' line per metric
+and /metrics.json returns the same metrics as JSON. Rates are calculated
+from the counters between two requests. Other paths can be served by
+commands, e.g. /profile to run the sampling profiler.
+
+Classes:
+    Counters: Named counters that are incremented by the miner.
+    MetricsServer: The HTTP server for the metrics of the miner.
+
+Methods:
+    get_rss():
+        Return the resident set size of this process in bytes
+"""
+import http.server
+import json
+import os
+import resource
+import socketserver
+import threading
+import time
+import urllib.parse
+
+
+class Counters:
+    """Named counters that can be incremented from any thread.
+
+    Methods:
+        incr(name, amount):
+            Add an amount to a counter.
+        snapshot():
+            Return a copy of all counters.
+    """
+    def __init__(self, names=()):
+        self.counts = {name: 0 for name in names}
+        self.counter_lock = threading.Lock()
+
+    def incr(self, name, amount=1):
+        """Add an amount (1 by default) to the named counter"""
+        self.counter_lock.acquire()
+        self.counts[name] = self.counts.get(name, 0) + amount
+        self.counter_lock.release()
+
+    def snapshot(self):
+        """Return a dictionary of the current value of every counter"""
+        self.counter_lock.acquire()
+        counts = dict(self.counts)
+        self.counter_lock.release()
+        return counts
+
+
+def get_rss():
+    """Return the resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Not on Linux, so use the peak resident set size (in kilobytes)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _flatten(metrics, prefix=''):
+    """Flatten nested dictionaries of metrics into (name, value) tuples"""
+    for name, value in sorted(metrics.items()):
+        name = prefix + str(name).replace('.', '_')
+        if isinstance(value, dict):
+            yield from _flatten(value, name + '_')
+        elif isinstance(value, (int, float)):
+            yield name, value
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """A HTTP server that handles every request on its own thread"""
+    daemon_threads = True
+
+
+class MetricsServer:
+    """Serves the metrics of the miner over HTTP on localhost.
+
+    The collect function is called for every request and returns a (possibly
+    nested) dictionary of metrics. For every counter in the 'counters'
+    dictionary a rate per second since the previous request is added.
+    Commands map other paths to functions that take the query parameters of
+    the request and return the text to send back.
+
+    Methods:
+        start():
+            Start serving on a background thread.
+        collect():
+            Collect the metrics and add the rates of the counters.
+        close():
+            Stop the server.
+    """
+    def __init__(self, port, collect, commands=None):
+        self.port = port
+        self.collect_metrics = collect
+        self.commands = commands or {}
+        self.last_counters = None
+        self.last_time = None
+        self.rate_lock = threading.Lock()
+        self.server = _ThreadingHTTPServer(('localhost', port),
+                                           _make_handler(self))
+        self.thread = None
+
+    def start(self):
+        """Serve requests on a daemon thread"""
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='metrics_server', daemon=True)
+        self.thread.start()
+
+    def collect(self):
+        """Collect the metrics and add the rate of every counter"""
+        metrics = self.collect_metrics()
+        counters = metrics.get('counters', {})
+        curr_time = time.time()
+        self.rate_lock.acquire()
+        if self.last_counters is not None and curr_time > self.last_time:
+            elapsed = curr_time - self.last_time
+            metrics['rates'] = {
+                name: (value - self.last_counters.get(name, 0)) / elapsed
+                for name, value in counters.items()}
+        self.last_counters = counters
+        self.last_time = curr_time
+        self.rate_lock.release()
+        return metrics
+
+    def close(self):
+        """Stop serving requests"""
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _make_handler(metrics_server):
+    """Create the request handler class for a metrics server"""
+    class _Handler(http.server.BaseHTTPRequestHandler):
+        """Handles requests for the text or JSON metrics"""
+        def do_GET(self):
+            """Send the metrics in the format for the requested path"""
+            url = urllib.parse.urlsplit(self.path)
+            if url.path in metrics_server.commands:
+                params = dict(urllib.parse.parse_qsl(url.query))
+                try:
+                    body = metrics_server.commands[url.path](params)
+                except ValueError as error:
+                    self.send_error(400, str(error))
+                    return
+                body = body.encode('utf-8')
+                content_type = 'text/plain'
+            elif self.path == '/metrics.json':
+                body = json.dumps(metrics_server.collect()).encode('utf-8')
+                content_type = 'application/json'
+            elif self.path == '/metrics':
+                lines = ['{} {}'.format(name, value) for name, value
+                         in _flatten(metrics_server.collect())]
+                body = ('\n'.join(lines) + '\n').encode('utf-8')
+                content_type = 'text/plain'
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            """Don't log every request"""
+            pass
+    return _Handler
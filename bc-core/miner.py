@@ -4,137 +4,112 @@
 Classes:
     Miner: The miner that is in a blockchain. Can be used for benchmarking.
 """
-import sys
+import argparse
 import threading
 import socket
 import pickle
 import hashlib
-import time
-import multiprocessing.dummy
-import plyvel
-from Crypto.PublicKey import RSA
-from Crypto.Signature import PKCS1_v1_5
-from Crypto.Hash import SHA256
-import transaction
-import block
-from summarise import get_summary
-
-
-class Miner:
+import queue
+import admission
+import capture
+import chaindb
+import engine
+import messages
+import metrics
+import profiler
+import query
+
+
+class Miner(engine.MinerEngine):
     """The class representing a miner in a blockchain.
 
     Miner objects will open a handle to a database (and create one if it doesn't
     already exist), open up a socket for users to connect to and receive
-    transactions. Blocks are created with transactions and block transactions
-    are manipulated every cleaning period depending on their types.
+    transactions. The transactions received are given to the engine the miner
+    is built on, which creates blocks and manipulates block transactions
+    every cleaning period depending on their types.
     Benchmarking can be performed by providing the appropriate parameters
     into the constructor of this class.
 
     None of the miner methods should be invoked directly.
     """
     def __init__(self, num_txs=None, block_cap=1000000, num_stored=1000,
-                 post_cap_interval=10):
-        self.transactions = []
-        self.running_threads = []
-        # Synchronisation for block creation and list of running threads
-        self.create_sync_vars()
-        self.blocks_created = 0
-        # How many blocks can be reached before using a fixed cleaning interval
-        # This can be set to zero or one to always use a fixed cleaning interval
-        self.block_cap = block_cap
-        # How many block hashes to store when using a fixed cleaning interval
-        # More blocks = longer fixed cleaning interval but higher possibility
-        # of remove succeeding
-        self.n_blocks_stored = num_stored
-        # The fixed cleaning interval in seconds when using a fixed interval
-        self.interval_after_cap = post_cap_interval
-        try:
-            # Try to open an existing database first
-            self.db = plyvel.DB("/home/ben/mof-bc")
-            last_tuple = pickle.loads(self.db.get('last'.encode('utf-8')))
-            # Get the details of the existing database
-            # (last block created and number of blocks)
-            if last_tuple:
-                self.prev_block = pickle.loads(self.db.get(last_tuple[0]))
-                self.blocks_created = last_tuple[1]
-            else:
-                self.blocks_created = 0
-        except plyvel.Error:
-            # Database doesn't exist - create a new one
-            self.db = plyvel.DB("/home/ben/mof-bc", create_if_missing=True)
-            self.genesis = block.Block()
-            self.genesis.calc_and_set_block_hash()
-            self.prev_block = self.genesis
-            self.store_block(self.genesis)
+                 post_cap_interval=10, cleaning_budget=0.2,
+                 max_retention_lag=300, min_block_size=10, max_block_size=500,
+                 max_block_latency=2, mempool_lanes=None, tx_lanes=None,
+                 key_rate=1000, conn_rate=2000, conn_queue_size=1000,
+                 key_file=None, metrics_port=None, trace_file=None,
+                 profile_dir=None, db_path=None, port=10000, capture_file=None,
+                 query_port=None, query_workers=4, indexes=False,
+                 block_codec='raw', clock=None):
+        super().__init__(block_cap, num_stored, post_cap_interval,
+                         cleaning_budget, max_retention_lag, min_block_size,
+                         max_block_size, max_block_latency, mempool_lanes,
+                         tx_lanes, key_file, trace_file, db_path, indexes,
+                         block_codec, clock=clock)
+        # Rate limits (transactions per second) for each public key and each
+        # connection. Bursts of up to twice the rate are allowed.
+        self.admission = admission.AdmissionController(
+            key_rate, None if key_rate is None else 2 * key_rate,
+            conn_rate, None if conn_rate is None else 2 * conn_rate,
+            self.clock)
+        # How many received transactions can wait for verification on each
+        # connection before the node is throttled
+        self.conn_queue_size = conn_queue_size
+        # The connection of every received transaction that has not been
+        # mined or rejected, so that receipts can be sent back
+        self.tx_conns = {}
+        # The connections subscribed to the removal of each transaction id
+        # and the ids each connection is subscribed to
+        self.subscriptions = {}
+        self.conn_subscriptions = {}
+        self.receipt_lock = threading.Lock()
+        # The port can be changed so that several miners (e.g. benchmarks)
+        # can run on one computer
+        self.port = port
+        # The keys and frames received are written to the capture file if
+        # one is given, so that they can be replayed with replay.py
+        self.recorder = capture.Recorder(capture_file)
         self.sock = socket.socket()
         self.start_socket()
-        self.key_hash_map = {}
-        self.create_new_key()
-        self.prev_tx = 'first'
-        self.init_optimisation_variables()
-        self.tx_per_block = 10
-        # Create up to 5 threads that will create new blocks from transactions
-        self.num_create_block_threads = 5
-        # Spin up a thread that accepts new connections from users
-        self.listen_thread = threading.Thread(target=self.accept_conn)
-        self.listen_thread.start()
-        # Spin up a new thread that checks the number of transactions received
-        # and create new blocks if there are enough transactions
-        self.check_tx_thread = threading.Thread(target=self.check_num_tx)
-        self.check_tx_thread.start()
-        # Spin up a new thread that will run cleaning period operations
-        self.cleaning_thread = threading.Thread(target=self.clean_bc)
-        self.cleaning_thread.start()
+        # The sampling profiler is started by SIGUSR1 (if a directory for
+        # the profiles is given) or by requesting /profile from the metrics
+        # server
+        self.profiler = profiler.SamplingProfiler(output_dir=profile_dir or '.')
+        if profile_dir is not None:
+            self.profiler.install_signal()
+        self.metrics_server = None
+        if metrics_port is not None:
+            self.metrics_server = metrics.MetricsServer(
+                metrics_port, self.get_metrics,
+                {'/profile': self.profile_command})
+            self.metrics_server.start()
+        # Other processes can read the database through the query server
+        # while the miner has it open
+        self.query_server = None
+        if query_port is not None:
+            self.query_server = query.QueryServer(self.db, query_port,
+                                                  query_workers)
+            self.query_server.start()
         # Used to terminate the miner when benchmarking
         self.check_to_kill = False
         self.benchmark = False
         if num_txs:
             self.benchmark = True
             self.start_time = None
-            self.num_blocks = num_txs / self.tx_per_block
-
-    def create_sync_vars(self):
-        """Create all the locks used for synchronisation in this thread"""
-        self.create_block_lock = threading.Lock()
-        # Lock for the list that stores currently running threads
-        self.thread_list_lock = threading.Lock()
-        # Lock for the list that stores user summarise or remove transactions
-        # that have not been consumed by a cleaning period
-        self.user_tx_lock = threading.Lock()
-        # Lock for the list that stores transactions that need to be removed
-        self.remove_tx_lock = threading.Lock()
-        # Lock for the list that stores summarisable transactions
-        self.summarise_tx_lock = threading.Lock()
-        self.transaction_list_lock = threading.Lock()
-
-    def init_optimisation_variables(self):
-        """Create all the variables related to cleaning the blockchain."""
-        self.cleaning_interval = 20  # seconds
-        # how many blocks to create before increasing the cleaning interval
-        self.increase_cp_block_limit = 10000
-        self.cp_increase_increment = 20
-        # Python time method returns number of seconds since epoch so using
-        # a period in order of seconds is appropriate
-        self.next_cleaning_period = time.time() + self.cleaning_interval
-        # A list of tuples of transactions that need to be removed.
-        # The tuples have structure (block_hash, transaction_id, remove_time)
-        # This allows constant time for removing transactions
-        self.to_remove = []
-        # A dictionary of transaction ids to be summarised
-        # The keys of the dictionary are block hashes
-        # The values are lists of transaction ids
-        # A dictionary is used so searching for transactions to summarise is
-        # linear to the number of transactions in the dictionary otherwise
-        # the runtime is too slow
-        self.to_summarise = {}
-        # Store the remove and summarise transactions received from nodes
-        self.user_txs = [[], []]
-        # A list of the last n_blocks_stored block hashes
-        self.last_n_blocks = []
+            self.num_txs = num_txs
+        # Spin up a thread that accepts new connections from users. Threads
+        # are named after the method they run so they can be told apart in
+        # profiles.
+        self.listen_thread = threading.Thread(target=self.accept_conn,
+                                              name='accept_conn')
+        self.listen_thread.start()
+        # Start the engine threads that create blocks and clean the blockchain
+        self.start()
 
     def start_socket(self):
         """Start the socket that will listen for new connections"""
-        self.sock.bind(('localhost', 10000))
+        self.sock.bind(('localhost', self.port))
         self.sock.listen()
 
     def accept_conn(self):
@@ -146,24 +121,18 @@ class Miner:
         outside of the scope of this project
         """
         self.connections = []
+        # Locks that stop frames sent to the same node from interleaving
+        self.send_locks = {}
         while True:
             conn, addr = self.sock.accept()
             self.connections.append((conn, addr))
+            self.send_locks[conn] = threading.Lock()
             self.get_new_key(conn)
             sock_listen_thread = threading.Thread(target=self.listen_for_tx,
-                                                  args=[conn])
+                                                  args=[conn],
+                                                  name='listen_for_tx')
             sock_listen_thread.start()
 
-    def create_new_key(self):
-        """Create a new key for miner created transactions"""
-        self.key = RSA.generate(1024)
-        self.priv_key = self.key.exportKey('PEM')
-        self.pub_key = self.key.publickey().exportKey('PEM')
-        hash_algo = hashlib.sha256()
-        hash_algo.update(self.pub_key)
-        self.key_hash = hash_algo.hexdigest().encode('utf-8')
-        self.key_hash_map[self.key_hash] = self.pub_key
-
     def get_new_key(self, conn):
         """Hash and store a private key received from a node"""
         key_length = conn.recv(4).decode('utf-8')
@@ -172,73 +141,235 @@ class Miner:
         hash_algo = hashlib.sha256()
         hash_algo.update(key)
         key_hash = hash_algo.hexdigest()
-        self.key_hash_map[key_hash] = key
+        self.recorder.record_key(conn, key)
+        self.register_key(key_hash, key)
 
     def listen_for_tx(self, conn):
         """Listen for new transactions from connected users.
 
-        The digital signature of the received transactions are verified.
-        There is a limit on the number of transactions that will be stored in
-        the list so that the RAM load is eased.
+        Every transaction received must pass the rate limits of its connection
+        and of its public key hash before it is queued for verification on
+        this connection. Transactions over a limit, or that arrive when the
+        queue of this connection is full, are dropped without checking their
+        digital signature and the node is sent a throttle message telling it
+        how long to wait. Transactions that are queued are sent receipts
+        when they are accepted or rejected and when they are mined, and
+        transactions from public keys the miner does not know are sent a
+        rejected receipt.
+        Requests (dictionaries with a 'type') can be sent on the same
+        connection, e.g. to subscribe to the removal of transactions.
         """
-        int_size = 50  # The maximum size of a transaction in number of digits
-        tx_limit = 1000000
+        conn_queue = queue.Queue(self.conn_queue_size)
+        verify_thread = threading.Thread(target=self.verify_queued_txs,
+                                         args=[conn_queue],
+                                         name='verify_queued_txs')
+        verify_thread.start()
         while True:
-            if len(self.transactions) <= tx_limit:
+            try:
+                data = messages.recv_frame(conn)
+                if data is None:
+                    break
+                self.recorder.record_frame(conn, data)
+                # Check the connection limit before unpickling anything
+                allowed, retry_after = self.admission.admit_connection(conn)
+                if not allowed:
+                    self.counters.incr('txs_received')
+                    self.send_throttle(conn, 'connection', retry_after)
+                    continue
+                rcvd_tx = pickle.loads(data)  # Unpickle the received object
+                if isinstance(rcvd_tx, dict):
+                    self.handle_request(conn, rcvd_tx)
+                    continue
+                self.counters.incr('txs_received')
+                pub_key_hash = rcvd_tx.pub_key.decode('utf-8')
+                if self.get_pub_key(pub_key_hash) is None:
+                    # The signature of a transaction from an unknown key
+                    # cannot be verified, so it is rejected straight away
+                    self.counters.incr('verify_failures')
+                    self.send_to_node(conn, {'type': 'receipt',
+                                             'tx_id': rcvd_tx.tx_id,
+                                             'accepted': False,
+                                             'reason': 'unknown key'})
+                    continue
+                allowed, retry_after = self.admission.admit_key(pub_key_hash)
+                if not allowed:
+                    self.send_throttle(conn, 'key', retry_after,
+                                       rcvd_tx.tx_id)
+                    continue
+                self.latency.stamp(rcvd_tx, 'received')
+                # Remember where to send the receipts of the transaction
+                self.receipt_lock.acquire()
+                self.tx_conns[rcvd_tx.tx_id] = conn
+                self.receipt_lock.release()
                 try:
-                    obj_size = conn.recv(int_size).decode('utf-8')
-                    if not obj_size:
-                        break
-                    obj_size = int(obj_size)
-                    data = conn.recv(obj_size)
-                    # Continuously receive and concatenate bytes until the
-                    # whole pickled object is received
-                    while len(data) < obj_size:
-                        bytes_remaining = obj_size - len(data)
-                        data += conn.recv(bytes_remaining)
-                    rcvd_tx = pickle.loads(data)  # Unpickle the received object
-                    if self.verify_tx(rcvd_tx) and self.check_tx_type(rcvd_tx):
-                        self.transaction_list_lock.acquire()
-                        self.transactions.append(rcvd_tx)
-                        self.transaction_list_lock.release()
-                    if self.benchmark and not self.start_time:
-                        # If we are benchmarking and this is the first
-                        # transaction received, start the timer
-                        self.start_time = time.time()
-                except Exception:
-                    # Ignore any errors
+                    conn_queue.put_nowait(rcvd_tx)
+                except queue.Full:
+                    self.receipt_lock.acquire()
+                    self.tx_conns.pop(rcvd_tx.tx_id, None)
+                    self.receipt_lock.release()
+                    self.latency.discard(rcvd_tx)
+                    self.send_throttle(conn, 'queue', 0.1, rcvd_tx.tx_id)
                     continue
+                if self.benchmark and not self.start_time:
+                    # If we are benchmarking and this is the first
+                    # transaction received, start the timer
+                    self.start_time = self.clock.time()
+            except OSError:
+                break
+            except Exception:
+                # Ignore any errors
+                continue
+        # Stop the verification thread of this connection
+        conn_queue.put(None)
+        self.recorder.record_close(conn)
+        self.admission.remove_connection(conn)
+        self.unsubscribe(conn)
+
+    def handle_request(self, conn, request):
+        """Handle a request sent by a node instead of a transaction.
+
+        Nodes subscribe to the removal of transactions with a request of
+        type 'subscribe' and a list of 'tx_ids'. The node is sent a
+        'summarised' message if one of them is summarised and a 'removed'
+        message once it has been removed from the blockchain.
+        """
+        if request.get('type') == 'subscribe':
+            self.receipt_lock.acquire()
+            for tx_id in request['tx_ids']:
+                self.subscriptions.setdefault(tx_id, set()).add(conn)
+            self.conn_subscriptions.setdefault(conn, set()).update(
+                request['tx_ids'])
+            self.receipt_lock.release()
+
+    def unsubscribe(self, conn):
+        """Remove every subscription of a closed connection"""
+        self.receipt_lock.acquire()
+        for tx_id in self.conn_subscriptions.pop(conn, ()):
+            conns = self.subscriptions.get(tx_id)
+            if conns is not None:
+                conns.discard(conn)
+                if not conns:
+                    del self.subscriptions[tx_id]
+        self.receipt_lock.release()
+
+    def verify_queued_txs(self, conn_queue):
+        """Verify the transactions queued on a connection.
+
+        The transactions are given to the engine, which verifies their
+        digital signatures. There is a limit on the number of transactions
+        that will be stored in the list so that the RAM load is eased. While
+        the limit is reached this thread waits, the queue of the connection
+        fills up and the node is throttled.
+        """
+        while True:
+            rcvd_tx = conn_queue.get()
+            if rcvd_tx is None:
+                break
+            while len(self.transactions) > self.tx_limit:
+                self.clock.sleep(0.01)
+            self.process_tx(rcvd_tx)
+
+    def send_to_node(self, conn, msg):
+        """Send a message to a node, ignoring connections that have closed"""
+        try:
+            messages.send_msg(conn, msg, self.send_locks.get(conn))
+        except OSError:
+            pass
 
-    def verify_tx(self, tx):
-        """Check the digital signature of a received transaction"""
-        pub_key_hash = tx.pub_key.decode('utf-8')
-        pub_key = self.key_hash_map[pub_key_hash]
-        tx_hash = SHA256.new(tx.get_signature_contents())
-        key = RSA.importKey(pub_key)
-        verifier = PKCS1_v1_5.new(key)
-        verified = verifier.verify(tx_hash, tx.sig)
-        return verified
+    def send_throttle(self, conn, reason, retry_after, tx_id=None):
+        """Tell a node that a transaction was dropped and how long to wait"""
+        self.counters.incr('txs_throttled')
+        self.send_to_node(conn, {'type': 'throttle', 'reason': reason,
+                                 'retry_after': retry_after, 'tx_id': tx_id})
+
+    def on_tx_result(self, tx, accepted, reason=None):
+        """Send a node a receipt saying if its transaction was accepted"""
+        self.receipt_lock.acquire()
+        if accepted:
+            conn = self.tx_conns.get(tx.tx_id)
+        else:
+            conn = self.tx_conns.pop(tx.tx_id, None)
+        self.receipt_lock.release()
+        if conn is not None:
+            self.send_to_node(conn, {'type': 'receipt', 'tx_id': tx.tx_id,
+                                     'accepted': accepted, 'reason': reason})
+
+    def on_block_stored(self, block_hash, height, block_tx):
+        """Tell the nodes that sent the transactions of a block it is stored.
+
+        Every node is sent one 'mined' message with the block hash, height
+        and the ids of its transactions in the block.
+        """
+        conn_tx_ids = {}
+        self.receipt_lock.acquire()
+        for tx in block_tx:
+            conn = self.tx_conns.pop(tx.tx_id, None)
+            if conn is not None:
+                conn_tx_ids.setdefault(conn, []).append(tx.tx_id)
+        self.receipt_lock.release()
+        for conn, tx_ids in conn_tx_ids.items():
+            self.send_to_node(conn, {'type': 'mined', 'block_hash': block_hash,
+                                     'height': height, 'tx_ids': tx_ids})
+
+    def on_txs_summarised(self, tx_ids, summary_tx_id):
+        """Tell subscribed nodes that transactions have been summarised"""
+        self.notify_subscribers(tx_ids, {'type': 'summarised',
+                                         'summary_tx_id': summary_tx_id},
+                                False)
+
+    def on_txs_removed(self, block_hash, tx_ids):
+        """Tell subscribed nodes that transactions have been removed"""
+        self.notify_subscribers(tx_ids, {'type': 'removed',
+                                         'block_hash': block_hash}, True)
+
+    def notify_subscribers(self, tx_ids, msg, finished):
+        """Send a message to the nodes subscribed to some transactions.
+
+        Every node is sent the message once with the ids of the transactions
+        it subscribed to added as 'tx_ids'. If the subscriptions are finished
+        they are removed.
+        """
+        conn_tx_ids = {}
+        self.receipt_lock.acquire()
+        if self.subscriptions:
+            for tx_id in tx_ids:
+                if finished:
+                    conns = self.subscriptions.pop(tx_id, ())
+                else:
+                    conns = self.subscriptions.get(tx_id, ())
+                for conn in conns:
+                    conn_tx_ids.setdefault(conn, []).append(tx_id)
+                    if finished:
+                        self.conn_subscriptions[conn].discard(tx_id)
+        self.receipt_lock.release()
+        for conn, conn_ids in conn_tx_ids.items():
+            conn_msg = dict(msg)
+            conn_msg['tx_ids'] = conn_ids
+            self.send_to_node(conn, conn_msg)
 
     def close(self):
         """Clean up open sockets and database handles"""
+        if self.metrics_server:
+            self.metrics_server.close()
+        if self.query_server:
+            self.query_server.close()
         self.sock.close()
-        self.db.close()
+        self.recorder.close()
+        super().close()
 
-    def store_block(self, block_to_store):
-        """Store a created block in the database"""
-        try:
-            # Get the bytes of the block
-            byte_blocks = pickle.dumps(block_to_store)
-        except Exception:
-            return
-        with self.db.write_batch(transaction=True) as batch:
-            # Write the byte blocks to the database and update the "last block"
-            # object on the database. This operation is considered atomic.
-            block_hash = block_to_store.block_hash.encode('utf-8')
-            batch.put(block_hash, byte_blocks)
-            batch.put('last'.encode('utf-8'), pickle.dumps((block_hash,
-                                                            self.blocks_created)))
-        return
+    def profile_command(self, params):
+        """Profile the miner for a window and return the collapsed stacks.
+
+        The query parameters are 'seconds' (the length of the window) and
+        'mode', which is 'cpu' to only count threads using the CPU (default)
+        or 'wall' to count every thread in every sample.
+        """
+        seconds = float(params.get('seconds', self.profiler.window))
+        mode = params.get('mode', 'cpu')
+        if mode not in ('cpu', 'wall') or not 0 < seconds <= 300:
+            raise ValueError("seconds must be in (0, 300] and mode cpu or wall")
+        counts = self.profiler.run(seconds, mode == 'cpu')
+        return profiler.format_stacks(counts)
 
     def wait_to_kill(self):
         """Kill the process when all the processes have completed.
@@ -246,7 +377,7 @@ class Miner:
         This method will only run when the miner is started with the
         benchmarking option set to true.
         """
-        time.sleep(5)
+        self.clock.sleep(5)
         last_tx = 0
         kill_counter = 0
         while True:
@@ -256,24 +387,18 @@ class Miner:
             # that need to be removed and either there are no more transactions
             # that are waiting to be mined or the number of transactions
             # that are waiting to be mined have not changed in the last 25
-            # or so seconds.
+            # or so seconds. Partially filled blocks are created once their
+            # transactions have waited max_block_latency seconds, so no
+            # transactions need to be added to fill the last block.
             if not self.to_remove and not self.to_summarise \
                     and not self.user_txs[0] and not self.user_txs[1] \
                     and not self.running_threads and (not self.transactions
                                                       or kill_counter > 5):
-                # If there are still transactions left then create enough
-                # "filler" transactions to make up a block.
-                if self.transactions:
-                    tx_left = self.tx_per_block - len(self.transactions)
-                    for _ in range(tx_left):
-                        self.transactions.append(transaction.Transaction
-                                                 (self.prev_tx, 'filler',
-                                                  'filler', self.key_hash,
-                                                  'perm'))
-                total_time = time.time() - self.start_time
+                total_time = self.clock.time() - self.start_time
                 print("Total time =", total_time)
+                self.latency.print_summary()
                 print("Mining finished")
-                time.sleep(10)
+                self.clock.sleep(10)
                 self.close()
                 import os
                 import signal
@@ -285,338 +410,82 @@ class Miner:
                 self.thread_list_lock.acquire()
                 self.running_threads = [thread for thread
                                         in self.running_threads
-                                        if thread.isAlive()]
+                                        if thread.is_alive()]
                 self.thread_list_lock.release()
                 if len(self.transactions) == last_tx:
                     kill_counter += 1
                 else:
                     last_tx = len(self.transactions)
                     kill_counter = 0
-                time.sleep(5)
+                self.clock.sleep(5)
 
     def create_and_append_block(self, block_tx):
         """Create a block from a list of transactions"""
-        new_block = block.Block(block_tx)
-        # Lock block creation so that the blocks form a consistent chain
-        # Only lock a small part of the creation so that multiple blocks
-        # can be created at once and a small part is synchronised
-        self.create_block_lock.acquire()
-        new_block.set_prev_block(self.prev_block)
-        new_block.calc_and_set_block_hash()
-        self.prev_block = new_block
-        self.blocks_created += 1
-        # If the block cap has been reached, change the cleaning interval to
-        # a predefined fixed value
-        if self.blocks_created > self.block_cap:
-            self.cleaning_interval = self.interval_after_cap
-        store_block_thread = threading.Thread(target=self.store_block,
-                                              args=[new_block])
-        store_block_thread.start()
-        self.last_n_blocks.append(new_block.block_hash)
-        if len(self.last_n_blocks) > self.n_blocks_stored:
-            self.last_n_blocks = self.last_n_blocks[1:]
-        store_block_thread.join()
-        self.check_block_tx_types(new_block.block_hash, block_tx)
-        self.create_block_lock.release()
-        # If we are benchmarking and the number of blocks created is the number
-        # of blocks we are expecting based off the number of transactions
-        # expected, then start the thread where it waits to kill this process
-        if self.benchmark and self.blocks_created >= self.num_blocks \
+        super().create_and_append_block(block_tx)
+        # If we are benchmarking and the number of transactions mined is the
+        # number of transactions expected, then start the thread where it
+        # waits to kill this process
+        if self.benchmark and self.txs_mined >= self.num_txs \
                 and not self.check_to_kill:
             self.check_to_kill = True
-            kill_thread = threading.Thread(target=self.wait_to_kill)
+            kill_thread = threading.Thread(target=self.wait_to_kill,
+                                           name='wait_to_kill')
             kill_thread.start()
 
-    def check_block_tx_types(self, block_hash, txs):
-        """Check the types of the block transactions when a block is created.
 
-        This method checks for any temporary or miner summarisable transactions
-        in a created block. If there are any, the transaction id and block
-        hash is stored by the miner so that retrieval of these transactions
-        can be performed in constant time.
-        """
-        block_hash = block_hash.encode('utf-8')
-        for tx in txs:
-            if tx.tx_type == 'temp':
-                remove_time = tx.ttl + time.time()
-                self.to_remove.append((block_hash, tx.tx_id, remove_time))
-            elif tx.tx_type == 'summ':
-                self.summarise_tx_lock.acquire()
-                if block_hash in self.to_summarise:
-                    self.to_summarise[block_hash].append(tx.tx_id)
-                else:
-                    self.to_summarise[block_hash] = [tx.tx_id]
-                self.summarise_tx_lock.release()
-
-    def check_tx_type(self, tx):
-        """Check if the type of a received transaction is valid"""
-        valid_type = True
-        if tx.tx_type == 'perm':
-            pass
-        elif tx.tx_type == 'temp':
-            pass
-        elif tx.tx_type == 'summ':
-            pass
-        # Check transaction validity of remove and summarise transactions
-        # during a cleaning period
-        elif tx.tx_type == 'remove':
-            valid_type = False
-            self.user_tx_lock.acquire()
-            self.user_txs[1].append(tx)
-            self.user_tx_lock.release()
-        elif tx.tx_type == 'summarise':
-            valid_type = False
-            self.user_tx_lock.acquire()
-            self.user_txs[1].append(tx)
-            self.user_tx_lock.release()
-        # If the transaction type is not an accepted type
-        else:
-            valid_type = False
-        return valid_type
-
-    def block_pooling(self, block_tx):
-        """The method called by map to spawn multiple threads"""
-        if len(block_tx) != 10:
-            print("Not 10")
-        self.create_and_append_block(block_tx)
-
-    def check_num_tx(self):
-        """Check the current number of transactions in the transaction list.
-
-        Check the number of transactions waiting to be mined. If there are at
-        least 10 (or however many transactions in a block), create the
-        appropriate number of threads (maximum 5) to create new blocks with
-        those transactions and store them in the database.
-        """
-        num_threads = 5
-        create_block_pool = multiprocessing.dummy.Pool(num_threads)
-        while True:
-            if len(self.transactions) >= self.tx_per_block:
-                tx = self.transactions
-                last_num = 0
-                tx_for_block = []
-                # Create at most 5 threads for block creation. If there is
-                # less than 50 transactions, the number of threads created is
-                # the highest multiple of 10 in the stored transaction list
-                # length (e.g. if there is 37 transactions, create 3 threads)
-                threads_spawned = 5 if len(self.transactions) >= 50 \
-                    else len(self.transactions) // self.tx_per_block
-                for end_tx_index in range(1, threads_spawned + 1):
-                    # Slice the transaction list to take the first
-                    # 10 * threads_spawned number of transactions
-                    # Each list of 10 transactions is added to a list of lists
-                    # i.e. [[10 txs], [10 txs], [10 txs]] and the overall list
-                    # is passed to the method called which takes lists of
-                    # transactions as an argument. By passing one large list
-                    # of lists of transactions, we can enforce the number of
-                    # transactions each blocks receives is 10.
-                    tx_for_block.append(tx[last_num:end_tx_index
-                                           * self.tx_per_block])
-                    last_num = end_tx_index * self.tx_per_block
-                # Spin up new threads that runs the block_pooling method
-                create_block_pool.map(self.block_pooling, tx_for_block,
-                                      threads_spawned)
-                self.transaction_list_lock.acquire()
-                # Slice the list to have only unmined transactions
-                self.transactions = self.transactions[last_num:]
-                self.transaction_list_lock.release()
-
-    def remove_txs_from_bc(self):
-        """Purge the blockchain of any transactions that need to be removed."""
-        self.remove_tx_lock.acquire()
-        curr_time = time.time()
-        # Look for any transactions that need to be removed from the blockchain
-        # These transactions are all tracked in the to_remove list
-        # Temporary transactions that have past their time to live, summarisable
-        # transactions that have been summarised in the past cleaning period
-        # or transactions stored in the merkle tree of user summarise or remove
-        # transactions that have been located on the blockchain in the past
-        # cleaning period
-        to_clean_list = [(block_hash, tx_id) for block_hash, tx_id, remove_time
-                         in self.to_remove if remove_time <= curr_time]
-        # Update the to remove list to all transactions that will need to be
-        # removed in the future
-        self.to_remove = [remove_tuple for remove_tuple in self.to_remove
-                          if remove_tuple[2] > curr_time]
-        self.remove_tx_lock.release()
-        if to_clean_list:
-            block_hash_dict = {}
-            # Combine all transactions that are stored in the same block in
-            # a single list so all transactions stored in the same block that
-            # need to be removed are removed in one i/o operation
-            for block_hash, tx_id in to_clean_list:
-                if block_hash in block_hash_dict:
-                    block_hash_dict[block_hash].append(tx_id)
-                else:
-                    block_hash_dict[block_hash] = [tx_id]
-            # Remove all removable transactions from blocks and update the db
-            for block_hash, tx_id_list in block_hash_dict.items():
-                pickled_block = self.db.get(block_hash)
-                loaded_block = pickle.loads(pickled_block)
-                loaded_block.remove_txs(tx_id_list)
-                pickled_block = pickle.dumps(loaded_block)
-                self.db.put(block_hash, pickled_block)
-
-    def verify_usr_txs(self):
-        """Check some blocks to verify remove or summarise transactions"""
-        # Clone the list of user summarise or remove transactions that were
-        # received before this cleaning period and update the list of received
-        # user summarise or remove transactions so that new received
-        # transactions will be queued for verification and removal next cleaning
-        # period
-        self.user_tx_lock.acquire()
-        user_txs = self.user_txs[0].copy()
-        self.user_txs[0] = self.user_txs[1]
-        self.user_txs[1] = []
-        self.user_tx_lock.release()
-        verified_txs = []
-        if user_txs:
-            # Transform the list of remove or summarise transactions into tuples
-            # containing relevant information for each transaction
-            # (i.e. gv values, transaction ids)
-            user_txs = [(tx, tx.gv_list, tx.tx_tree.get_ids(), [])
-                        for tx in user_txs]
-            # Only consider the transactions that provide an equal number of
-            # gv values as the number of ids in the merkle tree
-            user_txs = [tx_tuple for tx_tuple in user_txs if len(tx_tuple[1])
-                        == len(tx_tuple[2])]
-            # Check existing blocks for transactions matching the transaction
-            # ids stored in the merkle tree of remove or summarise transactions
-            if self.blocks_created > self.block_cap:
-                last_n_blocks = self.last_n_blocks.copy()
-                for block_hash in last_n_blocks:
-                    pickled_block = self.db.get(block_hash.encode('utf-8'))
-                    loaded_block = pickle.loads(pickled_block)
-                    loaded_block.check_usr_txs(user_txs)
-                verified_txs = [tx_tuple for tx_tuple in user_txs
-                                if len(tx_tuple[2]) == len(tx_tuple[3])]
-            else:
-                # This part should be rewritten so that transactions that are
-                # verified are removed from the user_txs list so that the loop
-                # can early exit if all transactions are verified
-                with self.db.iterator() as it:
-                    for block_hash, pickled_block in it:
-                        if block_hash == b'last':
-                            continue
-                        loaded_block = pickle.loads(pickled_block)
-                        loaded_block.check_usr_txs(user_txs)
-                        verified_txs.extend([tx_tuple for tx_tuple in user_txs
-                                             if len(tx_tuple[2])
-                                             == len(tx_tuple[3])])
-                        user_txs = [tx_tuple for tx_tuple in user_txs
-                                    if len(tx_tuple[2]) != len(tx_tuple[3])]
-                        if not user_txs:
-                            break
-        for tx, _, _, tx_list in verified_txs:
-            # If all of the transactions in the remove or summarise transaction
-            # has been verified
-            if (tx.tx_type == 'summarise' and
-                    Miner.check_user_summ(tx, tx_list)) \
-                    or tx.tx_type == 'remove':
-                self.transaction_list_lock.acquire()
-                self.transactions.append(tx)
-                self.transaction_list_lock.release()
-                self.remove_tx_lock.acquire()
-                # Add the transaction ids from all verified transaction
-                # merkle trees to the to_remove list and give them a
-                # remove time of 0
-                self.to_remove.extend([(block_hash, tx.tx_id, 0) for tx,
-                                       block_hash in tx_list])
-                self.remove_tx_lock.release()
-
-    @staticmethod
-    def check_user_summ(tx, txs):
-        """Check the inputs and outputs of a verified user summarise transaction"""
-        txs = [tx_found for tx_found, block_hash in txs]
-        ins, outs = get_summary(txs)
-        tx_in = tx.input.split(':')
-        tx_out = tx.output.split(':')
-        return set(ins) == set(tx_in) and set(outs) == set(tx_out)
-
-    def summarise_current_txs(self):
-        """Summarise all received miner summarisable transactions"""
-        self.summarise_tx_lock.acquire()
-        summarise_tx_dict = self.to_summarise.copy()
-        self.to_summarise = {}
-        self.summarise_tx_lock.release()
-        summarise_txs = []
-        for block_hash in summarise_tx_dict:
-            pickled_block = self.db.get(block_hash)
-            try:
-                loaded_block = pickle.loads(pickled_block)
-                for tx_id in summarise_tx_dict[block_hash]:
-                    summarise_txs.append(loaded_block.get_tx(tx_id))
-            except pickle.UnpicklingError:
-                continue
-        self.remove_tx_lock.acquire()
-        # Track the summarisable transactions for removal next cleaning period
-        for block_hash, tx_id_list in summarise_tx_dict.items():
-            for tx_id in tx_id_list:
-                self.to_remove.append((block_hash, tx_id, 0))  # Remove time of 0
-        self.remove_tx_lock.release()
-        (inputs, outputs) = get_summary(summarise_txs)
-        if inputs and outputs:
-            # Create a new transaction
-            summarised = transaction.Transaction(self.prev_tx, ':'.join(inputs),
-                                                 ':'.join(outputs),
-                                                 self.key_hash, 'summarised')
-            self.prev_tx = summarised.tx_id
-            self.transaction_list_lock.acquire()
-            self.transactions.append(summarised)
-            self.transaction_list_lock.release()
-
-    def clean_bc(self):
-        """A continuously running method that will purge the blockchain.
-
-        This method runs while the miner is active and every cleaning period it
-        will remove all transactions to be removed, summarise miner summarisable
-        transactions and attempt to verify received remove or user summarise
-        transaction. If it is not the next cleaning period, the thread that
-        this method is running on will sleep.
-        """
-        while True:
-            # If it is the next cleaning period
-            if time.time() > self.next_cleaning_period:
-                # Update the next cleaning period time
-                self.next_cleaning_period = time.time() + self.cleaning_interval
-                if self.to_remove:
-                    # Start the remove transaction thread
-                    remove_tx_thread = threading.Thread(target=self.remove_txs_from_bc)
-                    self.thread_list_lock.acquire()
-                    self.running_threads.append(remove_tx_thread)
-                    self.thread_list_lock.release()
-                    remove_tx_thread.start()
-                if self.user_txs:
-                    self.verify_usr_txs()
-                # Start the miner summarise thread
-                if self.to_summarise:
-                    summarise_thread = threading.Thread(target=self.summarise_current_txs)
-                    self.thread_list_lock.acquire()
-                    self.running_threads.append(summarise_thread)
-                    self.thread_list_lock.release()
-                    summarise_thread.start()
-                # If the cleaning interval is still in a dynamic state, update
-                # the cleaning interval to be an appropriate amount given the
-                # number of blocks currently on the blockchain
-                if self.increase_cp_block_limit < self.blocks_created <= self.block_cap:
-                    self.cleaning_interval = self.cp_increase_increment * \
-                                             self.blocks_created // self.increase_cp_block_limit
-            else:
-                self.thread_list_lock.acquire()
-                # Remove finished threads from the running thread list
-                self.running_threads = [thread for thread in
-                                        self.running_threads if thread.isAlive()]
-                self.thread_list_lock.release()
-                # Sleep for 5% of the cleaning interval time or 1 second,
-                # whichever is smaller
-                sleep_time = min(1, self.cleaning_interval // 20)
-                time.sleep(sleep_time)
+def parse_args(argv=None):
+    """Parse the command line arguments of the miner script"""
+    parser = argparse.ArgumentParser(description='Start a blockchain miner.')
+    parser.add_argument('num_txs', type=int, nargs='?',
+                        help='benchmark: exit once this many transactions '
+                             'are mined and cleaning has finished')
+    parser.add_argument('--db', help='database directory (default {})'.format(
+        chaindb.DB_PATH))
+    parser.add_argument('--port', type=int, default=10000)
+    parser.add_argument('--metrics-port', type=int)
+    parser.add_argument('--trace-file')
+    parser.add_argument('--profile-dir', default='.',
+                        help='directory profiles started by SIGUSR1 go to')
+    parser.add_argument('--key-file')
+    parser.add_argument('--query-port', type=int,
+                        help='port to serve read only queries of the chain on')
+    parser.add_argument('--query-workers', type=int, default=4)
+    parser.add_argument('--indexes', action='store_true',
+                        help='index transactions by public key and blocks '
+                             'by time')
+    parser.add_argument('--block-codec', default='raw',
+                        choices=sorted(chaindb.CODECS),
+                        help='codec blocks are compressed with when stored')
+    parser.add_argument('--capture-file',
+                        help='file to record the keys and frames received to')
+    parser.add_argument('--block-cap', type=int, default=1000000)
+    parser.add_argument('--num-stored', type=int, default=1000)
+    parser.add_argument('--post-cap-interval', type=float, default=10)
+    parser.add_argument('--cleaning-budget', type=float, default=0.2)
+    parser.add_argument('--max-retention-lag', type=float, default=300)
+    parser.add_argument('--min-block-size', type=int, default=10)
+    parser.add_argument('--max-block-size', type=int, default=500)
+    parser.add_argument('--max-block-latency', type=float, default=2)
+    parser.add_argument('--key-rate', type=float, default=1000)
+    parser.add_argument('--conn-rate', type=float, default=2000)
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
-    num_txs_received = None
-    try:
-        num_txs_received = int(sys.argv[1])
-    except IndexError:
-        exit()
-    miner = Miner(num_txs_received)
+    args = parse_args()
+    # Send SIGUSR1 to the miner to write a profile to the profile directory
+    miner = Miner(args.num_txs, block_cap=args.block_cap,
+                  num_stored=args.num_stored,
+                  post_cap_interval=args.post_cap_interval,
+                  cleaning_budget=args.cleaning_budget,
+                  max_retention_lag=args.max_retention_lag,
+                  min_block_size=args.min_block_size,
+                  max_block_size=args.max_block_size,
+                  max_block_latency=args.max_block_latency,
+                  key_rate=args.key_rate, conn_rate=args.conn_rate,
+                  key_file=args.key_file, metrics_port=args.metrics_port,
+                  trace_file=args.trace_file, profile_dir=args.profile_dir,
+                  db_path=args.db, port=args.port,
+                  capture_file=args.capture_file, query_port=args.query_port,
+                  query_workers=args.query_workers, indexes=args.indexes,
+                  block_codec=args.block_codec)
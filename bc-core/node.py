@@ -3,32 +3,117 @@
 
 Classes:
     Node: Represents a non miner participant in the blockchain.
+    Receipt: The futures of the receipts sent by the miner for a transaction.
+    TransactionRejected: The exception raised by the futures of a transaction
+                         the miner will not mine.
 """
 
+import concurrent.futures
 import socket
 import pickle
 import hashlib
+import threading
+import queue
+import itertools
+import multiprocessing
 from Crypto.PublicKey import RSA
 from Crypto.Signature import PKCS1_v1_5
 from Crypto.Hash import SHA256
 from Crypto.Cipher import AES
+import clocks
+import keystore
+import messages
 import summarise
 import transaction
 
+
+# The signer and gvs of the node that started a signing worker process
+_worker_state = None
+
+
+def _calc_gv_key(gvs, tx_id):
+    """Calculate the key used to encrypt the transaction id for a transaction"""
+    sha256 = hashlib.sha256()
+    # The encryption key is a SHA256 hash of the gvs and the transaction
+    # id of the created transaction
+    sha256.update((gvs + tx_id).encode('UTF-8'))
+    return sha256.digest()
+
+
+def _init_signing_worker(priv_key, gvs):
+    """Load the key of the node in a signing worker process"""
+    global _worker_state
+    _worker_state = (PKCS1_v1_5.new(RSA.importKey(priv_key)), gvs)
+
+
+def _sign_in_worker(tx):
+    """Calculate the gv and digital signature of a transaction in a worker"""
+    signer, gvs = _worker_state
+    aes_cipher = AES.new(_calc_gv_key(gvs, tx.tx_id))
+    tx.set_gv(aes_cipher.encrypt(tx.tx_id))
+    return tx.gv, signer.sign(SHA256.new(tx.get_signature_contents()))
+
+
+class TransactionRejected(Exception):
+    """The miner will not mine a transaction, e.g. its signature is invalid"""
+    def __init__(self, tx_id, reason):
+        super().__init__("Transaction {} was rejected: {}".format(tx_id, reason))
+        self.tx_id = tx_id
+        self.reason = reason
+
+
+class Receipt:
+    """The futures of the receipts sent by the miner for a transaction.
+
+    Callbacks can be added to either future with add_done_callback. Both
+    futures raise TransactionRejected if the miner will not mine the
+    transaction and ConnectionError if the connection closes first.
+
+    Attributes:
+        tx_id: The id of the transaction.
+        accepted: Done (with the result True) once the miner has verified
+                  the transaction and will mine it.
+        mined: Done once the transaction has been stored in a block. The
+               result is the hash and height of the block.
+    """
+    def __init__(self, tx_id):
+        self.tx_id = tx_id
+        self.accepted = concurrent.futures.Future()
+        self.mined = concurrent.futures.Future()
+
+    def reject(self, error):
+        """Fail the futures that are not done yet with an exception"""
+        for future in (self.accepted, self.mined):
+            if not future.done():
+                future.set_exception(error)
+
+
 class Node:
     """This class represents a normal user on the blockchain.
 
     Methods for creating a new user, connecting to a miner and sending
     transactions are available in this class. Public/private keypair creation
     is automated and calculation of generator verifier values is handled as well.
+    Messages sent back by the miner are received on a background thread. When
+    the miner throttles this node, sending waits until the miner is ready and
+    the ids of dropped transactions are kept in dropped_txs. Transactions
+    sent with track set return a Receipt that is completed by the receipts
+    the miner sends back, so that the node does not have to poll the
+    blockchain to find out if they were mined.
 
     Methods:
         create_tx(input, output, type, ttl, gv, tree):
             Create a transaction.
-        send_tx(tx):
+        send_tx(tx, track):
             Send the transaction given.
+        subscribe(tx_ids):
+            Get futures that are done once transactions have been removed.
         create_and_send_tx(input, output, type, ttl, gv, tree):
             Create a transaction and send it.
+        create_txs(tx_args, processes, batch_size):
+            Create and sign many transactions in a process pool.
+        send_txs(tx_args, processes, queue_size):
+            Create many transactions and send them while others are signed.
         sign_tx(tx):
             Digitally sign the given transaction.
         calc_gv_key(tx_id):
@@ -46,10 +131,25 @@ class Node:
         close():
             Close the connection to the socket.
     """
-    def __init__(self, gvs='password'):
+    def __init__(self, gvs='password', key_file=None, key=None,
+                 port=10000, clock=None):
+        """Create a node and connect it to the miner.
+
+        Arguments:
+            gvs: The generator verifier secret of this node.
+            key_file: A file the node's key is loaded from (or saved to if it
+                      doesn't exist) so the node keeps the same identity.
+            key: An exported private key to use, e.g. one from a key pool.
+            port: The port of the miner on this computer.
+            clock: The clock used for transaction times and throttling, e.g.
+                   the simulated clock of the miner.
+        """
         self.sock = socket.socket()
-        self.sock.connect(('localhost', 10000))
-        self.key = RSA.generate(1024)
+        self.sock.connect(('localhost', port))
+        if key:
+            self.key = RSA.importKey(key)
+        else:
+            self.key = keystore.load_or_create_key(key_file)
         self.priv_key = self.key.exportKey('PEM')
         self.pub_key = self.key.publickey().exportKey('PEM')
         self.signer = PKCS1_v1_5.new(self.key)
@@ -57,6 +157,18 @@ class Node:
         self.hash_pub_key()
         self.last_tx = 'first'
         self.gvs = gvs
+        self.clock = clock or clocks.SYSTEM_CLOCK
+        # Sending is paused until this time when the miner throttles the node
+        self.throttled_until = 0
+        self.dropped_txs = []
+        # The receipts of tracked transactions and the futures of subscribed
+        # transactions with the id of the transaction that summarised them
+        self.receipts = {}
+        self.subscriptions = {}
+        self.receipt_lock = threading.Lock()
+        self.msg_thread = threading.Thread(target=self.listen_for_msgs,
+                                           daemon=True)
+        self.msg_thread.start()
 
     def hash_pub_key(self):
         """Calculate the SHA256 hash of the public key used by this user."""
@@ -93,32 +205,217 @@ class Node:
             gv_list: The list of gv values if the transaction is remove or summarise.
             tx_tree: The transaction id merkle tree if the transaction is remove or summarise.
         """
+        tx = self.build_tx(self.last_tx, input_string, output_string, tx_type,
+                           ttl, gv_list, tx_tree)
+        self.calc_encrypted_id(tx)
+        tx.set_signature(self.sign_tx(tx))
+        return tx
+
+    def build_tx(self, prev_id, input_string, output_string, tx_type="perm",
+                 ttl=None, gv_list=None, tx_tree=None):
+        """Create an unsigned transaction following the given transaction id"""
         if ttl:
-            tx = transaction.Transaction(self.last_tx, input_string,
+            tx = transaction.Transaction(prev_id, input_string,
                                          output_string, self.key_hash,
-                                         tx_type, ttl)
+                                         tx_type, ttl, clock=self.clock)
         # Creating a remove or summarise transaction
         elif gv_list:
-            tx = transaction.Transaction(self.last_tx, input_string,
+            tx = transaction.Transaction(prev_id, input_string,
                                          output_string, self.key_hash, tx_type,
-                                         gv_list=gv_list, tx_tree=tx_tree)
+                                         gv_list=gv_list, tx_tree=tx_tree,
+                                         clock=self.clock)
         else:
-            tx = transaction.Transaction(self.last_tx, input_string,
-                                         output_string, self.key_hash, tx_type)
-        self.calc_encrypted_id(tx)
-        tx.set_signature(self.sign_tx(tx))
+            tx = transaction.Transaction(prev_id, input_string,
+                                         output_string, self.key_hash, tx_type,
+                                         clock=self.clock)
         return tx
 
-    def send_tx(self, tx):
-        """Send a created transaction to the connected miner"""
-        pickled_tx = pickle.dumps(tx)
-        pickle_size = str(len(pickled_tx))
-        while len(pickle_size) < 50:
-            pickle_size = '0' + pickle_size
-        pickle_size = pickle_size.encode('utf-8')
-        self.sock.send(pickle_size)
-        self.sock.send(pickled_tx)
+    def create_txs(self, tx_args, processes=None, batch_size=1024):
+        """Create transactions and sign them across a pool of processes.
+
+        Each item of tx_args is a tuple of the arguments to create_tx. The
+        transactions are created in order in this process so that each one
+        follows the id of the one before it, and the signed transactions are
+        returned by this generator in the same order. Transactions are signed
+        in batches and the next batch is signed while the current one is
+        returned, so at most two batches are held in memory.
+
+        Arguments:
+            tx_args: An iterable of create_tx argument tuples.
+            processes: The number of signing processes (defaults to the
+                       number of CPUs).
+            batch_size: The number of transactions signed at a time.
+        """
+        unsigned_txs = self.__chain_txs(tx_args)
+        pool = multiprocessing.Pool(processes, _init_signing_worker,
+                                    (self.priv_key, self.gvs))
+        try:
+            batch = list(itertools.islice(unsigned_txs, batch_size))
+            signing = pool.map_async(_sign_in_worker, batch)
+            while batch:
+                # Start signing the next batch before returning this one
+                next_batch = list(itertools.islice(unsigned_txs, batch_size))
+                next_signing = pool.map_async(_sign_in_worker, next_batch)
+                for tx, (gv, sig) in zip(batch, signing.get()):
+                    tx.set_gv(gv)
+                    tx.set_signature(sig)
+                    yield tx
+                batch, signing = next_batch, next_signing
+        finally:
+            pool.terminate()
+
+    def __chain_txs(self, tx_args):
+        """Create unsigned transactions that each follow the previous one"""
+        prev_id = self.last_tx
+        for args in tx_args:
+            tx = self.build_tx(prev_id, *args)
+            prev_id = tx.tx_id
+            yield tx
+
+    def send_txs(self, tx_args, processes=None, queue_size=1000):
+        """Create, sign and send many transactions.
+
+        Transactions are signed in a pool of processes (see create_txs) and
+        put on a bounded queue that a sending thread takes them from, so
+        sending overlaps with signing. Return the ids of the transactions
+        sent, in order.
+        """
+        send_queue = queue.Queue(queue_size)
+        send_thread = threading.Thread(target=self.__send_queued_txs,
+                                       args=[send_queue])
+        send_thread.start()
+        tx_ids = []
+        try:
+            for tx in self.create_txs(tx_args, processes):
+                send_queue.put(tx)
+                tx_ids.append(tx.tx_id)
+        finally:
+            send_queue.put(None)
+            send_thread.join()
+        return tx_ids
+
+    def __send_queued_txs(self, send_queue):
+        """Send the transactions put on the queue until None is put on it"""
+        while True:
+            tx = send_queue.get()
+            if tx is None:
+                break
+            self.send_tx(tx)
+
+    def send_tx(self, tx, track=False):
+        """Send a created transaction to the connected miner.
+
+        If track is set, a Receipt for the transaction is returned.
+        """
+        wait_time = self.throttled_until - self.clock.time()
+        if wait_time > 0:
+            self.clock.sleep(wait_time)
+        receipt = None
+        if track:
+            # Register the receipt first, the miner can reply at any time
+            receipt = Receipt(tx.tx_id)
+            self.receipt_lock.acquire()
+            self.receipts[tx.tx_id] = receipt
+            self.receipt_lock.release()
+        messages.send_msg(self.sock, tx)
         self.last_tx = tx.tx_id
+        return receipt
+
+    def subscribe(self, tx_ids):
+        """Subscribe to the removal of transactions from the blockchain.
+
+        Returns a dictionary of a future for every transaction id. A future
+        is done once its transaction has been removed, e.g. because its time
+        to live has passed or it was summarised. The result is a dictionary
+        of the 'block_hash' it was removed from and the 'summary_tx_id' of
+        the transaction that summarised it (None if it was not summarised).
+        """
+        futures = {}
+        self.receipt_lock.acquire()
+        for tx_id in tx_ids:
+            futures[tx_id] = concurrent.futures.Future()
+            self.subscriptions[tx_id] = [futures[tx_id], None]
+        self.receipt_lock.release()
+        messages.send_msg(self.sock, {'type': 'subscribe',
+                                      'tx_ids': list(tx_ids)})
+        return futures
+
+    def listen_for_msgs(self):
+        """Receive and handle the messages sent back by the miner"""
+        while True:
+            try:
+                data = messages.recv_frame(self.sock)
+            except OSError:
+                break
+            if data is None:
+                break
+            self.handle_msg(pickle.loads(data))
+        # Nothing more will be received for the transactions still waiting
+        error = ConnectionError("The connection to the miner closed")
+        self.receipt_lock.acquire()
+        receipts = list(self.receipts.values())
+        subscriptions = list(self.subscriptions.values())
+        self.receipts = {}
+        self.subscriptions = {}
+        self.receipt_lock.release()
+        for receipt in receipts:
+            receipt.reject(error)
+        for future, _ in subscriptions:
+            future.set_exception(error)
+
+    def handle_msg(self, msg):
+        """Handle a message received from the miner"""
+        if msg['type'] == 'throttle':
+            self.throttled_until = max(self.throttled_until,
+                                       self.clock.time() + msg['retry_after'])
+            if msg['tx_id']:
+                self.dropped_txs.append(msg['tx_id'])
+                self.reject_tx(msg['tx_id'], 'throttled ({})'.format(
+                    msg['reason']))
+        elif msg['type'] == 'receipt':
+            if msg['accepted']:
+                receipt = self.receipts.get(msg['tx_id'])
+                if receipt and not receipt.accepted.done():
+                    receipt.accepted.set_result(True)
+            else:
+                self.reject_tx(msg['tx_id'], msg['reason'])
+        elif msg['type'] == 'mined':
+            self.receipt_lock.acquire()
+            receipts = [self.receipts.pop(tx_id, None)
+                        for tx_id in msg['tx_ids']]
+            self.receipt_lock.release()
+            for receipt in receipts:
+                if receipt:
+                    # Transactions can be mined before their accepted receipt
+                    # is received
+                    if not receipt.accepted.done():
+                        receipt.accepted.set_result(True)
+                    receipt.mined.set_result((msg['block_hash'],
+                                              msg['height']))
+        elif msg['type'] == 'summarised':
+            self.receipt_lock.acquire()
+            for tx_id in msg['tx_ids']:
+                if tx_id in self.subscriptions:
+                    self.subscriptions[tx_id][1] = msg['summary_tx_id']
+            self.receipt_lock.release()
+        elif msg['type'] == 'removed':
+            self.receipt_lock.acquire()
+            subscriptions = [self.subscriptions.pop(tx_id, None)
+                             for tx_id in msg['tx_ids']]
+            self.receipt_lock.release()
+            for subscription in subscriptions:
+                if subscription:
+                    future, summary_tx_id = subscription
+                    future.set_result({'block_hash': msg['block_hash'],
+                                       'summary_tx_id': summary_tx_id})
+
+    def reject_tx(self, tx_id, reason):
+        """Fail the receipt of a transaction the miner will not mine"""
+        self.receipt_lock.acquire()
+        receipt = self.receipts.pop(tx_id, None)
+        self.receipt_lock.release()
+        if receipt:
+            receipt.reject(TransactionRejected(tx_id, reason))
 
     def create_and_send_tx(self, input_string, output_string, tx_type="perm",
                            ttl=None, gv_list=None, tx_tree=None):
@@ -139,11 +436,7 @@ class Node:
 
     def calc_gv_key(self, tx_id):
         """Calculate the key used to encrypt the transaction id for a transaction"""
-        sha256 = hashlib.sha256()
-        # The encryption key is a SHA256 hash of the gvs and the transaction
-        # id of the created transaction
-        sha256.update((self.gvs + tx_id).encode('UTF-8'))
-        return sha256.digest()
+        return _calc_gv_key(self.gvs, tx_id)
 
     def calc_encrypted_id(self, tx):
         """Calculate the encrypted id for a transaction using a generated key"""
@@ -0,0 +1,157 @@
+#!/usr/bin/python3
+"""This module provides a sampling profiler that can be started while running.
+
+The stacks of all threads are sampled with sys._current_frames() at a fixed
+rate for a window of time. Each sample is counted as a collapsed stack (the
+thread name and the functions from outermost to innermost separated by
+semicolons, followed by a count) which can be rendered as a flame graph with
+flamegraph.pl or speedscope. Unlike cProfile, nothing is slowed down until
+the profiler is started and only one thread is added while it runs.
+
+By default only threads that used CPU time since the previous sample are
+counted, so threads blocked on sockets, locks or sleeps don't hide the
+threads that are busy. Threads are named after the method they run so the
+stacks show which part of the miner is using the CPU.
+
+Classes:
+    SamplingProfiler: Samples thread stacks for a window of time.
+
+Methods:
+    format_stacks(counts):
+        Return collapsed stacks as lines of text.
+"""
+import os
+import signal
+import sys
+import threading
+import time
+
+
+def _thread_cpu_time(thread_id):
+    """Return the CPU time used by a thread, or None if it can't be found"""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+    except (AttributeError, OSError, OverflowError):
+        return None
+
+
+def format_stacks(counts):
+    """Return collapsed stacks as 'frame;frame;frame count' lines"""
+    return ''.join('{} {}\n'.format(stack, count) for stack, count
+                   in sorted(counts.items()))
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads in this process.
+
+    A window can be run on the calling thread with run(), or on a background
+    thread with start() which writes the stacks to a file in output_dir when
+    the window ends. install_signal() starts a window whenever the process
+    receives a signal (SIGUSR1 by default).
+
+    Methods:
+        run(window, cpu_only):
+            Sample for a window of time and return the stack counts.
+        start(window):
+            Sample on a background thread and write the stacks to a file.
+        is_running():
+            Check if a background window is running.
+        install_signal(signum):
+            Start a background window when the signal is received.
+    """
+    def __init__(self, rate=100, window=10, output_dir='.', cpu_only=True):
+        # Samples per second
+        self.rate = rate
+        # The default number of seconds to sample for
+        self.window = window
+        self.output_dir = output_dir
+        self.cpu_only = cpu_only
+        self.thread = None
+        self.start_lock = threading.Lock()
+
+    def run(self, window=None, cpu_only=None):
+        """Sample every thread for a window of time.
+
+        Returns a dictionary of collapsed stack -> number of samples.
+        """
+        if window is None:
+            window = self.window
+        if cpu_only is None:
+            cpu_only = self.cpu_only
+        own_id = threading.get_ident()
+        interval = 1 / self.rate
+        counts = {}
+        cpu_times = {}
+        next_sample = time.time()
+        end_time = next_sample + window
+        while next_sample < end_time:
+            names = {thread.ident: thread.name
+                     for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if cpu_only:
+                    cpu_time = _thread_cpu_time(thread_id)
+                    last_cpu_time = cpu_times.get(thread_id)
+                    cpu_times[thread_id] = cpu_time
+                    # Skip threads that were idle since the previous sample.
+                    # Nothing is known about a thread the first time it is
+                    # seen, or if its CPU time can't be read.
+                    if cpu_time is not None and (last_cpu_time is None or
+                                                 cpu_time <= last_cpu_time):
+                        continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{}:{}'.format(
+                        os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                stack = ';'.join(reversed(stack))
+                counts[stack] = counts.get(stack, 0) + 1
+            next_sample += interval
+            time.sleep(max(0, next_sample - time.time()))
+        return counts
+
+    def start(self, window=None):
+        """Start sampling on a background thread.
+
+        The stacks are written to profile-<pid>-<time>.folded in the output
+        directory when the window ends. Returns False if a window is already
+        running.
+        """
+        self.start_lock.acquire()
+        if self.is_running():
+            self.start_lock.release()
+            return False
+        self.thread = threading.Thread(target=self.__run_to_file,
+                                       args=[window], name='profiler',
+                                       daemon=True)
+        self.thread.start()
+        self.start_lock.release()
+        return True
+
+    def is_running(self):
+        """Check if a background sampling window is running"""
+        return self.thread is not None and self.thread.is_alive()
+
+    def __run_to_file(self, window):
+        """Sample for a window and write the stacks to a new file"""
+        counts = self.run(window)
+        path = os.path.join(self.output_dir, 'profile-{}-{}.folded'.format(
+            os.getpid(), time.strftime('%Y%m%d-%H%M%S')))
+        with open(path, 'w') as profile_file:
+            profile_file.write(format_stacks(counts))
+        print("Profile written to", path, file=sys.stderr)
+
+    def install_signal(self, signum=signal.SIGUSR1):
+        """Start a background sampling window when a signal is received.
+
+        Signal handlers can only be installed from the main thread, so
+        returns False if called from any other thread.
+        """
+        try:
+            signal.signal(signum, lambda received, frame: self.start())
+        except ValueError:
+            return False
+        return True
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+"""This module provides the verification of merkle inclusion proofs.
+
+A proof shows that a transaction is stored in a block without the block
+itself. It is the path of sibling hashes from the leaf of the transaction up
+to the root of the block's merkle tree, so it has O(log n) hashes for a block
+of n transactions. A light client that knows the hash of a block (e.g. from
+a stats or range query) checks the proof together with the block's previous
+block hash and timestamp, which are hashed with the root to get the block
+hash.
+
+Every step of a proof is a (sibling hash, side) tuple where side is LEFT if
+the sibling comes before the node on the path and RIGHT if it comes after
+it. The sibling hash is None for a node that is the only child of its parent.
+
+Only this module and hashlib are needed to verify a proof.
+
+Methods:
+    hash_children(child_hashes):
+        Calculate the hash of a merkle tree node from its children's hashes
+    get_root(tx_id, proof):
+        Calculate the merkle root a proof leads to
+    verify_proof(tx_id, proof, root):
+        Check a proof against a merkle root
+    verify_block_proof(tx_id, proof, block_hash, prev_block_hash, timestamp):
+        Check a proof against a block hash
+"""
+import hashlib
+
+LEFT = 'left'
+RIGHT = 'right'
+
+
+def hash_children(child_hashes):
+    """Calculate the hash of a merkle tree node from its children's hashes"""
+    hash_algo = hashlib.sha256()
+    for child_hash in child_hashes:
+        hash_algo.update(child_hash.encode('utf-8'))
+    return hash_algo.hexdigest()
+
+
+def get_root(tx_id, proof):
+    """Calculate the merkle root that a proof for a transaction leads to"""
+    node_hash = tx_id
+    for sibling_hash, side in proof:
+        if sibling_hash is None:
+            node_hash = hash_children([node_hash])
+        elif side == LEFT:
+            node_hash = hash_children([sibling_hash, node_hash])
+        elif side == RIGHT:
+            node_hash = hash_children([node_hash, sibling_hash])
+        else:
+            raise ValueError("unknown side {}".format(side))
+    return node_hash
+
+
+def verify_proof(tx_id, proof, root):
+    """Check that a proof shows a transaction is in the tree with a root"""
+    return get_root(tx_id, proof) == root
+
+
+def verify_block_proof(tx_id, proof, block_hash, prev_block_hash, timestamp):
+    """Check that a proof shows a transaction is in the block with a hash.
+
+    The block hash is calculated as in Block.calc_and_set_block_hash from the
+    previous block hash, the merkle root the proof leads to and the block's
+    timestamp (milliseconds).
+    """
+    block_hash_algo = hashlib.sha256()
+    block_hash_algo.update(prev_block_hash.encode('utf-8'))
+    block_hash_algo.update(get_root(tx_id, proof).encode('utf-8'))
+    block_hash_algo.update(str(timestamp).encode('utf-8'))
+    return block_hash_algo.hexdigest() == block_hash
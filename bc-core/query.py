@@ -0,0 +1,395 @@
+#!/usr/bin/python3
+"""This module provides read only queries of a live blockchain database.
+
+LevelDB only lets one process open a database, so the miner serves queries
+of its database to other programs over a socket on localhost. Requests and
+responses are JSON objects, one per line. Every request has an 'op' (the
+query to run) and the arguments of the query, and may have an 'id' that is
+returned in its response. Responses have 'ok' set and the 'result' of the
+query, or 'ok' unset and an 'error'.
+
+Queries are run by a pool of worker threads, not by the threads that create
+blocks or clean the blockchain, and every query reads a snapshot of the
+database so it sees a consistent chain while blocks are being written.
+
+Queries:
+    block: The block with a 'hash' or at a 'height'. The transactions are
+           included unless 'txs' is false.
+    tx: The transaction with a 'tx_id' and the hash of its block.
+    stats: The height and hash of the last block and the number of blocks.
+    range: The blocks from height 'start' up to (not including) 'stop', at
+           most 'limit' of them. 'next' is the height to continue from.
+    key_txs: The transactions sent by the public key with SHA256 hash
+             'pub_key', in the order they were mined, at most 'limit' of
+             them. 'next' is the 'cursor' to continue from.
+    time_blocks: The blocks created from time 'start' up to (not including)
+                 'stop' (milliseconds), at most 'limit' of them. The
+                 transactions are included if 'txs' is true. 'next' is the
+                 'cursor' to continue from.
+    proof: The merkle inclusion proof of the transaction with a 'tx_id' in
+           the block with hash 'block_hash' (found with the index of
+           transactions or a scan if not given), with the previous block
+           hash and timestamp needed to check it against the block hash
+           (see proofs.py). Fails if the transaction is not stored.
+
+key_txs and time_blocks need a database with secondary indexes (see
+chaindb), and tx uses the index of transactions when there is one. A 'limit'
+must be at least 1, and is lowered to the max_range of the server. A 'cursor'
+that is not in the range of its query (e.g. one from the key_txs of another
+key) is rejected.
+
+Classes:
+    QueryServer: Serves queries of a database over a socket.
+    QueryClient: Sends queries to a query server.
+    QueryError: The error raised by the client when a query fails.
+
+Methods:
+    tx_to_dict(tx):
+        Get the fields of a transaction that can be written as JSON.
+    block_to_dict(block, height, include_txs):
+        Get the fields of a block that can be written as JSON.
+"""
+import json
+import queue
+import socket
+import threading
+import chaindb
+
+
+def tx_to_dict(tx):
+    """Get the fields of a transaction that can be written as JSON"""
+    tx_dict = {'tx_id': tx.tx_id, 'type': tx.tx_type,
+               'prev_tx_id': tx.prev_tx_id, 'input': tx.input,
+               'output': tx.output, 'pub_key': tx.pub_key.decode('utf-8'),
+               'time': tx.time}
+    if tx.tx_type == 'temp':
+        tx_dict['ttl'] = tx.ttl
+    elif tx.tx_type in ('remove', 'summarise'):
+        tx_dict['tx_ids'] = tx.tx_tree.get_ids()
+    return tx_dict
+
+
+def block_to_dict(block, height=None, include_txs=True):
+    """Get the fields of a block that can be written as JSON"""
+    tx_count = getattr(block, 'tx_count', None)
+    if tx_count is None:
+        # Blocks stored before tx_count was added only have the transactions
+        # still in them to count
+        tx_count = len(block.get_tx_ids())
+    block_dict = {'hash': block.block_hash, 'height': height,
+                  'prev_hash': block.prev_block_hash,
+                  'timestamp': int(block.timestamp),
+                  'tx_count': tx_count}
+    if include_txs:
+        block_dict['txs'] = [tx_to_dict(tx) for tx in block.get_block_txs()]
+    return block_dict
+
+
+class QueryError(Exception):
+    """A query sent to a query server failed"""
+
+
+class QueryServer:
+    """Serves read only queries of a blockchain database over a socket.
+
+    Methods:
+        start():
+            Start accepting connections and answering queries.
+        answer(request):
+            Run a query and return its response.
+        close():
+            Stop accepting connections.
+    """
+    QUERIES = ('block', 'tx', 'stats', 'range', 'key_txs', 'time_blocks',
+               'proof')
+
+    def __init__(self, db, port, num_workers=4, max_range=1000):
+        self.db = db
+        self.port = port
+        self.num_workers = num_workers
+        # The most blocks or transactions returned by a query
+        self.max_range = max_range
+        # Requests from every connection waiting for a worker
+        self.requests = queue.Queue()
+        self.sock = socket.socket()
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('localhost', port))
+        self.sock.listen()
+
+    def start(self):
+        """Start the threads that accept connections and answer queries"""
+        threading.Thread(target=self.accept_conn, name='query_accept',
+                         daemon=True).start()
+        for _ in range(self.num_workers):
+            threading.Thread(target=self.answer_requests, name='query_worker',
+                             daemon=True).start()
+
+    def accept_conn(self):
+        """Accept connections and read their requests on a thread each"""
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.read_requests, args=[conn],
+                             name='query_conn', daemon=True).start()
+
+    def read_requests(self, conn):
+        """Queue the requests received on a connection for the workers"""
+        send_lock = threading.Lock()
+        with conn.makefile('rb') as conn_file:
+            for line in conn_file:
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                    if not isinstance(request, dict):
+                        raise ValueError("requests must be JSON objects")
+                except ValueError as error:
+                    QueryServer.send_response(conn, send_lock, {
+                        'id': None, 'ok': False, 'error': str(error)})
+                    continue
+                self.requests.put((conn, send_lock, request))
+        conn.close()
+
+    def answer_requests(self):
+        """Answer queued requests and send the responses"""
+        while True:
+            conn, send_lock, request = self.requests.get()
+            QueryServer.send_response(conn, send_lock, self.answer(request))
+
+    @staticmethod
+    def send_response(conn, send_lock, response):
+        """Send a response as a line of JSON"""
+        line = json.dumps(response) + '\n'
+        send_lock.acquire()
+        try:
+            conn.sendall(line.encode('utf-8'))
+        except OSError:
+            pass
+        send_lock.release()
+
+    def answer(self, request):
+        """Run a query on a snapshot of the database and return the response"""
+        response = {'id': request.get('id')}
+        try:
+            if request.get('op') not in QueryServer.QUERIES:
+                raise ValueError("unknown query {}".format(request.get('op')))
+            query = getattr(self, 'query_' + request['op'])
+            with self.db.snapshot() as snapshot:
+                response['result'] = query(snapshot, request)
+            response['ok'] = True
+        except Exception as error:
+            response['ok'] = False
+            response['error'] = str(error) or type(error).__name__
+        return response
+
+    @staticmethod
+    def load_block(snapshot, block_hash):
+        """Load the block with a hash (None if there is no such block)"""
+        key = block_hash.encode('utf-8')
+        pickled_block = snapshot.get(key) if chaindb.is_block_key(key) \
+            else None
+        if pickled_block is None:
+            return None
+        return chaindb.decode_block(pickled_block, snapshot)
+
+    def query_block(self, snapshot, request):
+        """Get a block by its hash or height"""
+        height = request.get('height')
+        if height is not None:
+            block_hash = snapshot.get(chaindb.height_key(int(height)))
+            if block_hash is None:
+                raise ValueError("no block at height {}".format(height))
+            block_hash = block_hash.decode('utf-8')
+        else:
+            block_hash = request['hash']
+        loaded_block = QueryServer.load_block(snapshot, block_hash)
+        if loaded_block is None:
+            raise ValueError("no block with hash {}".format(block_hash))
+        return block_to_dict(loaded_block, height, request.get('txs', True))
+
+    @staticmethod
+    def check_indexed(snapshot):
+        """Raise an error if the database has no secondary indexes"""
+        if snapshot.get(chaindb.INDEXED_KEY) is None:
+            raise ValueError("the database has no secondary indexes, start "
+                             "the miner with --indexes")
+
+    def get_limit(self, request):
+        """Get the number of items a query may return.
+
+        Raises a ValueError if the limit is below 1, as a page with no items
+        has no cursor to continue from.
+        """
+        limit = int(request.get('limit', self.max_range))
+        if limit < 1:
+            raise ValueError("limit must be at least 1, not {}".format(limit))
+        return min(limit, self.max_range)
+
+    @staticmethod
+    def find_tx(snapshot, tx_id):
+        """Find the block a transaction is stored in.
+
+        Uses the index of transactions if the database has one, otherwise
+        every block is read. Returns the block and the transaction, and
+        raises an error if the transaction is not stored.
+        """
+        if snapshot.get(chaindb.INDEXED_KEY) is not None:
+            block_hash = snapshot.get(chaindb.TX_PREFIX +
+                                      tx_id.encode('utf-8'))
+            if block_hash is not None:
+                loaded_block = chaindb.decode_block(snapshot.get(block_hash),
+                                                    snapshot)
+                tx = loaded_block.get_tx(tx_id)
+                if tx is not None:
+                    return loaded_block, tx
+        else:
+            for _, pickled_block in chaindb.iter_blocks(snapshot):
+                loaded_block = chaindb.decode_block(pickled_block, snapshot)
+                tx = loaded_block.get_tx(tx_id)
+                if tx is not None:
+                    return loaded_block, tx
+        raise ValueError("no transaction with id {}".format(tx_id))
+
+    def query_tx(self, snapshot, request):
+        """Find a transaction by its id"""
+        loaded_block, tx = QueryServer.find_tx(snapshot, request['tx_id'])
+        return {'block_hash': loaded_block.block_hash, 'tx': tx_to_dict(tx)}
+
+    def query_proof(self, snapshot, request):
+        """Get the merkle inclusion proof of a transaction"""
+        tx_id = request['tx_id']
+        if request.get('block_hash') is not None:
+            loaded_block = QueryServer.load_block(snapshot,
+                                                  request['block_hash'])
+            if loaded_block is None:
+                raise ValueError("no block with hash {}".format(
+                    request['block_hash']))
+        else:
+            loaded_block, _ = QueryServer.find_tx(snapshot, tx_id)
+        proof = loaded_block.get_proof(tx_id)
+        if proof is None:
+            if loaded_block.get_tx(tx_id) is not None:
+                raise ValueError("block {} was created before merkle proofs "
+                                 "were supported".format(
+                                     loaded_block.block_hash))
+            raise ValueError("no transaction with id {} in block {}".format(
+                tx_id, loaded_block.block_hash))
+        return {'tx_id': tx_id, 'block_hash': loaded_block.block_hash,
+                'prev_hash': loaded_block.prev_block_hash,
+                'timestamp': int(loaded_block.timestamp),
+                'proof': [list(step) for step in proof]}
+
+    def query_stats(self, snapshot, request):
+        """Get the height and hash of the last block"""
+        last = chaindb.get_last(snapshot)
+        if last is None:
+            return {'height': None, 'last_hash': None, 'blocks': 0}
+        return {'height': last[1], 'last_hash': last[0].decode('utf-8'),
+                'blocks': last[1] + 1}
+
+    def query_range(self, snapshot, request):
+        """Get the blocks in a range of heights"""
+        start = int(request.get('start', 0))
+        stop = request.get('stop')
+        limit = self.get_limit(request)
+        include_txs = request.get('txs', False)
+        blocks = []
+        next_height = None
+        for height, block_hash in chaindb.iter_heights(
+                snapshot, start, None if stop is None else int(stop)):
+            if len(blocks) == limit:
+                next_height = height
+                break
+            loaded_block = chaindb.decode_block(snapshot.get(block_hash),
+                                                snapshot)
+            blocks.append(block_to_dict(loaded_block, height, include_txs))
+        return {'blocks': blocks, 'next': next_height}
+
+    def query_key_txs(self, snapshot, request):
+        """Get a page of the transactions sent by a public key"""
+        QueryServer.check_indexed(snapshot)
+        key_hash = request['pub_key'].encode('utf-8')
+        cursor = request.get('cursor')
+        limit = self.get_limit(request)
+        txs = []
+        next_cursor = None
+        # The index key of the last transaction returned
+        last_key = None
+        # Transactions of the same block are next to each other in the
+        # index, so every block is only unpickled once per page
+        loaded_blocks = {}
+        for key, tx_id, block_hash in chaindb.iter_key_txs(
+                snapshot, key_hash,
+                None if cursor is None else cursor.encode('utf-8')):
+            if len(txs) == limit:
+                next_cursor = last_key.decode('utf-8')
+                break
+            if block_hash not in loaded_blocks:
+                loaded_blocks[block_hash] = chaindb.decode_block(
+                    snapshot.get(block_hash), snapshot)
+            txs.append({'block_hash': block_hash.decode('utf-8'),
+                        'tx': tx_to_dict(
+                            loaded_blocks[block_hash].get_tx(tx_id))})
+            last_key = key
+        return {'txs': txs, 'next': next_cursor}
+
+    def query_time_blocks(self, snapshot, request):
+        """Get a page of the blocks created in a time range"""
+        QueryServer.check_indexed(snapshot)
+        stop = request.get('stop')
+        cursor = request.get('cursor')
+        limit = self.get_limit(request)
+        include_txs = request.get('txs', False)
+        blocks = []
+        next_cursor = None
+        # The index key of the last block returned
+        last_key = None
+        for key, block_hash, height in chaindb.iter_time_blocks(
+                snapshot, int(request.get('start', 0)),
+                None if stop is None else int(stop),
+                None if cursor is None else cursor.encode('utf-8')):
+            if len(blocks) == limit:
+                next_cursor = last_key.decode('utf-8')
+                break
+            loaded_block = chaindb.decode_block(snapshot.get(block_hash),
+                                                snapshot)
+            blocks.append(block_to_dict(loaded_block, height, include_txs))
+            last_key = key
+        return {'blocks': blocks, 'next': next_cursor}
+
+    def close(self):
+        """Stop accepting connections"""
+        self.sock.close()
+
+
+class QueryClient:
+    """Sends queries to the query server of a miner.
+
+    Methods:
+        query(op, **arguments):
+            Run a query and return its result.
+        close():
+            Close the connection to the server.
+    """
+    def __init__(self, port):
+        self.sock = socket.create_connection(('localhost', port))
+        self.sock_file = self.sock.makefile('rb')
+        self.next_id = 0
+
+    def query(self, op, **arguments):
+        """Run a query and return its result. Raises QueryError if it failed"""
+        self.next_id += 1
+        request = dict(arguments, op=op, id=self.next_id)
+        self.sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        line = self.sock_file.readline()
+        if not line:
+            raise QueryError("The query server closed the connection")
+        response = json.loads(line.decode('utf-8'))
+        if not response['ok']:
+            raise QueryError(response['error'])
+        return response['result']
+
+    def close(self):
+        """Close the connection to the query server"""
+        self.sock_file.close()
+        self.sock.close()
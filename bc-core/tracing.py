@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+"""This module provides structured tracing of the miner's cleaning periods.
+
+A span covers a cleaning period or one of its phases. Spans record when they
+started and ended, the blocks read and written, the bytes written and the
+transactions affected, and how long was spent in each sub-step. Finished
+spans are written to a file as one JSON object per line so that slow
+cleaning periods can be analysed afterwards (see analyse_trace.py).
+
+The start and end of a span are timestamps of the miner's clock (see
+clocks.py), but durations are the real time measured with time.perf_counter.
+Durations are the cost the interval controller schedules cleaning periods
+with, and a simulated clock does not move while a phase runs.
+
+Classes:
+    Tracer: Creates spans and writes them to a file.
+"""
+import itertools
+import json
+import threading
+import time
+import clocks
+
+# The work counted by every span
+WORK_FIELDS = ('blocks_read', 'blocks_written', 'bytes', 'txs')
+
+
+class Tracer:
+    """Creates spans and writes finished spans to a JSON lines file.
+
+    If no path is given, spans still measure their work (so it can be used
+    by the miner) but nothing is written. Spans are timestamped with the
+    clock given, or the system clock.
+
+    Methods:
+        span(name, parent, on_end, **attributes):
+            Create and start a span.
+        write(record):
+            Write a record as a line of JSON.
+        close():
+            Close the trace file.
+    """
+    def __init__(self, path=None, clock=None):
+        self.trace_file = open(path, 'a') if path else None
+        self.clock = clock or clocks.SYSTEM_CLOCK
+        self.span_ids = itertools.count(1)
+        self.write_lock = threading.Lock()
+
+    def span(self, name, parent=None, on_end=None, **attributes):
+        """Create and start a span.
+
+        Arguments:
+            name: The name of the span, e.g. the cleaning phase.
+            parent: The span this span is part of.
+            on_end: A function called with the span when it ends.
+            attributes: Extra values written with the span.
+        """
+        return _Span(self, name, parent, on_end, attributes)
+
+    def write(self, record):
+        """Write a record to the trace file as a line of JSON"""
+        if not self.trace_file:
+            return
+        line = json.dumps(record) + '\n'
+        self.write_lock.acquire()
+        self.trace_file.write(line)
+        self.trace_file.flush()
+        self.write_lock.release()
+
+    def close(self):
+        """Close the trace file"""
+        if self.trace_file:
+            self.trace_file.close()
+            self.trace_file = None
+
+
+class _Span:
+    """A timed part of a cleaning period and the work done in it.
+
+    Spans can be used as context managers or ended with end(). The time
+    spent in sub-steps is measured with the step(name) context manager.
+    """
+    def __init__(self, tracer, name, parent, on_end, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.span_id = next(tracer.span_ids)
+        self.parent = parent
+        self.on_end = on_end
+        self.attributes = attributes
+        self.work = dict.fromkeys(WORK_FIELDS, 0)
+        self.steps = {}
+        self.span_lock = threading.Lock()
+        self.start = tracer.clock.time()
+        self.end_time = None
+        # The durations of the span and its steps are measured in real time
+        self.perf_start = time.perf_counter()
+        self.perf_end = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.end()
+        return False
+
+    def add(self, **work):
+        """Add to the work counted by this span (see WORK_FIELDS)"""
+        self.span_lock.acquire()
+        for field, amount in work.items():
+            self.work[field] += amount
+        self.span_lock.release()
+
+    def step(self, name):
+        """Return a context manager that adds its time to a sub-step"""
+        return _Step(self, name)
+
+    def add_step_time(self, name, elapsed):
+        """Add the time spent in a sub-step"""
+        self.span_lock.acquire()
+        self.steps[name] = self.steps.get(name, 0) + elapsed
+        self.span_lock.release()
+
+    def duration(self):
+        """Return the time from the start to the end (or now) of the span"""
+        perf_end = self.perf_end if self.perf_end else time.perf_counter()
+        return perf_end - self.perf_start
+
+    def end(self, **attributes):
+        """End the span and write it to the trace"""
+        self.perf_end = time.perf_counter()
+        self.end_time = self.tracer.clock.time()
+        self.attributes.update(attributes)
+        record = {'name': self.name, 'id': self.span_id,
+                  'parent': self.parent.span_id if self.parent else None,
+                  'start': self.start, 'end': self.end_time,
+                  'duration': self.duration(),
+                  'steps': self.steps}
+        record.update(self.work)
+        record.update(self.attributes)
+        self.tracer.write(record)
+        if self.on_end:
+            self.on_end(self)
+
+
+class _Step:
+    """Context manager that adds its running time to a step of a span"""
+    def __init__(self, span, name):
+        self.span = span
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.span.add_step_time(self.name, time.perf_counter() - self.start)
+        return False
@@ -7,6 +7,7 @@ Classes:
 """
 import hashlib
 import time
+import clocks
 
 class Transaction:
     """Class representing transactions sent on the blockchain.
@@ -25,7 +26,7 @@ class Transaction:
             Set the generator verifier for this transaction.
     """
     def __init__(self, prev_id, input_data, output_data, pk, tx_type, ttl=None,
-                 gv_list=None, tx_tree=None):
+                 gv_list=None, tx_tree=None, clock=None):
         # The passed in transaction type is checked so that extra fields are not
         # erroneously saved. e.g. Only if the transaction type is temp will the
         # ttl field be saved as an object variable.
@@ -35,7 +36,8 @@ class Transaction:
         self.pub_key = pk  # The hashed public key of the node
         self.tx_id = self.__calc_id()
         self.tx_type = tx_type
-        self.time = time.time()
+        # The clock is not kept so that transactions can be pickled
+        self.time = (clock or clocks.SYSTEM_CLOCK).time()
         if tx_type == 'temp':
             self.ttl = ttl
         elif tx_type in ('remove', 'summarise'):
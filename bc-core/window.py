@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+"""This module provides the rolling window of the most recently created blocks.
+
+Once the block cap is reached, the miner only looks for the transactions in
+remove or user summarise transactions in the last few blocks created. The
+window keeps the block hash and a compact set of transaction ids for each of
+these blocks in memory so that only blocks that actually contain a requested
+transaction have to be read from the database.
+
+Classes:
+    BlockWindow: The rolling window of recently created blocks.
+"""
+import collections
+import threading
+
+
+def _compact_id(tx_id):
+    """Return the first 64 bits of a hex transaction id as an integer"""
+    return int(tx_id[:16], 16)
+
+
+class BlockWindow:
+    """A fixed size window of the block hashes and transaction ids of the most
+    recently created blocks.
+
+    The oldest block is evicted when a block is added to a full window.
+    Transaction ids are stored as 64 bit integers rather than hex strings.
+    A match in the window means the block very likely contains the
+    transaction, so the block still has to be checked after it is loaded.
+
+    Methods:
+        add(block_hash, tx_ids):
+            Add a newly created block to the window.
+        find(tx_ids):
+            Return the hashes of blocks in the window that may contain any of
+            the given transaction ids.
+    """
+    def __init__(self, size):
+        self.blocks = collections.deque(maxlen=size)
+        # Blocks are added while cleaning periods search the window
+        self.window_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def add(self, block_hash, tx_ids):
+        """Add a block and its transaction ids, evicting the oldest block"""
+        compact_ids = frozenset(_compact_id(tx_id) for tx_id in tx_ids)
+        self.window_lock.acquire()
+        self.blocks.append((block_hash, compact_ids))
+        self.window_lock.release()
+
+    def find(self, tx_ids):
+        """Get the hashes of blocks that may store a transaction in tx_ids"""
+        wanted = set(_compact_id(tx_id) for tx_id in tx_ids)
+        self.window_lock.acquire()
+        blocks = list(self.blocks)
+        self.window_lock.release()
+        return [block_hash for block_hash, compact_ids in blocks
+                if not compact_ids.isdisjoint(wanted)]
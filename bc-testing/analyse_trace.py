@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+"""Report the slowest cleaning periods in a miner trace file.
+
+For every cleaning period, the phases (remove, verify, summarise) that ran in
+it are found, and the phase and sub-step that took the most time are shown
+along with the blocks read and written and the bytes written.
+
+Arguments:
+    1. The trace file written by a miner started with a trace_file
+    2. The number of periods to show (optional, default 10)
+"""
+import json
+import sys
+
+
+def load_periods(path):
+    """Load the cleaning periods in a trace file and attach their phases"""
+    periods = {}
+    phases = []
+    with open(path) as trace_file:
+        for line in trace_file:
+            span = json.loads(line)
+            if span['name'] == 'cleaning_period':
+                span['phases'] = []
+                periods[span['id']] = span
+            else:
+                phases.append(span)
+    for phase in phases:
+        if phase['parent'] in periods:
+            periods[phase['parent']]['phases'].append(phase)
+    return list(periods.values())
+
+
+def dominant(durations):
+    """Return the name and time of the largest duration in a dictionary"""
+    if not durations:
+        return None, 0
+    name = max(durations, key=durations.get)
+    return name, durations[name]
+
+
+def print_period(period):
+    """Print the breakdown of a cleaning period"""
+    phase_times = {}
+    for phase in period['phases']:
+        phase_times[phase['name']] = phase_times.get(phase['name'], 0) + \
+            phase['duration']
+    phase_name, phase_time = dominant(phase_times)
+    print("Period {} took {:.3f}s (interval after {:.1f}s, backlog {})".format(
+        period['id'], period['duration'], period.get('interval', 0),
+        period.get('backlog', 0)))
+    if phase_name is None:
+        print("    No phases ran")
+        return
+    share = phase_time / period['duration'] * 100 if period['duration'] else 0
+    print("    Dominant phase: {} ({:.3f}s, {:.0f}% of the period)".format(
+        phase_name, phase_time, share))
+    for phase in sorted(period['phases'], key=lambda p: -p['duration']):
+        step_name, step_time = dominant(phase['steps'])
+        print("    {:<10} {:8.3f}s  read {:<6} written {:<6} bytes {:<10} "
+              "txs {:<6} slowest step {} ({:.3f}s)".format(
+                  phase['name'], phase['duration'], phase['blocks_read'],
+                  phase['blocks_written'], phase['bytes'], phase['txs'],
+                  step_name, step_time))
+
+
+def print_totals(periods):
+    """Print the total time spent in each phase and sub-step"""
+    totals = {}
+    for period in periods:
+        for phase in period['phases']:
+            phase_totals = totals.setdefault(phase['name'], {'total': 0})
+            phase_totals['total'] += phase['duration']
+            for step, step_time in phase['steps'].items():
+                phase_totals[step] = phase_totals.get(step, 0) + step_time
+    print("Total time by phase over", len(periods), "periods")
+    for phase_name, phase_totals in sorted(totals.items(),
+                                           key=lambda t: -t[1]['total']):
+        steps = ', '.join('{} {:.3f}s'.format(step, step_time) for step,
+                          step_time in sorted(phase_totals.items(),
+                                              key=lambda t: -t[1])
+                          if step != 'total')
+        print("    {:<10} {:8.3f}s  ({})".format(phase_name,
+                                                 phase_totals['total'], steps))
+
+
+if __name__ == "__main__":
+    all_periods = load_periods(sys.argv[1])
+    num_shown = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    print_totals(all_periods)
+    print()
+    print("Slowest", min(num_shown, len(all_periods)), "cleaning periods")
+    for slow_period in sorted(all_periods,
+                              key=lambda p: -p['duration'])[:num_shown]:
+        print_period(slow_period)
@@ -0,0 +1,339 @@
+#!/usr/bin/python3
+"""Benchmark the miner with scenarios of different transaction types.
+
+Every scenario starts a miner in its own process, with a new database in a
+temporary directory and its own ports, and sends it load with load_gen.py.
+While the scenario runs, the memory, threads and CPU time of the miner are
+sampled from /proc and its metrics endpoint is polled until every
+transaction has been mined and every cleaning period has finished. The
+results (throughput, latency percentiles, peak memory, database size and
+number of blocks) are written as JSON and can be compared against the
+results of an earlier run.
+
+Scenarios are declared in SCENARIOS. Each has the load_gen.py mix of
+transaction types and optionally the number of transactions covered by
+remove and summarise transactions and extra miner arguments. With --replay
+every scenario is sent the traffic of a capture file (see replay.py) instead
+of its mix, so that miner changes are compared on exactly the same input.
+
+Example:
+    ./bench.py --count 50000 --rate 2000 --output results.json
+    ./bench.py --scenarios perm temp_10 --count 50000 --baseline results.json
+    ./bench.py --scenarios perm --replay run.capture --speed max
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import plyvel
+import chaindb
+import load_gen
+import node
+import replay
+
+SCENARIOS = {
+    'perm': {'mix': 'perm=100'},
+    'temp_10': {'mix': 'perm=90,temp=10'},
+    'temp_50': {'mix': 'perm=50,temp=50'},
+    'temp_100': {'mix': 'temp=100'},
+    'summ_10': {'mix': 'perm=90,summ=10'},
+    'summ_50': {'mix': 'perm=50,summ=50'},
+    'summ_100': {'mix': 'summ=100'},
+    # One remove or summarise transaction for about every 100 transactions,
+    # each covering group_size of the sender's permanent transactions
+    'remove_100': {'mix': 'perm=99,remove=1', 'group_size': 100},
+    'remove_10': {'mix': 'perm=99,remove=1', 'group_size': 10},
+    'summarise_100': {'mix': 'perm=99,summarise=1', 'group_size': 100},
+    'summarise_10': {'mix': 'perm=99,summarise=1', 'group_size': 10},
+    'combined': {'mix': 'perm=60,temp=15,summ=15,remove=5,summarise=5',
+                 'group_size': 10},
+    # Every cleaning period after the first block only looks at recent blocks
+    'combined_capped': {'mix': 'perm=60,temp=15,summ=15,remove=5,summarise=5',
+                        'group_size': 10, 'miner': ['--block-cap', '1']},
+}
+# Results compared against the baseline and whether higher or lower is better
+COMPARED = (('throughput', 'higher'), ('end_to_end_p99', 'lower'),
+            ('peak_rss', 'lower'), ('cpu_seconds', 'lower'),
+            ('db_size', 'lower'))
+
+
+def free_port():
+    """Find a port on localhost that is not in use"""
+    sock = socket.socket()
+    sock.bind(('localhost', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class _ProcessSampler:
+    """Samples the memory, threads and CPU time of a process from /proc"""
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.max_threads = 0
+        self.cpu_seconds = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.__sample, daemon=True)
+
+    def start(self):
+        """Start sampling on a background thread"""
+        self.thread.start()
+
+    def stop(self):
+        """Stop sampling and wait for the sampling thread"""
+        self.stop_event.set()
+        self.thread.join()
+
+    def __sample(self):
+        """Sample the process until stopped or the process exits"""
+        clock_ticks = os.sysconf('SC_CLK_TCK')
+        while True:
+            try:
+                with open('/proc/{}/status'.format(self.pid)) as status:
+                    for line in status:
+                        name, value = line.split(':', 1)
+                        if name == 'VmHWM':
+                            # The kernel keeps the peak resident set size
+                            self.peak_rss = int(value.split()[0]) * 1024
+                        elif name == 'Threads':
+                            self.max_threads = max(self.max_threads,
+                                                   int(value))
+                with open('/proc/{}/stat'.format(self.pid)) as stat:
+                    # The fields after the command name, which can contain
+                    # spaces, start with the state (field 3)
+                    fields = stat.read().rsplit(')', 1)[1].split()
+                    self.cpu_seconds = (int(fields[11]) + int(fields[12])) / \
+                        clock_ticks
+            except (OSError, ValueError, IndexError):
+                return
+            if self.stop_event.wait(self.interval):
+                return
+
+
+def get_metrics(port):
+    """Get the metrics of a miner, or None if they can't be fetched"""
+    url = 'http://localhost:{}/metrics.json'.format(port)
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return json.loads(response.read().decode('utf-8'))
+    except (OSError, urllib.error.URLError, ValueError):
+        return None
+
+
+def is_idle(metrics):
+    """Check if a miner has handled every transaction it has received"""
+    counters = metrics['counters']
+    handled = counters['txs_verified'] + counters['verify_failures'] + \
+        counters['txs_throttled']
+    return handled >= counters['txs_received'] and \
+        not metrics['mempool']['depth'] and not metrics['to_remove'] and \
+        not metrics['to_summarise'] and not metrics['user_txs']
+
+
+def db_size(path):
+    """Get the total size in bytes of the files in a directory"""
+    size = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            size += os.path.getsize(os.path.join(dir_path, file_name))
+    return size
+
+
+def count_blocks(path):
+    """Count the blocks stored in a database"""
+    db = plyvel.DB(path)
+    blocks = sum(1 for _ in chaindb.iter_blocks(db))
+    db.close()
+    return blocks
+
+
+def summarise_latency(latency):
+    """Get the largest end to end p99 latency over all transaction types"""
+    return max((intervals['end_to_end']['p99'] for intervals
+                in latency.values() if 'end_to_end' in intervals), default=0)
+
+
+def start_miner(args, work_dir, port, metrics_port, miner_args):
+    """Start a miner process and wait for its metrics endpoint"""
+    log_file = open(os.path.join(work_dir, 'miner.log'), 'w')
+    command = [sys.executable, args.miner, '--db', os.path.join(work_dir, 'db'),
+               '--port', str(port), '--metrics-port', str(metrics_port),
+               '--profile-dir', work_dir] + miner_args
+    process = subprocess.Popen(command, stdout=log_file,
+                               stderr=subprocess.STDOUT,
+                               cwd=os.path.dirname(args.miner))
+    log_file.close()
+    deadline = time.time() + 30
+    while get_metrics(metrics_port) is None:
+        if process.poll() is not None or time.time() > deadline:
+            process.kill()
+            with open(os.path.join(work_dir, 'miner.log')) as log:
+                raise RuntimeError("The miner did not start:\n" + log.read())
+        time.sleep(0.1)
+    return process
+
+
+def wait_until_idle(metrics_port, process, timeout):
+    """Wait until the miner has mined and cleaned everything it received.
+
+    Returns the last metrics, the time the last transaction was mined and
+    whether the timeout was reached first.
+    """
+    deadline = time.time() + timeout
+    last_mined = None
+    last_mined_time = time.time()
+    while True:
+        metrics = get_metrics(metrics_port)
+        if metrics is None:
+            raise RuntimeError("The miner exited with code {}".format(
+                process.poll()))
+        mined = metrics['counters']['txs_mined']
+        if mined != last_mined:
+            last_mined = mined
+            last_mined_time = time.time()
+        elif is_idle(metrics):
+            return metrics, last_mined_time, False
+        if time.time() > deadline:
+            return metrics, last_mined_time, True
+        time.sleep(0.5)
+
+
+def run_scenario(name, scenario, args):
+    """Run a scenario and return its results"""
+    work_dir = tempfile.mkdtemp(prefix='bench-{}-'.format(name))
+    port = free_port()
+    metrics_port = free_port()
+    process = start_miner(args, work_dir, port, metrics_port,
+                          scenario.get('miner', []))
+    sampler = _ProcessSampler(process.pid)
+    sampler.start()
+    if args.replay:
+        load_report = replay.run(replay.parse_args([
+            args.replay, '--speed', args.speed, '--port', str(port)]))
+    else:
+        load_report = load_gen.run(load_gen.parse_args([
+            '--identities', str(args.identities),
+            '--workers', str(args.workers), '--rate', str(args.rate),
+            '--count', str(args.count), '--arrival', args.arrival,
+            '--mix', scenario['mix'],
+            '--group-size', str(scenario.get('group_size', 5)),
+            '--port', str(port)] +
+            (['--key-pool', args.key_pool] if args.key_pool else []) +
+            (['--seed', str(args.seed)] if args.seed is not None else [])))
+    metrics, last_mined_time, timed_out = wait_until_idle(
+        metrics_port, process, args.timeout)
+    sampler.stop()
+    process.terminate()
+    process.wait()
+    # The time from the first transaction sent to the last one mined
+    elapsed = last_mined_time - load_report['start']
+    txs_mined = metrics['counters']['txs_mined']
+    results = {
+        'mix': 'replay' if args.replay else scenario['mix'],
+        'load': load_report,
+        'timed_out': timed_out,
+        'elapsed': elapsed,
+        'txs_mined': txs_mined,
+        'throughput': txs_mined / elapsed if elapsed > 0 else 0,
+        'latency': metrics['latency'],
+        'end_to_end_p99': summarise_latency(metrics['latency']),
+        'store_latency': metrics['store_latency'],
+        'cleaning_periods': metrics['cleaning_periods'],
+        'peak_rss': sampler.peak_rss,
+        'max_threads': sampler.max_threads,
+        'cpu_seconds': sampler.cpu_seconds,
+        'db_size': db_size(os.path.join(work_dir, 'db')),
+        'blocks': count_blocks(os.path.join(work_dir, 'db')),
+        'counters': metrics['counters'],
+    }
+    if args.keep:
+        results['work_dir'] = work_dir
+    else:
+        shutil.rmtree(work_dir)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the change from the baseline of every scenario in both.
+
+    Returns a list of (scenario, result name) tuples of the results that are
+    worse than the baseline by more than the tolerance (a fraction).
+    """
+    regressions = []
+    for name, scenario_results in sorted(results.items()):
+        if name not in baseline:
+            continue
+        print("Scenario", name)
+        for result_name, better in COMPARED:
+            new = scenario_results[result_name]
+            old = baseline[name][result_name]
+            change = (new - old) / old if old else 0
+            worse = change < -tolerance if better == 'higher' \
+                else change > tolerance
+            if worse:
+                regressions.append((name, result_name))
+            print("    {:<16} {:>14.4f} -> {:>14.4f} {:+7.1%}{}".format(
+                result_name, old, new, change, '  REGRESSION' if worse else ''))
+    return regressions
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments of the benchmark harness"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS),
+                        help='scenarios to run (default all)')
+    parser.add_argument('--count', type=int, default=10000,
+                        help='transactions sent in every scenario')
+    parser.add_argument('--rate', type=float, default=1000)
+    parser.add_argument('--arrival', default='constant',
+                        choices=('constant', 'poisson', 'burst'))
+    parser.add_argument('--identities', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--key-pool', help='key pool made by gen_keys.py')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--replay', help='capture file to send instead of '
+                                         'the scenario mix')
+    parser.add_argument('--speed', default='max',
+                        help="replay speed: 'recorded', 'max' or a multiple")
+    parser.add_argument('--timeout', type=float, default=600,
+                        help='seconds to wait for the miner after sending')
+    parser.add_argument('--miner', default=os.path.join(
+        os.path.dirname(os.path.abspath(node.__file__)), 'miner.py'))
+    parser.add_argument('--output', help='file to write the JSON results to')
+    parser.add_argument('--baseline', help='results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='fractional change counted as a regression')
+    parser.add_argument('--keep', action='store_true',
+                        help='keep the database and log of every scenario')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    all_results = {}
+    for scenario_name in arguments.scenarios or sorted(SCENARIOS):
+        print("Running", scenario_name, file=sys.stderr)
+        all_results[scenario_name] = run_scenario(
+            scenario_name, SCENARIOS[scenario_name], arguments)
+    output = {'time': time.time(), 'count': arguments.count,
+              'rate': arguments.rate, 'scenarios': all_results}
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(output, output_file, indent=2)
+    else:
+        print(json.dumps(output, indent=2))
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline_file:
+            baseline_results = json.load(baseline_file)['scenarios']
+        if compare(all_results, baseline_results, arguments.tolerance):
+            sys.exit(1)
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+"""Query the blockchain of a running miner through its query server.
+
+The miner must be started with --query-port. Unlike iterate_db.py and
+get_size.py, this does not need the miner to be stopped first.
+
+Example:
+    ./chain_query.py --port 10002 stats
+    ./chain_query.py --port 10002 block --height 5
+    ./chain_query.py --port 10002 block --hash 3bc42a2e... --no-txs
+    ./chain_query.py --port 10002 tx 50c5e02e...
+    ./chain_query.py --port 10002 range --start 0 --stop 100 --limit 10
+    ./chain_query.py --port 10002 key-txs 9f86d081... --limit 50
+    ./chain_query.py --port 10002 time-blocks --start 1546300800000
+    ./chain_query.py --port 10002 proof 50c5e02e...
+
+The proof is checked against the block hash it was given for before it is
+printed, as a light client would check it. If a query fails its error is
+printed and the exit status is 1.
+
+key-txs and time-blocks need a miner started with --indexes. Pass the
+'next' value of a result as --cursor to get the next page.
+"""
+import argparse
+import json
+import sys
+import proofs
+import query
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments of the query client"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, required=True,
+                        help='query port of the miner')
+    queries = parser.add_subparsers(dest='op', required=True)
+    queries.add_parser('stats', help='height and hash of the last block')
+    block = queries.add_parser('block', help='a block by hash or height')
+    block_id = block.add_mutually_exclusive_group(required=True)
+    block_id.add_argument('--hash')
+    block_id.add_argument('--height', type=int)
+    block.add_argument('--no-txs', dest='txs', action='store_false')
+    tx = queries.add_parser('tx', help='a transaction by id')
+    tx.add_argument('tx_id')
+    block_range = queries.add_parser('range', help='blocks in a height range')
+    block_range.add_argument('--start', type=int, default=0)
+    block_range.add_argument('--stop', type=int)
+    block_range.add_argument('--limit', type=int, default=100)
+    block_range.add_argument('--txs', action='store_true')
+    key_txs = queries.add_parser('key-txs',
+                                 help='transactions sent by a public key')
+    key_txs.add_argument('pub_key', help='SHA256 hash of the public key')
+    key_txs.add_argument('--limit', type=int, default=100)
+    key_txs.add_argument('--cursor')
+    time_blocks = queries.add_parser('time-blocks',
+                                     help='blocks created in a time range')
+    time_blocks.add_argument('--start', type=int, default=0,
+                             help='milliseconds since the epoch')
+    time_blocks.add_argument('--stop', type=int)
+    time_blocks.add_argument('--limit', type=int, default=100)
+    time_blocks.add_argument('--cursor')
+    time_blocks.add_argument('--txs', action='store_true')
+    proof = queries.add_parser('proof',
+                               help='merkle inclusion proof of a transaction')
+    proof.add_argument('tx_id')
+    proof.add_argument('--block-hash')
+    args = parser.parse_args(argv)
+    args.op = args.op.replace('-', '_')
+    return args
+
+
+if __name__ == "__main__":
+    arguments = vars(parse_args())
+    client = query.QueryClient(arguments.pop('port'))
+    op = arguments.pop('op')
+    try:
+        result = client.query(op, **{name: value for name, value
+                                     in arguments.items()
+                                     if value is not None})
+    except query.QueryError as error:
+        # A failed query has no result to print, or proof to check
+        print("Query failed:", error, file=sys.stderr)
+        sys.exit(1)
+    finally:
+        client.close()
+    if op == 'proof':
+        result['verified'] = proofs.verify_block_proof(
+            result['tx_id'], result['proof'], result['block_hash'],
+            result['prev_hash'], result['timestamp'])
+    print(json.dumps(result, indent=2))
@@ -0,0 +1,16 @@
+#!/usr/bin/python3
+"""Generate a pool of keys that benchmark nodes can use instead of generating
+their own keys at startup.
+
+Arguments:
+    1. The file to save the key pool to
+    2. The number of keys to generate
+"""
+import sys
+import time
+import keystore
+
+
+start = time.time()
+keystore.create_key_pool(sys.argv[1], int(sys.argv[2]))
+print("Generated", sys.argv[2], "keys in", time.time() - start, "seconds")
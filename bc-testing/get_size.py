@@ -1,28 +1,83 @@
 #!/usr/bin/python3
-"""This module gets the size of the blocks and merkle tree in the blockchain"""
+"""This module gets the size of the blocks and merkle tree in the blockchain
+
+The stored size of the blocks is their size in the database, which is
+smaller than their raw (pickled) size if they were stored compressed. With
+--codecs the first --sample blocks are also compressed with every codec (see
+chaindb) to show the size and time of each, so that the codec can be chosen
+for the disk space and CPU time available.
+
+Example:
+    ./get_size.py
+    ./get_size.py --db /tmp/bench/db --codecs --sample 500
+"""
+import argparse
 import pickle
+import time
 import plyvel
+import chaindb
+
+
+def format_size(size):
+    """Format a number of bytes with the largest prefix below it"""
+    byte_prefix = ["", "K", "M", "G"]
+    prefix_count = 0
+    while size > 1000 and prefix_count < len(byte_prefix) - 1:
+        prefix_count += 1
+        size /= 1000
+    return "{:.2f} {}B".format(size, byte_prefix[prefix_count])
 
 
-db = plyvel.DB("/home/ben/mof-bc")
-size = 0
-block_size = 0
-with db.iterator() as it:
-    for block_hash, pickled_block in it:
-        if block_hash == b'last':
-            continue
-        block = pickle.loads(pickled_block)
+def compare_codecs(samples):
+    """Compress the sample pickles with every codec and print the results"""
+    raw_size = sum(len(sample) for sample in samples)
+    dictionary = chaindb.train_dictionary(samples)
+    dictionaries = {chaindb.DICT_PREFIX + chaindb.dictionary_id(dictionary):
+                    dictionary}
+    print("Codecs on {} blocks ({} raw):".format(len(samples),
+                                                format_size(raw_size)))
+    for codec in sorted(chaindb.CODECS):
+        start = time.time()
+        encoded = [chaindb.encode_block(sample, codec, dictionary)
+                   for sample in samples]
+        encode_time = time.time() - start
+        start = time.time()
+        for data in encoded:
+            chaindb.unpack_block(data, dictionaries)
+        decode_time = time.time() - start
+        size = sum(len(data) for data in encoded)
+        print("  {:10} {:>12} ratio {:5.2f}  encode {:7.3f}s  decode "
+              "{:7.3f}s".format(codec, format_size(size), raw_size / size,
+                                encode_time, decode_time))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db', default=chaindb.DB_PATH)
+    parser.add_argument('--codecs', action='store_true',
+                        help='compare the size and time of every codec')
+    parser.add_argument('--sample', type=int, default=1000,
+                        help='blocks to compare the codecs on')
+    args = parser.parse_args()
+
+    db = plyvel.DB(args.db)
+    size = 0
+    block_size = 0
+    raw_block_size = 0
+    samples = []
+    for block_hash, stored_block in chaindb.iter_blocks(db):
+        pickled_block = chaindb.unpack_block(stored_block, db)
+        block = chaindb.decode_block(stored_block, db)
         m_tree_length = len(pickle.dumps(block.merkle_tree))
         size += m_tree_length
-        block_size += len(pickled_block)
-
-byte_prefix = ["", "K", "M", "G"]
-prefix_count = 0
-while size > 1000:
-    prefix_count += 1
-    size /= 1000
-    block_size /= 1000
-
-magnitude = byte_prefix[prefix_count] + "B"
-print("Tree: ", size, magnitude)
-print("Block: ", block_size, magnitude)
+        block_size += len(stored_block)
+        raw_block_size += len(pickled_block)
+        if args.codecs and len(samples) < args.sample:
+            samples.append(pickled_block)
+    db.close()
+
+    print("Tree: ", format_size(size))
+    print("Block (raw): ", format_size(raw_block_size))
+    print("Block (stored): ", format_size(block_size))
+    if samples:
+        compare_codecs(samples)
@@ -27,52 +27,64 @@ def create_perm_tx(send_node):
     return send_node.create_and_send_tx(input_string, output_string, 'perm')
 
 
-def is_together():
-    """Check if there are 4 command line arguments"""
-    return len(sys.argv) > 4
+def perm_tx_args():
+    """Get the create_tx arguments of a permanent transaction"""
+    return create_random_string(), create_random_string(), 'perm'
 
 
-tx_created = int(sys.argv[1])
-send_type = sys.argv[2]
-sending_node = node.Node()
-if send_type != 'perm':
-    percentage = int(sys.argv[3])
-    cutoff = tx_created * percentage / 100
-if send_type == 'perm':
-    for i in range(1, tx_created + 1):
-        create_perm_tx(sending_node)
-elif send_type == 'temp':
+def temp_tx_args():
+    """Get the create_tx arguments of a temporary transaction"""
+    return (create_random_string(), create_random_string(), 'temp',
+            random.randrange(1, 20))
+
+
+def temp_tx_stream():
+    """Generate the arguments of the transactions sent by the temp type"""
     together = is_together()
     for i in range(1, tx_created + 1):
         if together:
-            if i > cutoff:
-                create_perm_tx(sending_node)
-            else:
-                ttl = random.randrange(1, 20)
-                sending_node.create_and_send_tx(create_random_string(),
-                                                create_random_string(), 'temp', ttl)
+            yield perm_tx_args() if i > cutoff else temp_tx_args()
         else:
-            if i % 100 < percentage:
-                ttl = random.randrange(1, 20)
-                sending_node.create_and_send_tx(create_random_string(),
-                                                create_random_string(), 'temp', ttl)
-            else:
-                create_perm_tx(sending_node)
-elif send_type == 'summ':
+            yield temp_tx_args() if i % 100 < percentage else perm_tx_args()
+
+
+def summ_tx_stream():
+    """Generate the arguments of the transactions sent by the summ type"""
     together = is_together()
     last = 1
     for i in range(1, tx_created + 1):
         if together:
             if i > cutoff:
-                create_perm_tx(sending_node)
+                yield perm_tx_args()
             else:
-                sending_node.create_and_send_tx(str(i), str(i + 1), 'summ')
+                yield str(i), str(i + 1), 'summ'
         else:
             if i % 100 < percentage:
-                sending_node.create_and_send_tx(str(last), str(last+1), 'summ')
+                yield str(last), str(last + 1), 'summ'
                 last += 1
             else:
-                create_perm_tx(sending_node)
+                yield perm_tx_args()
+
+
+def is_together():
+    """Check if there are 4 command line arguments"""
+    return len(sys.argv) > 4
+
+
+tx_created = int(sys.argv[1])
+send_type = sys.argv[2]
+sending_node = node.Node()
+if send_type != 'perm':
+    percentage = int(sys.argv[3])
+    cutoff = tx_created * percentage / 100
+# Permanent, temporary and summarisable transactions are signed in a pool of
+# processes while they are sent
+if send_type == 'perm':
+    sending_node.send_txs(perm_tx_args() for _ in range(tx_created))
+elif send_type == 'temp':
+    sending_node.send_txs(temp_tx_stream())
+elif send_type == 'summ':
+    sending_node.send_txs(summ_tx_stream())
 elif send_type == 'remove':
     frequency = int(sys.argv[4])
     created = []
@@ -0,0 +1,261 @@
+#!/usr/bin/python3
+"""Send transactions from many identities at a target arrival rate.
+
+Unlike large_sender.py, which sends as fast as one node can sign, this is an
+open loop load generator. Each worker process owns some of the identities
+(nodes) and sends transactions at the times given by its arrival schedule,
+whether or not earlier transactions were sent on time. The time every
+transaction was scheduled and sent is recorded, and the achieved rate is
+reported against the target rate so that the point where the miner (or the
+sender) saturates can be found.
+
+Example:
+    ./load_gen.py --identities 100 --workers 4 --rate 500 --duration 60 \\
+        --arrival poisson --mix perm=80,temp=10,remove=10 --key-pool keys.pool
+"""
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import random
+import string
+import time
+import keystore
+import node
+
+TX_TYPES = ('perm', 'temp', 'summ', 'remove', 'summarise')
+LOG_FIELDS = ('worker', 'identity', 'tx_type', 'tx_id', 'scheduled', 'sent')
+
+
+def parse_mix(mix):
+    """Parse a mix such as 'perm=80,temp=20' into a dictionary of weights"""
+    weights = {}
+    for part in mix.split(','):
+        tx_type, weight = part.split('=')
+        if tx_type not in TX_TYPES:
+            raise ValueError("Unknown transaction type " + tx_type)
+        weights[tx_type] = float(weight)
+    return weights
+
+
+def arrival_times(arrival, rate, start, count=None, duration=None,
+                  burst_size=10):
+    """Generate the times transactions should be sent at.
+
+    Arguments:
+        arrival: 'constant', 'poisson' or 'burst'.
+        rate: The average number of transactions per second.
+        start: The time of the first transaction.
+        count: Stop after this many transactions.
+        duration: Stop after this many seconds.
+        burst_size: The number of transactions sent at once for bursts.
+    """
+    sent = 0
+    offset = 0
+    while (count is None or sent < count) and \
+            (duration is None or offset < duration):
+        yield start + offset
+        sent += 1
+        if arrival == 'constant':
+            offset = sent / rate
+        elif arrival == 'poisson':
+            offset += random.expovariate(rate)
+        elif arrival == 'burst':
+            # Send burst_size transactions at the start of every interval
+            offset = (sent // burst_size) * burst_size / rate
+        else:
+            raise ValueError("Unknown arrival process " + arrival)
+
+
+def random_string():
+    """Create a random 2 character string"""
+    return ''.join([random.choice(string.digits) for _ in range(2)])
+
+
+class _Identity:
+    """A node sending transactions and the transactions it has sent"""
+    def __init__(self, key, port):
+        self.node = node.Node(key=key, port=port)
+        self.last = random.randrange(1000000)
+        # Permanent transactions that can still be removed or summarised
+        self.sent = []
+
+    def send(self, tx_type, group_size):
+        """Create and send a transaction of the given type.
+
+        Remove and summarise transactions cover the last group_size permanent
+        transactions sent by this identity. If there are not enough of them
+        a permanent transaction is sent instead. Return the type sent and the
+        transaction id.
+        """
+        if tx_type in ('remove', 'summarise') and len(self.sent) < group_size:
+            tx_type = 'perm'
+        if tx_type == 'perm':
+            tx = self.node.create_tx(str(self.last), str(self.last + 1))
+            self.last += 1
+            self.sent.append(tx)
+        elif tx_type == 'temp':
+            tx = self.node.create_tx(random_string(), random_string(), 'temp',
+                                     random.randrange(1, 20))
+        elif tx_type == 'summ':
+            tx = self.node.create_tx(str(self.last), str(self.last + 1),
+                                     'summ')
+            self.last += 1
+        else:
+            covered = self.sent[-group_size:]
+            self.sent = self.sent[:-group_size]
+            if tx_type == 'remove':
+                tx = self.node.create_remove_tx([t.tx_id for t in covered])
+            else:
+                tx = self.node.create_summarise_tx(covered)
+        self.node.send_tx(tx)
+        return tx_type, tx.tx_id
+
+
+def run_worker(worker, keys, args, start, result_queue):
+    """Send this worker's share of the load and report what was sent"""
+    random.seed(None if args.seed is None else args.seed + worker)
+    identities = [_Identity(key, args.port) for key in keys]
+    weights = parse_mix(args.mix)
+    tx_types = list(weights)
+    type_weights = [weights[tx_type] for tx_type in tx_types]
+    rate = args.rate / args.workers
+    count = None
+    if args.count is not None:
+        # Spread the remainder over the first workers
+        count = args.count // args.workers + \
+            (1 if worker < args.count % args.workers else 0)
+    counts = {}
+    lateness = []
+    log_path = '{}.{}'.format(args.log, worker) if args.log else None
+    log_file = open(log_path, 'w', newline='') if log_path else None
+    log = csv.writer(log_file) if log_file else None
+    for sent, scheduled in enumerate(arrival_times(
+            args.arrival, rate, start, count, args.duration, args.burst_size)):
+        wait_time = scheduled - time.time()
+        if wait_time > 0:
+            time.sleep(wait_time)
+        identity_index = sent % len(identities)
+        tx_type = random.choices(tx_types, type_weights)[0]
+        tx_type, tx_id = identities[identity_index].send(tx_type,
+                                                         args.group_size)
+        sent_time = time.time()
+        lateness.append(sent_time - scheduled)
+        counts[tx_type] = counts.get(tx_type, 0) + 1
+        if log:
+            log.writerow((worker, identity_index, tx_type, tx_id, scheduled,
+                          sent_time))
+    end = time.time()
+    dropped = sum(len(identity.node.dropped_txs) for identity in identities)
+    for identity in identities:
+        identity.node.close()
+    if log_file:
+        log_file.close()
+    lateness.sort()
+    result_queue.put({'worker': worker, 'counts': counts, 'end': end,
+                      'dropped': dropped, 'sent': len(lateness),
+                      'max_lateness': lateness[-1] if lateness else 0,
+                      'median_lateness':
+                          lateness[len(lateness) // 2] if lateness else 0})
+
+
+def merge_logs(path, num_workers):
+    """Merge the transaction logs of the workers into one file"""
+    with open(path, 'w', newline='') as log_file:
+        log = csv.writer(log_file)
+        log.writerow(LOG_FIELDS)
+        for worker in range(num_workers):
+            worker_path = '{}.{}'.format(path, worker)
+            with open(worker_path, newline='') as worker_file:
+                for row in csv.reader(worker_file):
+                    log.writerow(row)
+            os.remove(worker_path)
+
+
+def get_keys(args):
+    """Get an exported key for every identity, from the key pool if given"""
+    if args.key_pool:
+        keys = keystore.load_key_pool(args.key_pool)
+        if len(keys) < args.identities:
+            raise ValueError("The key pool has fewer keys than identities")
+        return keys[:args.identities]
+    return [keystore.load_or_create_key().exportKey('PEM')
+            for _ in range(args.identities)]
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments of the load generator"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--identities', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--rate', type=float, required=True,
+                        help='target transactions per second over all workers')
+    parser.add_argument('--count', type=int,
+                        help='total number of transactions to send')
+    parser.add_argument('--duration', type=float,
+                        help='number of seconds to send for')
+    parser.add_argument('--arrival', default='constant',
+                        choices=('constant', 'poisson', 'burst'))
+    parser.add_argument('--burst-size', type=int, default=10)
+    parser.add_argument('--mix', default='perm=100',
+                        help='transaction type weights, e.g. perm=90,temp=10')
+    parser.add_argument('--group-size', type=int, default=5,
+                        help='transactions covered by remove and summarise')
+    parser.add_argument('--key-pool', help='key pool made by gen_keys.py')
+    parser.add_argument('--log', help='file to record every transaction sent')
+    parser.add_argument('--report', help='file to write the JSON report to')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--port', type=int, default=10000,
+                        help='port of the miner')
+    args = parser.parse_args(argv)
+    if args.count is None and args.duration is None:
+        parser.error('one of --count or --duration is required')
+    if args.identities < args.workers:
+        parser.error('there must be at least one identity per worker')
+    return args
+
+
+def run(args):
+    """Run the load generator and return its report"""
+    keys = get_keys(args)
+    result_queue = multiprocessing.Queue()
+    # Give the workers time to connect their identities before sending
+    start = time.time() + 1 + 0.01 * args.identities / args.workers
+    workers = []
+    for worker in range(args.workers):
+        worker_keys = keys[worker::args.workers]
+        process = multiprocessing.Process(target=run_worker,
+                                          args=(worker, worker_keys, args,
+                                                start, result_queue))
+        process.start()
+        workers.append(process)
+    results = [result_queue.get() for _ in workers]
+    for process in workers:
+        process.join()
+    if args.log:
+        merge_logs(args.log, args.workers)
+    sent = sum(result['sent'] for result in results)
+    counts = {}
+    for result in results:
+        for tx_type, count in result['counts'].items():
+            counts[tx_type] = counts.get(tx_type, 0) + count
+    elapsed = max(result['end'] for result in results) - start
+    return {'target_rate': args.rate, 'arrival': args.arrival,
+            'start': start, 'sent': sent, 'elapsed': elapsed,
+            'achieved_rate': sent / elapsed if elapsed > 0 else 0,
+            'counts': counts,
+            'dropped': sum(result['dropped'] for result in results),
+            'max_lateness': max(result['max_lateness'] for result in results),
+            # The median time transactions were sent late by the slowest worker
+            'worst_median_lateness': max(result['median_lateness']
+                                         for result in results)}
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    report = run(arguments)
+    print(json.dumps(report, indent=2))
+    if arguments.report:
+        with open(arguments.report, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
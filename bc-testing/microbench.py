@@ -0,0 +1,288 @@
+#!/usr/bin/python3
+"""Microbenchmarks of the data structures and functions the miner relies on.
+
+Each benchmark times one operation (building a block merkle tree, removing
+transactions from one, signing a transaction, etc.) in isolation, without
+starting a miner or sending anything over a socket. Operations that change
+their input, such as removing transactions from a merkle tree, are given a
+fresh input for every call, which is prepared before the timing starts.
+
+Every benchmark is calibrated so that a sample takes at least --min-time
+seconds, then --warmup samples are discarded and --repeat samples are
+timed. The time per call of every sample is summarised (min, median, mean,
+standard deviation) and written as JSON, and can be compared against the
+results of an earlier run to find regressions.
+
+Example:
+    ./microbench.py --output micro.json
+    ./microbench.py --filter merkle --sizes 100 1000 --baseline micro.json
+"""
+import argparse
+import json
+import pickle
+import random
+import statistics
+import sys
+import time
+from Crypto.Signature import PKCS1_v1_5
+import block
+import keystore
+import miner
+import node
+import summarise
+import transaction
+
+# The number of transactions used by benchmarks that depend on a size
+SIZES = (10, 100, 1000)
+
+
+def _make_node():
+    """Create a node that is not connected to a miner, for signing"""
+    signing_node = node.Node.__new__(node.Node)
+    signing_node.key = keystore.load_or_create_key()
+    signing_node.pub_key = signing_node.key.publickey().exportKey('PEM')
+    signing_node.signer = PKCS1_v1_5.new(signing_node.key)
+    signing_node.hash_pub_key()
+    signing_node.last_tx = 'first'
+    signing_node.gvs = 'password'
+    return signing_node
+
+
+def _make_miner(signing_node):
+    """Create a miner without a database or socket that knows a node's key"""
+    verifying_miner = miner.Miner.__new__(miner.Miner)
+    verifying_miner.key_hash_map = {
+        signing_node.key_hash.decode('utf-8'): signing_node.pub_key}
+    return verifying_miner
+
+
+def _make_txs(num_txs, tx_type='perm'):
+    """Create a chain of unsigned transactions with chained inputs/outputs"""
+    txs = []
+    prev_id = 'first'
+    for i in range(num_txs):
+        tx = transaction.Transaction(prev_id, str(i), str(i + 1), b'0' * 64,
+                                     tx_type)
+        prev_id = tx.tx_id
+        txs.append(tx)
+    return txs
+
+
+def _remove_leaves(tree, fraction):
+    """Remove the transactions of some leaves without cleaning the tree"""
+    leaves = []
+    to_visit = [tree.root]
+    for tree_node in to_visit:
+        if tree_node.has_children():
+            if tree_node.child_is_tx():
+                leaves.append(tree_node)
+            else:
+                to_visit.extend(tree_node.children)
+    for leaf in random.sample(leaves, int(len(leaves) * fraction)):
+        leaf.remove_children()
+    return tree
+
+
+def bench_merkle_build(size):
+    """Build the merkle tree of a block"""
+    txs = _make_txs(size)
+    return lambda: txs, block._MerkleTree
+
+
+def bench_merkle_get_txs(size):
+    """Get the transactions of a merkle tree"""
+    tree = block._MerkleTree(_make_txs(size))
+    return lambda: tree, block._MerkleTree.get_txs
+
+
+def bench_merkle_remove_txs(size):
+    """Remove 10% of the transactions of a merkle tree"""
+    txs = _make_txs(size)
+
+    def prepare():
+        removed = random.sample(txs, max(1, size // 10))
+        return block._MerkleTree(txs), [tx.tx_id for tx in removed]
+    return prepare, lambda args: args[0].remove_txs(args[1])
+
+
+def bench_merkle_clean_tree(size):
+    """Clean a merkle tree that has had half of its transactions removed"""
+    txs = _make_txs(size)
+    return (lambda: _remove_leaves(block._MerkleTree(txs), 0.5),
+            block._MerkleTree.clean_tree)
+
+
+def bench_get_tx_merkle(size):
+    """Build the merkle tree of transaction ids in a remove transaction"""
+    tx_ids = [tx.tx_id for tx in _make_txs(size)]
+    return lambda: tx_ids, summarise.get_tx_merkle
+
+
+def bench_get_summary(size):
+    """Summarise the inputs and outputs of a chain of transactions"""
+    txs = _make_txs(size, 'summ')
+    return lambda: txs, summarise.get_summary
+
+
+def bench_get_order(size):
+    """Get the order of a chain of transactions given out of order"""
+    txs = _make_txs(size, 'summ')
+    random.shuffle(txs)
+    return lambda: txs, summarise.get_order
+
+
+def bench_sign_tx(size):
+    """Sign a transaction with a node's key"""
+    signing_node = _make_node()
+    return (lambda: signing_node.build_tx('first', 'in', 'out'),
+            signing_node.sign_tx)
+
+
+def bench_verify_tx(size):
+    """Verify the signature of a transaction as the miner does"""
+    signing_node = _make_node()
+    verifying_miner = _make_miner(signing_node)
+    tx = signing_node.build_tx('first', 'in', 'out')
+    tx.set_signature(signing_node.sign_tx(tx))
+    return lambda: tx, verifying_miner.verify_tx
+
+
+def bench_verify_gv(size):
+    """Verify the generator verifier of a transaction"""
+    signing_node = _make_node()
+    tx = signing_node.build_tx('first', 'in', 'out')
+    signing_node.calc_encrypted_id(tx)
+    gv = signing_node.calc_gv_key(tx.tx_id)
+    return (lambda: tx,
+            lambda gv_tx: block._MerkleTree.verify_gv(gv_tx, gv))
+
+
+def bench_block_pickle(size):
+    """Pickle a block and unpickle it again, as it is stored and read"""
+    stored_block = block.Block(_make_txs(size))
+    stored_block.calc_and_set_block_hash()
+    return (lambda: stored_block,
+            lambda pickled: pickle.loads(pickle.dumps(pickled)))
+
+
+# The name of every benchmark, the function that sets it up and whether it
+# is run at every size (otherwise it is only run once). Set up functions take
+# the size and return a function that prepares the argument of each call and
+# the function that is timed.
+BENCHMARKS = (
+    ('merkle_build', bench_merkle_build, True),
+    ('merkle_get_txs', bench_merkle_get_txs, True),
+    ('merkle_remove_txs', bench_merkle_remove_txs, True),
+    ('merkle_clean_tree', bench_merkle_clean_tree, True),
+    ('get_tx_merkle', bench_get_tx_merkle, True),
+    ('get_summary', bench_get_summary, True),
+    ('get_order', bench_get_order, True),
+    ('sign_tx', bench_sign_tx, False),
+    ('verify_tx', bench_verify_tx, False),
+    ('verify_gv', bench_verify_gv, False),
+    ('block_pickle', bench_block_pickle, True),
+)
+
+
+def time_calls(prepare, run, number):
+    """Time number calls of run with prepared arguments"""
+    args = [prepare() for _ in range(number)]
+    start = time.perf_counter()
+    for arg in args:
+        run(arg)
+    return time.perf_counter() - start
+
+
+def measure(prepare, run, warmup, repeat, min_time):
+    """Calibrate, warm up and time a benchmark.
+
+    Returns the statistics of the time per call in seconds.
+    """
+    number = 1
+    while time_calls(prepare, run, number) < min_time and number < 1 << 20:
+        number *= 2
+    for _ in range(warmup):
+        time_calls(prepare, run, number)
+    samples = [time_calls(prepare, run, number) / number
+               for _ in range(repeat)]
+    return {'number': number, 'repeat': repeat,
+            'min': min(samples), 'median': statistics.median(samples),
+            'mean': statistics.mean(samples),
+            'stdev': statistics.stdev(samples) if repeat > 1 else 0}
+
+
+def run_benchmarks(args):
+    """Run the selected benchmarks and return their results"""
+    results = []
+    for name, set_up, sized in BENCHMARKS:
+        if args.filter and not any(part in name for part in args.filter):
+            continue
+        sizes = args.sizes if sized else [None]
+        for size in sizes:
+            random.seed(args.seed)
+            prepare, run = set_up(size)
+            result = {'name': name, 'size': size}
+            result.update(measure(prepare, run, args.warmup, args.repeat,
+                                  args.min_time))
+            print("{:<18} {:>6} {:>12.2f}us  (+/- {:.2f}us, n={})".format(
+                name, size or '', result['median'] * 1e6,
+                result['stdev'] * 1e6, result['number']), file=sys.stderr)
+            results.append(result)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the change in median time from the baseline of each benchmark.
+
+    Returns the (name, size) tuples of benchmarks that are slower than the
+    baseline by more than the tolerance (a fraction).
+    """
+    old_medians = {(result['name'], result['size']): result['median']
+                   for result in baseline}
+    regressions = []
+    for result in results:
+        key = (result['name'], result['size'])
+        if key not in old_medians:
+            continue
+        old = old_medians[key]
+        change = (result['median'] - old) / old if old else 0
+        slower = change > tolerance
+        if slower:
+            regressions.append(key)
+        print("{:<18} {:>6} {:>12.2f}us -> {:>12.2f}us {:+7.1%}{}".format(
+            result['name'], result['size'] or '', old * 1e6,
+            result['median'] * 1e6, change, '  REGRESSION' if slower else ''))
+    return regressions
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments of the microbenchmarks"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--filter', nargs='+',
+                        help='only run benchmarks with names containing these')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES))
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05,
+                        help='the shortest time in seconds of a sample')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to write the JSON results to')
+    parser.add_argument('--baseline', help='results of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='fractional slow down counted as a regression')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    all_results = run_benchmarks(arguments)
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(all_results, output_file, indent=2)
+    else:
+        print(json.dumps(all_results, indent=2))
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline_file:
+            baseline_results = json.load(baseline_file)
+        if compare(all_results, baseline_results, arguments.tolerance):
+            sys.exit(1)
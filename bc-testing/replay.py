@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+"""Replay the traffic captured by a miner so it can be sent again.
+
+A miner started with --capture-file records the public keys and the signed
+transaction frames it receives. This sends them to a miner again, so that
+changes to the miner can be compared on exactly the same input without the
+cost of creating and signing transactions in the benchmark.
+
+Frames are sent at the speed they were recorded at, a multiple of it or as
+fast as possible. By default every recorded connection is replayed on its
+own connection. With --connections the recorded connections are spread over
+that many connections instead. Every connection is opened before the first
+frame is sent. Replaying faster than recorded is likely to hit the rate
+limits of the miner unless it is started with higher --key-rate and
+--conn-rate limits.
+
+Example:
+    ./miner.py --capture-file run.capture
+    ./replay.py run.capture --speed max --port 10001
+    ./replay.py run.capture --speed 2 --connections 4 --port 10001
+"""
+import argparse
+import json
+import pickle
+import socket
+import threading
+import time
+import capture
+import messages
+
+# The most frames sent on a connection at once
+BATCH_SIZE = 256
+
+
+def parse_speed(speed):
+    """Parse a speed: 'recorded', 'max' or a multiple of the recorded speed.
+
+    Returns the multiple, which is 0 for 'max'.
+    """
+    if speed == 'recorded':
+        return 1.0
+    if speed == 'max':
+        return 0.0
+    multiple = float(speed)
+    if multiple <= 0:
+        raise argparse.ArgumentTypeError("speed must be greater than 0")
+    return multiple
+
+
+def encode_key(key):
+    """Encode a public key as a node sends it when it connects"""
+    return str(len(key)).zfill(4).encode('utf-8') + key
+
+
+def load_capture(path, num_connections=None):
+    """Read a capture and split its frames into the connections to send on.
+
+    Arguments:
+        path: The capture file written by the miner.
+        num_connections: The number of connections to replay the recorded
+                         connections on (default one for each).
+
+    Returns a list of the public key of every replayed connection, a list of
+    the other keys that must be registered with the miner and a list of
+    every replayed connection's (time, frame bytes) tuples in time order.
+    """
+    keys = {}
+    frames = {}
+    for record_time, conn_id, kind, payload in capture.read_records(path):
+        if kind == capture.KEY:
+            keys[conn_id] = payload
+        elif kind == capture.FRAME:
+            frames.setdefault(conn_id, []).append(
+                (record_time, messages.encode_pickled(payload)))
+    recorded = sorted(set(keys) | set(frames))
+    if not recorded:
+        raise ValueError("The capture has no connections")
+    num_connections = num_connections or len(recorded)
+    conn_keys = [None] * num_connections
+    extra_keys = []
+    schedules = [[] for _ in range(num_connections)]
+    for index, conn_id in enumerate(recorded):
+        replayed = index % num_connections
+        schedules[replayed].extend(frames.get(conn_id, []))
+        if conn_id not in keys:
+            continue
+        if conn_keys[replayed] is None:
+            conn_keys[replayed] = keys[conn_id]
+        else:
+            extra_keys.append(keys[conn_id])
+    # Connections whose recorded connections sent no key still need one
+    any_key = next(key for key in conn_keys + extra_keys if key is not None)
+    conn_keys = [key or any_key for key in conn_keys]
+    for schedule in schedules:
+        schedule.sort(key=lambda scheduled: scheduled[0])
+    return conn_keys, extra_keys, schedules
+
+
+class _Connection:
+    """A connection to the miner that frames are replayed on"""
+    def __init__(self, port, key):
+        self.sock = socket.socket()
+        self.sock.connect(('localhost', port))
+        self.sock.sendall(encode_key(key))
+        # Messages received from the miner (e.g. throttles) by type
+        self.msg_counts = {}
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self.max_lateness = 0
+        self.msg_thread = threading.Thread(target=self.__receive, daemon=True)
+        self.msg_thread.start()
+
+    def __receive(self):
+        """Count the messages the miner sends back until the socket closes"""
+        while True:
+            try:
+                data = messages.recv_frame(self.sock)
+            except OSError:
+                return
+            if data is None:
+                return
+            msg_type = pickle.loads(data).get('type')
+            self.msg_counts[msg_type] = self.msg_counts.get(msg_type, 0) + 1
+
+    def send(self, schedule, start, speed):
+        """Send the frames of a schedule relative to a start time.
+
+        Frames that are due at the same time are sent together, up to
+        BATCH_SIZE at once. With a speed of 0 frames are not waited for.
+        """
+        i = 0
+        while i < len(schedule):
+            end = min(len(schedule), i + BATCH_SIZE)
+            if speed:
+                due_time = start + schedule[i][0] / speed
+                wait_time = due_time - time.time()
+                if wait_time > 0:
+                    time.sleep(wait_time)
+                self.max_lateness = max(self.max_lateness,
+                                        time.time() - due_time)
+                # Only send the frames that are already due with this one
+                offset = (time.time() - start) * speed
+                due = i + 1
+                while due < end and schedule[due][0] <= offset:
+                    due += 1
+                end = due
+            data = b''.join(frame for _, frame in schedule[i:end])
+            self.sock.sendall(data)
+            self.frames_sent += end - i
+            self.bytes_sent += len(data)
+            i = end
+
+    def close(self):
+        """Close the connection"""
+        self.sock.close()
+
+
+def register_keys(port, keys):
+    """Send keys to the miner on connections that are closed straight away"""
+    for key in keys:
+        sock = socket.socket()
+        sock.connect(('localhost', port))
+        sock.sendall(encode_key(key))
+        sock.close()
+
+
+def run(args):
+    """Replay a capture and return a report of what was sent"""
+    conn_keys, extra_keys, schedules = load_capture(args.capture,
+                                                    args.connections)
+    # The miner accepts connections one at a time, in the order they were
+    # made, and reads a connection's key before reading anything else. Keys
+    # registered first are therefore known before any frame is read.
+    register_keys(args.port, extra_keys)
+    connections = [_Connection(args.port, key) for key in conn_keys]
+    start = time.time()
+    threads = [threading.Thread(target=conn.send,
+                                args=(schedule, start, args.speed))
+               for conn, schedule in zip(connections, schedules)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    # Give the miner time to send back messages about the last frames
+    time.sleep(args.linger)
+    for conn in connections:
+        conn.close()
+    sent = sum(conn.frames_sent for conn in connections)
+    msg_counts = {}
+    for conn in connections:
+        for msg_type, count in conn.msg_counts.items():
+            msg_counts[msg_type] = msg_counts.get(msg_type, 0) + count
+    recorded = max((schedule[-1][0] for schedule in schedules if schedule),
+                   default=0)
+    return {'capture': args.capture, 'speed': args.speed or 'max',
+            'connections': len(connections), 'start': start, 'sent': sent,
+            'bytes': sum(conn.bytes_sent for conn in connections),
+            'elapsed': elapsed, 'recorded_elapsed': recorded,
+            'achieved_rate': sent / elapsed if elapsed > 0 else 0,
+            'max_lateness': max(conn.max_lateness for conn in connections),
+            'messages': msg_counts}
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments of the replayer"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('capture', help='capture file written by the miner')
+    parser.add_argument('--speed', type=parse_speed, default='recorded',
+                        help="'recorded', 'max' or a multiple such as 2")
+    parser.add_argument('--connections', type=int,
+                        help='connections to send on (default as recorded)')
+    parser.add_argument('--port', type=int, default=10000,
+                        help='port of the miner')
+    parser.add_argument('--linger', type=float, default=1,
+                        help='seconds to wait for messages after sending')
+    parser.add_argument('--report', help='file to write the JSON report to')
+    args = parser.parse_args(argv)
+    if args.connections is not None and args.connections < 1:
+        parser.error('--connections must be at least 1')
+    return args
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    report = run(arguments)
+    print(json.dumps(report, indent=2))
+    if arguments.report:
+        with open(arguments.report, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
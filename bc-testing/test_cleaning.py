@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+"""Test that threaded cleaning periods remove transactions end to end.
+
+A miner is started with its background threads on a simulated clock and a
+new database in a temporary directory. A node sends temporary transactions,
+permanent transactions and a remove transaction covering some of them, and
+the clock is advanced until every temporary transaction has expired. The
+test passes if the expired and removed transactions are gone from the chain,
+the other transactions are still there, the cleaning thread is still running
+and at least one cleaning period has finished.
+
+The exit status is 1 if the test fails.
+
+Example:
+    ./test_cleaning.py
+    ./test_cleaning.py --port 10050
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import chaindb
+import clocks
+import miner
+import node
+
+
+def chain_tx_ids(db):
+    """Get the ids of every transaction stored on the chain"""
+    tx_ids = set()
+    for _, stored_block in chaindb.iter_blocks(db):
+        tx_ids.update(chaindb.decode_block(stored_block, db).get_tx_ids())
+    return tx_ids
+
+
+def run_for(clock, seconds, step):
+    """Advance the clock once the miner's threads are waiting on it"""
+    end = clock.time() + seconds
+    while clock.time() < end:
+        # The block and cleaning threads sleep on the clock between steps
+        if not clock.wait_for_sleepers(2, 10):
+            raise RuntimeError("The miner threads stopped sleeping")
+        clock.advance(step)
+
+
+def run_until(clock, futures, step, timeout=60):
+    """Advance the clock until every future is done.
+
+    Transactions are verified in real time, so a fixed amount of simulated
+    time may pass before they reach the mempool. timeout is in real seconds.
+    """
+    deadline = time.time() + timeout
+    while not all(future.done() for future in futures):
+        if time.time() > deadline:
+            raise RuntimeError("The futures were not done in time")
+        if not clock.wait_for_sleepers(2, 10):
+            raise RuntimeError("The miner threads stopped sleeping")
+        clock.advance(step)
+    for future in futures:
+        # Raise the error of any future that failed
+        future.result()
+
+
+def run(args):
+    """Run the test and return a list of the checks that failed"""
+    clock = clocks.SimulatedClock(1000000.0)
+    test_miner = miner.Miner(max_block_latency=1, min_block_size=5,
+                             port=args.port, clock=clock,
+                             db_path=os.path.join(tempfile.mkdtemp(), 'db'))
+    sender = node.Node(port=args.port, clock=clock)
+    temps = [sender.create_tx('temp{}'.format(i), 'out', 'temp', 30)
+             for i in range(10)]
+    perms = [sender.create_tx('perm{}'.format(i), 'out') for i in range(10)]
+    receipts = [sender.send_tx(tx, track=True) for tx in temps + perms]
+    # Every transaction is in the mempool before the clock is advanced
+    for receipt in receipts:
+        receipt.accepted.result(timeout=10)
+    run_until(clock, [receipt.mined for receipt in receipts], 0.5)
+    removed = perms[:3]
+    remove_tx = sender.create_remove_tx([tx.tx_id for tx in removed])
+    # Remove transactions are only accepted in a cleaning period, so the
+    # clock is advanced until it has been mined
+    run_until(clock, [sender.send_tx(remove_tx, track=True).mined], 1)
+    # Long enough for the temporary transactions to expire and for several
+    # cleaning periods to run
+    run_for(clock, 120, 1)
+    # Give the last cleaning threads time to write their blocks
+    time.sleep(1)
+    tx_ids = chain_tx_ids(test_miner.db)
+    failed = []
+    if any(tx.tx_id in tx_ids for tx in temps):
+        failed.append('expired temporary transactions were not removed')
+    if any(tx.tx_id in tx_ids for tx in removed):
+        failed.append('transactions covered by a remove were not removed')
+    if not all(tx.tx_id in tx_ids for tx in perms[len(removed):]):
+        failed.append('permanent transactions were removed')
+    if not test_miner.cleaning_thread.is_alive():
+        failed.append('the cleaning thread stopped')
+    if not test_miner.interval_controller.get_decisions():
+        failed.append('no cleaning period finished')
+    return failed
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments of the test"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=10040,
+                        help='port to start the test miner on')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    failures = run(parse_args())
+    for failure in failures:
+        print("FAIL:", failure)
+    if not failures:
+        print("PASS")
+    sys.stdout.flush()
+    # The miner threads run until the process exits
+    os._exit(1 if failures else 0)
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+"""Test the query server on a chain written by an older miner.
+
+A block is pickled the way the miner stored blocks before blocks counted
+the transactions they were created with (without a tx_count), and stored
+with its height and index keys in a new database in a temporary directory.
+A query server is started on the database and the block, range and
+time_blocks queries are sent to it. The test passes if every query returns
+the block with the number of transactions in it, and if key_txs and
+time_blocks queries given a cursor outside their range fail.
+
+The exit status is 1 if the test fails.
+
+Example:
+    ./test_query.py
+    ./test_query.py --port 10051
+"""
+import argparse
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import plyvel
+import block
+import chaindb
+import query
+import transaction
+
+
+def get_key_hash(name):
+    """Get a public key hash as it is stored in transactions"""
+    return hashlib.sha256(name).hexdigest().encode('utf-8')
+
+
+def check_cursors(client, old_block):
+    """Return the checks of cursors outside their query's range that failed"""
+    failed = []
+    # A cursor of the transactions of one key used for another key
+    cursor = client.query('key_txs', pub_key=get_key_hash(b'test key').decode(
+        'utf-8'), limit=1)['next']
+    other_key = get_key_hash(b'other key').decode('utf-8')
+    # Blocks created before the start of a time range
+    start = int(old_block.timestamp) + 1
+    queries = (('key_txs', {'pub_key': other_key, 'cursor': cursor}),
+               ('time_blocks', {'start': start, 'cursor': 'ts:'}),
+               ('time_blocks', {'start': start, 'cursor': cursor}))
+    for op, arguments in queries:
+        try:
+            client.query(op, **arguments)
+        except query.QueryError:
+            continue
+        failed.append('{} query accepted the cursor {}'.format(
+            op, arguments['cursor']))
+    return failed
+
+
+def store_old_block(db):
+    """Store a block without a tx_count as the only block of the chain"""
+    key_hash = get_key_hash(b'test key')
+    txs = []
+    prev_id = ''
+    for i in range(3):
+        txs.append(transaction.Transaction(prev_id, 'in{}'.format(i), 'out',
+                                           key_hash, 'perm'))
+        prev_id = txs[-1].tx_id
+    old_block = block.Block(txs)
+    old_block.calc_and_set_block_hash()
+    del old_block.tx_count
+    block_hash = old_block.block_hash.encode('utf-8')
+    with db.write_batch() as batch:
+        batch.put(block_hash, pickle.dumps(old_block))
+        batch.put(chaindb.height_key(0), block_hash)
+        chaindb.index_block(batch, old_block, 0)
+        batch.put(chaindb.INDEXED_KEY, b'1')
+        batch.put(chaindb.LAST_KEY, pickle.dumps((block_hash, 0)))
+    return old_block
+
+
+def run(args):
+    """Run the test and return a list of the checks that failed"""
+    db = plyvel.DB(os.path.join(tempfile.mkdtemp(), 'db'),
+                   create_if_missing=True)
+    old_block = store_old_block(db)
+    server = query.QueryServer(db, args.port)
+    server.start()
+    client = query.QueryClient(args.port)
+    failed = []
+    queries = (('block', {'height': 0}, lambda result: [result]),
+               ('range', {'start': 0}, lambda result: result['blocks']),
+               ('time_blocks', {}, lambda result: result['blocks']))
+    for op, arguments, get_blocks in queries:
+        try:
+            blocks = get_blocks(client.query(op, **arguments))
+        except query.QueryError as error:
+            failed.append('{} query failed: {}'.format(op, error))
+            continue
+        if [found['hash'] for found in blocks] != [old_block.block_hash]:
+            failed.append('{} query did not return the block'.format(op))
+        elif blocks[0]['tx_count'] != 3:
+            failed.append('{} query counted {} transactions'.format(
+                op, blocks[0]['tx_count']))
+    failed.extend(check_cursors(client, old_block))
+    client.close()
+    return failed
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments of the test"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=10051,
+                        help='port to start the query server on')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    failures = run(parse_args())
+    for failure in failures:
+        print("FAIL:", failure)
+    if not failures:
+        print("PASS")
+    sys.stdout.flush()
+    # The query server threads run until the process exits
+    os._exit(1 if failures else 0)
@@ -1,11 +1,13 @@
 #!/usr/bin/python3
 from subprocess import Popen
+import concurrent.futures
 import time
 import node
 import plyvel
 import pickle
 import random
 import string
+import chaindb
 
 
 # Get a random 10 character string
@@ -28,6 +30,10 @@ for _ in range(1):
 
     created = []
     ids = []
+    # The receipts of every transaction sent and the ids of the transactions
+    # that should be removed from the blockchain
+    receipts = []
+    to_be_removed = []
     sending_node = node.Node()
     import random, string
     print('Node sending')
@@ -38,11 +44,12 @@ for _ in range(1):
             #Temporary transactions should be removed from the blockchain so shouldn't exist
             #tx_id = sending_node.create_and_send_tx(get_random_str(), get_random_str(), tx_type="temp", ttl=20)
             tx = sending_node.create_tx(get_random_str(), get_random_str(), tx_type="temp", ttl=20)
-            sending_node.send_tx(tx)
+            receipts.append(sending_node.send_tx(tx, track=True))
             txs_sent[tx.tx_id] = tx
+            to_be_removed.append(tx.tx_id)
         else:
             tx = sending_node.create_tx(get_random_str(), get_random_str(), 'perm')
-            sending_node.send_tx(tx)
+            receipts.append(sending_node.send_tx(tx, track=True))
             saved_txs.append(tx.tx_id)
             txs_sent[tx.tx_id] = tx
     blocks_created += blocks_to_create
@@ -52,8 +59,9 @@ for _ in range(1):
     summ_start = last
     for i in range(1, tx_created+1):
         tx = sending_node.create_tx(str(last), str(last+1), 'summ')
-        sending_node.send_tx(tx)
+        receipts.append(sending_node.send_tx(tx, track=True))
         txs_sent[tx.tx_id] = tx
+        to_be_removed.append(tx.tx_id)
         last += 1
     summ_end = last
     blocks_created += blocks_to_create
@@ -63,12 +71,13 @@ for _ in range(1):
     for i in range(1, tx_created+1):
         tx = sending_node.create_tx(str(last), str(last+1), 'perm')
         created.append(tx)
-        sending_node.send_tx(tx)
+        receipts.append(sending_node.send_tx(tx, track=True))
         txs_sent[tx.tx_id] = tx
+        to_be_removed.append(tx.tx_id)
         last += 1
     #The summarised transaction should exist on the blockchain
     tx = sending_node.create_summarise_tx(created)
-    sending_node.send_tx(tx)
+    receipts.append(sending_node.send_tx(tx, track=True))
     saved_txs.append(tx.tx_id)
     txs_sent[tx.tx_id] = tx
     blocks_created += blocks_to_create
@@ -79,53 +88,59 @@ for _ in range(1):
     for i in range(1, tx_created+1):
         tx = sending_node.create_tx(get_random_str(), get_random_str(), 'perm')
         to_remove_ids.append(tx.tx_id)
-        sending_node.send_tx(tx)
+        to_be_removed.append(tx.tx_id)
+        receipts.append(sending_node.send_tx(tx, track=True))
         txs_sent[tx.tx_id] = tx
     blocks_created += blocks_to_create
     tx = sending_node.create_remove_tx(to_remove_ids)
-    sending_node.send_tx(tx)
+    receipts.append(sending_node.send_tx(tx, track=True))
     saved_txs.append(tx.tx_id)
     txs_sent[tx.tx_id] = tx
 
-    #Pad the transactions so that all the sent transactions will be mined and exist on the blockchain
-    extra_transactions = 3 * blocks_to_create
-    if extra_transactions:
-        for i in range(extra_transactions * 9):
-            tx = sending_node.create_tx(get_random_str(), get_random_str(), 'perm')
-            sending_node.send_tx(tx)
-            saved_txs.append(tx.tx_id)
-            txs_sent[tx.tx_id] = tx
+    #No padding is needed: the miner creates a partially filled block once
+    #the last transactions have waited long enough
     print('Finished sending')
-    sending_node.close()
+    removals = sending_node.subscribe(to_be_removed)
 
-    #Let the miner finish running including it's cleaning periods
-    time.sleep(60)
+    #Wait for the miner to mine every transaction and to remove the ones that
+    #should be removed in it's cleaning periods
     passed = True
+    futures = [receipt.mined for receipt in receipts] + list(removals.values())
+    done, not_done = concurrent.futures.wait(futures, timeout=120)
+    if not_done:
+        print(len(not_done), "transactions were not mined or removed in time")
+        passed = False
+    for future in done:
+        if future.exception():
+            print(future.exception())
+            passed = False
+    sending_node.close()
     summarise_exists = False
     all_txs = []
     #Kill the miner process so other processes can access the blockchain
     Popen(["pkill", "miner"])
     time.sleep(3)
-    db = plyvel.DB("/home/ben/mof-bc")
+    db = plyvel.DB(chaindb.DB_PATH)
     num_blocks = 0
+    #The number of blocks the miner recorded creating
+    last_tuple = pickle.loads(db.get(chaindb.LAST_KEY))
     #Get all the transactions that currently exist on the blockchain
-    with db.iterator() as it:
-        for k, v in it:
-            if k == b'last':
-                continue
-            block = pickle.loads(v)
-            all_txs.extend(block.get_block_txs())
-            #Track how many blocks have been created on the blockchain
-            num_blocks += 1
+    for k, v in chaindb.iter_blocks(db):
+        block = chaindb.decode_block(v, db)
+        all_txs.extend(block.get_block_txs())
+        #Track how many blocks have been created on the blockchain
+        num_blocks += 1
     db.close()
 
     try:
         # Add one because there is a 'root' block
         # The 'last' block is ignored
-        assert(num_blocks == blocks_created + extra_transactions + 1)
+        # Blocks are sealed by size or by time so the number of blocks
+        # depends on timing, but it must match the miner's own count
+        assert(num_blocks == last_tuple[1] + 1)
     except AssertionError:
         print("Existing number of blocks does not equal number of blocks created")
-        print("Expected:", blocks_created + extra_transactions + 1, 'Found:', num_blocks)
+        print("Expected:", last_tuple[1] + 1, 'Found:', num_blocks)
         passed = False
     for tx in all_txs:
         if tx.tx_type == 'summarised' and tx.input == str(summ_start) and tx.output == str(summ_end):
@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+"""Export a blockchain to a chain file or import one into a new database.
+
+Chain files (see chainfile.py) hold the blocks in height order and the keys
+of the nodes, optionally compressed with gzip or lzma. Importing loads the
+stored blocks directly through large write batches, which is much faster
+than sending the transactions to a miner again. The miner must be stopped
+before a chain is exported from its database.
+
+Example:
+    ./transfer_chain.py export chain.bc.xz --compression lzma
+    ./transfer_chain.py import chain.bc.xz --db /tmp/bench/db --indexes
+"""
+import argparse
+import json
+import os
+import time
+import plyvel
+import chainfile
+import chaindb
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments of the chain transfer"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    actions = parser.add_subparsers(dest='action', required=True)
+    export = actions.add_parser('export', help='write a chain file')
+    export.add_argument('path')
+    export.add_argument('--db', default=chaindb.DB_PATH,
+                        help='path of the database to export')
+    export.add_argument('--compression', default='none',
+                        choices=sorted(chainfile.COMPRESSIONS))
+    load = actions.add_parser('import',
+                              help='load a chain file into a new database')
+    load.add_argument('path')
+    load.add_argument('--db', default=chaindb.DB_PATH,
+                      help='path of the new database to import into')
+    load.add_argument('--batch-mb', type=int, default=64,
+                      help='megabytes of records in every write batch')
+    load.add_argument('--indexes', action='store_true',
+                      help='build the secondary indexes while importing')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    start = time.time()
+    if args.action == 'export':
+        db = plyvel.DB(args.db)
+        num_blocks, num_keys = chainfile.export_chain(db, args.path,
+                                                      args.compression)
+    else:
+        db = plyvel.DB(args.db, create_if_missing=True)
+        num_blocks, num_keys = chainfile.import_chain(
+            db, args.path, args.batch_mb * 1024 * 1024, args.indexes)
+    db.close()
+    elapsed = time.time() - start
+    print(json.dumps({'action': args.action, 'path': args.path,
+                      'blocks': num_blocks, 'keys': num_keys,
+                      'file_bytes': os.path.getsize(args.path),
+                      'elapsed': elapsed,
+                      'blocks_per_second': num_blocks / elapsed
+                      if elapsed else 0}, indent=2))
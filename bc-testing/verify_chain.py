@@ -0,0 +1,291 @@
+#!/usr/bin/python3
+"""Verify that a stored blockchain is consistent.
+
+Every block in the database is read once, in key order, and checked by a pool
+of worker processes: the block is decompressed and unpickled, its hash is
+calculated again from its contents and compared with its key and stored
+hash, and with --merkle the hashes of its merkle tree nodes are checked as
+well (trees created before merkle proofs only hash the last child of a node
+and are not checked). Only what links the blocks together is sent back from the workers.
+
+The links are written to a temporary LevelDB database instead of being kept
+in memory, so chains larger than memory can be checked. Once every block has
+been read the chain is walked back from the 'last' pointer to the genesis
+block, checking that:
+    every block's previous block exists (broken links),
+    the number of blocks walked matches the blocks_created count of 'last',
+    the height keys match the heights of the blocks walked,
+    every block is on the chain (orphans) and no block has two children.
+
+The miner must be stopped first, as LevelDB only lets one process open a
+database. The exit status is 1 if any problem is found.
+
+Example:
+    ./verify_chain.py
+    ./verify_chain.py --db /tmp/bench/db --workers 8 --merkle --report out.json
+"""
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import plyvel
+import chaindb
+import proofs
+
+# Keys of the link database. Every block hash is stored under LINK_PREFIX
+# with its previous block hash, the hash of every block with a child under
+# CHILD_PREFIX with its (first) child and every block on the chain under
+# CHAIN_PREFIX.
+LINK_PREFIX = b'l:'
+CHILD_PREFIX = b'c:'
+CHAIN_PREFIX = b'w:'
+# The most blocks marked on the chain before the marks are written
+WALK_BATCH_SIZE = 10000
+
+
+def check_merkle(tree):
+    """Count the nodes of a merkle tree whose hash does not match its children"""
+    if tree.root == 'root' or getattr(tree, 'version', 1) < 2:
+        return 0
+    bad_nodes = 0
+    to_visit = [tree.root]
+    for node in to_visit:
+        if not node.has_children() or node.child_is_tx():
+            continue
+        if node.data != proofs.hash_children([child.data
+                                              for child in node.children]):
+            bad_nodes += 1
+        to_visit.extend(node.children)
+    return bad_nodes
+
+
+def check_blocks(chunk, merkle, records):
+    """Check a chunk of (key, stored block) tuples in a worker process.
+
+    The dictionaries and public key hash identities needed to decode blocks
+    are given as a mapping of their database keys to them, as the workers
+    cannot open the database.
+
+    Returns a (key, previous block hash, problem) tuple for every block.
+    The previous block hash is None if the block could not be decoded.
+    """
+    checked = []
+    for key, stored_block in chunk:
+        try:
+            loaded_block = chaindb.decode_block(stored_block, records)
+        except Exception as error:
+            checked.append((key, None, 'unreadable: {}'.format(error)))
+            continue
+        stored_hash = loaded_block.block_hash
+        loaded_block.calc_and_set_block_hash()
+        problem = None
+        if loaded_block.block_hash != stored_hash:
+            problem = 'hash does not match contents'
+        elif stored_hash.encode('utf-8') != key:
+            problem = 'stored under the wrong key'
+        elif merkle and check_merkle(loaded_block.merkle_tree):
+            problem = 'merkle tree hashes do not match'
+        checked.append((key, loaded_block.prev_block_hash, problem))
+    return checked
+
+
+def read_chunks(db, chunk_bytes):
+    """Read the blocks of a database in chunks of about chunk_bytes bytes"""
+    chunk = []
+    size = 0
+    for key, stored_block in chaindb.iter_blocks(db):
+        chunk.append((key, stored_block))
+        size += len(stored_block)
+        if size >= chunk_bytes:
+            yield chunk, size
+            chunk = []
+            size = 0
+    if chunk:
+        yield chunk, size
+
+
+class _Problems:
+    """The number of every kind of problem and the first examples of each"""
+    def __init__(self, max_examples):
+        self.max_examples = max_examples
+        self.counts = collections.Counter()
+        self.examples = {}
+
+    def add(self, kind, example):
+        """Record a problem"""
+        self.counts[kind] += 1
+        examples = self.examples.setdefault(kind, [])
+        if len(examples) < self.max_examples:
+            examples.append(example)
+
+    def report(self):
+        """Get the problems as a dictionary that can be written as JSON"""
+        return {kind: {'count': count, 'examples': self.examples[kind]}
+                for kind, count in sorted(self.counts.items())}
+
+
+def read_links(db, links, problems, args):
+    """Check every block on the workers and write the links of the chain.
+
+    Returns the number of blocks and bytes read.
+    """
+    num_blocks = 0
+    num_bytes = 0
+    # Chunks sent to the workers that have not been written yet. At most two
+    # per worker are in flight so memory stays bounded on large chains.
+    pending = collections.deque()
+    records = {}
+    for prefix in (chaindb.DICT_PREFIX, chaindb.IDENTITY_ID_PREFIX):
+        with db.iterator(prefix=prefix) as it:
+            records.update(it)
+    with multiprocessing.Pool(args.workers) as pool:
+        chunks = read_chunks(db, args.chunk_bytes)
+        while True:
+            while len(pending) < 2 * args.workers:
+                chunk, size = next(chunks, (None, 0))
+                if chunk is None:
+                    break
+                num_bytes += size
+                pending.append(pool.apply_async(
+                    check_blocks, (chunk, args.merkle, records)))
+            if not pending:
+                break
+            # Children found in this chunk, which are not in the link
+            # database until the batch is written
+            chunk_children = {}
+            with links.write_batch() as batch:
+                for key, prev_hash, problem in pending.popleft().get():
+                    num_blocks += 1
+                    block_hash = key.decode('utf-8')
+                    if problem:
+                        problems.add(problem, block_hash)
+                    if prev_hash is None:
+                        continue
+                    batch.put(LINK_PREFIX + key, prev_hash.encode('utf-8'))
+                    if prev_hash == 'root':
+                        continue
+                    child_key = CHILD_PREFIX + prev_hash.encode('utf-8')
+                    child = chunk_children.get(child_key) or \
+                        links.get(child_key)
+                    if child is not None:
+                        problems.add('fork', [prev_hash, child.decode('utf-8'),
+                                              block_hash])
+                    else:
+                        chunk_children[child_key] = key
+                        batch.put(child_key, key)
+    return num_blocks, num_bytes
+
+
+def walk_chain(db, links, problems):
+    """Walk the chain from the last block to the genesis block.
+
+    Marks every block walked in the link database and checks the height
+    keys. Returns the number of blocks walked.
+    """
+    last = chaindb.get_last(db)
+    if last is None:
+        problems.add('no last pointer', None)
+        return 0
+    block_hash, blocks_created = last
+    height = blocks_created
+    walked = 0
+    batch = links.write_batch()
+    while True:
+        prev_hash = links.get(LINK_PREFIX + block_hash)
+        if prev_hash is None:
+            problems.add('broken link', block_hash.decode('utf-8'))
+            break
+        batch.put(CHAIN_PREFIX + block_hash, b'')
+        walked += 1
+        if walked % WALK_BATCH_SIZE == 0:
+            batch.write()
+            batch = links.write_batch()
+        if height >= 0 and \
+                db.get(chaindb.height_key(height)) != block_hash:
+            problems.add('wrong height key', height)
+        height -= 1
+        if prev_hash == b'root':
+            break
+        if walked > blocks_created:
+            problems.add('chain longer than count', walked)
+            break
+        block_hash = prev_hash
+    batch.write()
+    if walked != blocks_created + 1:
+        problems.add('block count mismatch', {'counted': blocks_created + 1,
+                                              'walked': walked})
+    return walked
+
+
+def find_orphans(links, problems):
+    """Record every block that is not on the chain walked back from last"""
+    orphans = 0
+    with links.iterator(prefix=LINK_PREFIX, include_value=False) as it:
+        for key in it:
+            block_hash = key[len(LINK_PREFIX):]
+            if links.get(CHAIN_PREFIX + block_hash) is None:
+                problems.add('orphan', block_hash.decode('utf-8'))
+                orphans += 1
+    return orphans
+
+
+def run(args):
+    """Verify a chain and return the report"""
+    problems = _Problems(args.max_examples)
+    db = plyvel.DB(args.db)
+    temp_dir = tempfile.mkdtemp(prefix='verify_chain', dir=args.temp_dir)
+    links = plyvel.DB(os.path.join(temp_dir, 'links'), create_if_missing=True)
+    try:
+        start = time.time()
+        num_blocks, num_bytes = read_links(db, links, problems, args)
+        read_time = time.time() - start
+        walked = walk_chain(db, links, problems)
+        find_orphans(links, problems)
+        elapsed = time.time() - start
+    finally:
+        links.close()
+        db.close()
+        shutil.rmtree(temp_dir)
+    return {'db': args.db, 'workers': args.workers, 'blocks': num_blocks,
+            'bytes': num_bytes, 'chain_length': walked,
+            'read_seconds': read_time, 'elapsed': elapsed,
+            'blocks_per_second': num_blocks / read_time if read_time else 0,
+            'mb_per_second': num_bytes / 1e6 / read_time if read_time else 0,
+            'ok': not problems.counts, 'problems': problems.report()}
+
+
+def parse_args(argv=None):
+    """Parse the command line arguments of the verifier"""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--db', default=chaindb.DB_PATH,
+                        help='path of the blockchain database')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='worker processes that check blocks')
+    parser.add_argument('--chunk-bytes', type=int, default=4 * 1024 * 1024,
+                        help='bytes of blocks sent to a worker at once')
+    parser.add_argument('--merkle', action='store_true',
+                        help='check the hashes of merkle tree nodes')
+    parser.add_argument('--temp-dir',
+                        help='directory for the link database')
+    parser.add_argument('--max-examples', type=int, default=10,
+                        help='examples reported of every kind of problem')
+    parser.add_argument('--report', help='file to write the JSON report to')
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    return args
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    report = run(arguments)
+    print(json.dumps(report, indent=2))
+    if arguments.report:
+        with open(arguments.report, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    sys.exit(0 if report['ok'] else 1)